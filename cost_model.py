@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+import utils
+
+
+class TripCostModel(object):
+  """Cumulative distance and weight arrays of a single trip.
+
+  Leg k of a trip with n gifts leads to gift k (leg n leads back to the north pole). With the distance
+  travelled until arriving at each gift and the weight carried on each leg, the cost of inserting a
+  gift can be evaluated for all positions in one O(n) pass and removing a gift costs O(1).
+  """
+
+  def __init__(self, trip, gift_table=None):
+    """
+    :trip: Numpy array with the GiftIds of the trip in order of delivery
+    :gift_table: GiftTable to use (defaults to the global one)
+    """
+    self.gift_table = gift_table if gift_table is not None else utils.get_gift_table()
+    self.trip = np.asarray(trip, dtype=np.int64)
+    self.path = np.concatenate([[utils.NORTH_POLE_ID], self.trip, [utils.NORTH_POLE_ID]])
+    self.weights = self.gift_table.weights[self.trip]
+    self.legs = self.gift_table.trip_leg_distances(self.trip)
+    # arrival[k]: distance travelled when arriving at gift k (arrival[n]: length of the whole trip)
+    self.arrival = np.cumsum(self.legs)
+    # carried[k]: weight carried on leg k, including the sleigh
+    self.carried = utils.remaining_weights(self.weights)
+    self.cost = np.dot(self.legs, self.carried)
+
+  def __len__(self):
+    return len(self.trip)
+
+  def distance_before(self, index):
+    """Distance travelled when arriving at the gift before the index (0 for the first gift)."""
+    return self.arrival[index-1] if index > 0 else 0.0
+
+  def insertion_costs(self, gift):
+    """Calculates the cost of inserting a gift before each of the gifts of the trip.
+    Like before, inserting after the last gift isn't considered.
+
+    :gift: GiftId of the gift to insert
+
+    :returns: Numpy array of length n with the cost of inserting the gift before each index
+    """
+    gift_weight = self.gift_table.weights[gift]
+
+    # the gift is carried until the node before the insertion point
+    distance_to_previous = np.concatenate([[0.0], self.arrival[:-2]])
+    cost_to_carry_gift = distance_to_previous * gift_weight
+
+    # the detour via the gift replaces the leg to the current node
+    distance_from_gift = self.gift_table.one_to_many_distances(gift, self.path[:-1])
+    cum_weight = self.carried[:-1] + gift_weight
+    cost_to_move_here = distance_from_gift[:-1] * cum_weight + distance_from_gift[1:] * (cum_weight - gift_weight)
+    cost_for_old_path = self.legs[:-1] * (cum_weight - gift_weight)
+
+    return cost_to_carry_gift + cost_to_move_here - cost_for_old_path
+
+  def best_insertion(self, gift, index_to_be_removed=None):
+    """Finds the cheapest position to insert a gift.
+
+    :gift: GiftId of the gift to insert
+    :index_to_be_removed: Index of a gift that is about to be removed (insertion next to it is skipped)
+
+    :returns: Tuple with the index to insert the gift before and the cost of the insertion
+    """
+    if len(self.trip) == 0:
+      return None, np.finfo(np.float64).max
+
+    costs = self.insertion_costs(gift)
+    if index_to_be_removed is not None:
+      # don't compute insertion where we're about to remove
+      costs[[i for i in (index_to_be_removed-1, index_to_be_removed) if 0 <= i < len(costs)]] = np.inf
+
+    best_index = int(np.argmin(costs))
+    if np.isinf(costs[best_index]):
+      return None, np.finfo(np.float64).max
+    return best_index, costs[best_index]
+
+  def removal_cost(self, index):
+    """Calculates the (usually negative) cost of removing a gift.
+
+    :index: Index of the gift to remove
+
+    :returns: The cost of the removal
+    """
+    gift_weight = self.weights[index]
+    cum_weight = self.carried[index]
+
+    # the gift is no longer carried until the node before it
+    cost_to_not_carry_gift = self.distance_before(index) * -gift_weight
+
+    cost_of_old_tour = self.legs[index] * cum_weight + self.legs[index+1] * (cum_weight - gift_weight)
+    cost_for_new_path = self.gift_table.distance(self.path[index], self.path[index+2]) * (cum_weight - gift_weight)
+
+    return cost_to_not_carry_gift - cost_of_old_tour + cost_for_new_path
+
+  def _swap_costs(self, first, second, distance):
+    """Calculates the cost of swapping pairs of gifts.
+
+    :first: Numpy array with indexes of gifts
+    :second: Numpy array with indexes of gifts (broadcastable against first)
+    :distance: Function that returns the distances between two arrays of indexes into the path
+
+    :returns: Numpy array with the cost of each swap (inf for swapping a gift with itself)
+    """
+    i = np.minimum(first, second)
+    j = np.maximum(first, second)
+    legs = self.legs
+    carried = self.carried
+    # the weight carried on the legs after i up to j changes by the difference of the two gifts
+    weight_diff = self.weights[i] - self.weights[j]
+
+    # gift k is at index k+1 of the path
+    to_j = distance(i, j+1) * carried[i]
+    after_j = distance(j+1, i+2) * (carried[i+1] + weight_diff)
+    to_i = distance(j, i+1) * (carried[j] + weight_diff)
+    after_i = distance(i+1, j+2) * carried[j+1]
+    old = legs[i] * carried[i] + legs[i+1] * carried[i+1] + legs[j] * carried[j] + legs[j+1] * carried[j+1]
+    # the legs between the gifts keep their length
+    between = self.arrival[np.maximum(j-1, i+1)] - self.arrival[i+1]
+    costs = to_j + after_j + to_i + after_i - old + between * weight_diff
+
+    # adjacent gifts share the leg between them
+    adjacent = to_j + distance(j+1, i+1) * (carried[i+1] + weight_diff) + after_i - \
+        (legs[i] * carried[i] + legs[i+1] * carried[i+1] + legs[j+1] * carried[j+1])
+    costs = np.where(j == i+1, adjacent, costs)
+    return np.where(i == j, np.inf, costs)
+
+  def swap_costs(self, index):
+    """Calculates the cost of swapping a gift with each gift of the trip in one O(n) pass.
+
+    :index: Index of the gift to swap
+
+    :returns: Numpy array of length n with the cost of swapping the gift with each index (inf for itself)
+    """
+    def distance(a, b):
+      return self.gift_table.distances(self.path[a], self.path[b])
+    return self._swap_costs(np.full(len(self.trip), index), np.arange(len(self.trip)), distance)
+
+  def pair_swap_costs(self, first, second, path_distances=None):
+    """Calculates the cost of swapping the gifts of several pairs of indexes in one pass.
+
+    :first: Numpy array with the indexes of the first gifts
+    :second: Numpy array with the indexes of the second gifts
+    :path_distances: Precalculated `path_distance_matrix` of the trip (optional)
+
+    :returns: Numpy array with the cost of each swap (inf for swapping a gift with itself)
+    """
+    if path_distances is not None:
+      def distance(a, b):
+        return path_distances[a, b]
+    else:
+      def distance(a, b):
+        return self.gift_table.distances(self.path[a], self.path[b])
+    return self._swap_costs(np.asarray(first), np.asarray(second), distance)
+
+  def swap(self, first, second, path_distances=None):
+    """Swaps two gifts and updates the arrays in place, which is cheaper than building a new model.
+    The trip array of the model is changed as well.
+
+    :first: Index of the first gift
+    :second: Index of the second gift
+    :path_distances: `path_distance_matrix` of the trip after the swap (optional)
+    """
+    i = min(first, second)
+    j = max(first, second)
+    # the weight carried on the legs after i up to j changes by the difference of the two gifts
+    self.carried[i+1:j+1] += self.weights[i] - self.weights[j]
+    self.trip[[i, j]] = self.trip[[j, i]]
+    self.path[[i+1, j+1]] = self.path[[j+1, i+1]]
+    self.weights[[i, j]] = self.weights[[j, i]]
+
+    legs = np.unique([i, i+1, j, j+1])
+    if path_distances is not None:
+      self.legs[legs] = path_distances[legs, legs+1]
+    else:
+      self.legs[legs] = self.gift_table.distances(self.path[legs], self.path[legs+1])
+    np.cumsum(self.legs, out=self.arrival)
+    self.cost = np.dot(self.legs, self.carried)
+
+  def path_distance_matrix(self):
+    """Calculates the distances between all nodes of the path (including the north pole at both ends).
+
+    :returns: Numpy array of shape (n+2, n+2), gift k is at index k+1
+    """
+    vectors = self.gift_table.unit_vectors[self.path]
+    return utils.unit_vector_distances(vectors[:, None], vectors[None, :])
+
+  def all_swap_costs(self):
+    """Calculates the cost of swapping every pair of gifts of the trip.
+
+    :returns: Numpy array of shape (n, n) with the cost of swapping the gifts at both indexes (inf on the diagonal)
+    """
+    path_distances = self.path_distance_matrix()
+    def distance(a, b):
+      return path_distances[a, b]
+    indexes = np.arange(len(self.trip))
+    return self._swap_costs(indexes[:, None], indexes[None, :], distance)
+
+  def best_swap(self):
+    """Finds the cheapest swap of two gifts of the trip.
+
+    :returns: Tuple with the indexes of both gifts and the cost of the swap
+    """
+    if len(self.trip) < 2:
+      return None, None, np.finfo(np.float64).max
+    costs = self.all_swap_costs()
+    first, second = np.unravel_index(np.argmin(costs), costs.shape)
+    return int(first), int(second), costs[first, second]
+
+
+def find_best_insertion_into_trips(trips, gift, gift_table=None):
+  """Scores inserting a gift at every position of several trips in a single vectorized pass.
+
+  All trips are laid out back to back (each one preceded by the north pole), so the insertion costs
+  of every position of every trip are computed with a handful of array operations.
+  Like for a single trip, inserting after the last gift of a trip isn't considered.
+
+  :trips: List of Numpy arrays with the GiftIds of the candidate trips
+  :gift: GiftId of the gift to insert
+  :gift_table: GiftTable to use (defaults to the global one)
+
+  :returns: Tuple with the index of the best trip in `trips`, the index to insert the gift before and the cost
+  """
+  gift_table = gift_table if gift_table is not None else utils.get_gift_table()
+  lengths = np.asarray([len(trip) for trip in trips], dtype=np.int64)
+  if lengths.sum() == 0:
+    return None, None, np.finfo(np.float64).max
+  gift_weight = gift_table.weights[gift]
+
+  # layout: [NP, gifts of trip 0, NP, gifts of trip 1, ...]
+  nodes = np.concatenate([np.concatenate([[utils.NORTH_POLE_ID], trip]) for trip in trips]).astype(np.int64)
+  segment_starts = np.concatenate([[0], np.cumsum(lengths + 1)[:-1]])
+  is_start = np.zeros(len(nodes), dtype=bool)
+  is_start[segment_starts] = True
+  is_last = np.roll(is_start, -1)
+  previous_nodes = nodes[~is_last]
+  current_nodes = nodes[~is_start]
+
+  # position of each insertion point within its trip
+  trip_of_position = np.repeat(np.arange(len(trips)), lengths)
+  position_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+  # distance travelled until reaching the node before each insertion point (segmented cumsum)
+  legs = gift_table.distances(previous_nodes, current_nodes)
+  cumulative_legs = np.cumsum(legs)
+  distance_to_current = cumulative_legs - np.concatenate([[0.0], cumulative_legs])[position_starts][trip_of_position]
+  distance_to_previous = distance_to_current - legs
+
+  # weight carried on the leg to the current node (segmented suffix sums)
+  weights = gift_table.weights[current_nodes]
+  cumulative_weights = np.cumsum(weights)
+  trip_weights = np.add.reduceat(weights, position_starts[lengths > 0])
+  all_trip_weights = np.zeros(len(trips))
+  all_trip_weights[lengths > 0] = trip_weights
+  weight_before = cumulative_weights - weights - np.concatenate([[0.0], cumulative_weights])[position_starts][trip_of_position]
+  carried = all_trip_weights[trip_of_position] - weight_before + utils.SLEIGH_WEIGHT
+
+  # the detour via the gift replaces the leg to the current node
+  distance_from_gift = gift_table.one_to_many_distances(gift, nodes)
+  costs = distance_to_previous * gift_weight + \
+      distance_from_gift[~is_last] * (carried + gift_weight) + \
+      distance_from_gift[~is_start] * carried - \
+      legs * carried
+
+  best_position = int(np.argmin(costs))
+  best_trip = int(trip_of_position[best_position])
+  return best_trip, best_position - int(position_starts[best_trip]), costs[best_position]
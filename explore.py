@@ -17,7 +17,7 @@ def plot_weights():
   plt.show()
 
 def load_solution(file_name):
-  return pd.read_csv(file_name).merge(gifts, on="GiftId")
+  return utils.read_solution(file_name).merge(gifts, on="GiftId")
 
 def prepare_and_show_trip_plot():
   plt.colorbar()
@@ -31,7 +31,7 @@ def prepare_and_show_trip_plot():
   plt.show()
 
 def plot_trips(solution_file):
-  trips = pd.read_csv(solution_file).merge(gifts, on="GiftId")
+  trips = utils.read_solution(solution_file).merge(gifts, on="GiftId")
   fig = plt.figure()
   for t in trips.TripId.unique():
     if t % 100 == 0:
@@ -43,7 +43,7 @@ def plot_trips(solution_file):
   prepare_and_show_trip_plot()
 
 def plot_trip(solution_file, t=None):
-  trips = pd.read_csv(solution_file).merge(gifts, on="GiftId")
+  trips = utils.read_solution(solution_file).merge(gifts, on="GiftId")
   fig = plt.figure()
   if t is None:
     trip_ids = trips.TripId.unique()
@@ -57,7 +57,7 @@ def plot_trip(solution_file, t=None):
 
 def print_stats(file_name=None, df=None, plots=False):
   if file_name is not None:
-    df = pd.read_csv(file_name).merge(gifts, on="GiftId")
+    df = utils.read_solution(file_name).merge(gifts, on="GiftId")
   if df is None:
     print("Need to specify either file name or df")
 
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+import utils
+
+
+class WeightedTour(object):
+  """Cumulative arrays of a single trip that give the cost change of 2-opt and Or-opt moves in O(1).
+
+  The path of a trip with n gifts has the nodes 0..n+1 (node k+1 is gift k, nodes 0 and n+1 are the north pole)
+  and the edges 0..n (edge e leads from node e to node e+1). With prefix sums over the edge lengths and over
+  the edge lengths multiplied by the weight carried on them or by the weight delivered until then, the cost
+  of any reversed or relocated segment only needs a few lookups - even though the weight carried on every
+  edge of a reversed segment changes.
+  All move functions accept Numpy arrays as well as single indexes, so many moves can be scored at once.
+  """
+
+  def __init__(self, trip, gift_table=None):
+    """
+    :trip: Numpy array with the GiftIds of the trip in order of delivery
+    :gift_table: GiftTable to use (defaults to the global one)
+    """
+    self.gift_table = gift_table if gift_table is not None else utils.get_gift_table()
+    self.trip = np.asarray(trip, dtype=np.int64)
+    self.nodes = np.concatenate([[utils.NORTH_POLE_ID], self.trip, [utils.NORTH_POLE_ID]])
+    self.vectors = self.gift_table.unit_vectors[self.nodes]
+
+    # edges[e]: length of edge e
+    self.edges = utils.unit_vector_distances(self.vectors[:-1], self.vectors[1:])
+    # delivered[k]: weight of the gifts at the nodes up to k
+    self.delivered = np.cumsum(self.gift_table.weights[self.nodes])
+    # carried[e]: weight carried on edge e, including the sleigh
+    self.carried = self.delivered[-1] - self.delivered + utils.SLEIGH_WEIGHT
+
+    # prefix sums over the edges before node k
+    self.distance_until = np.concatenate([[0.0], np.cumsum(self.edges)])
+    self.cost_until = np.concatenate([[0.0], np.cumsum(self.edges * self.carried[:-1])])
+    self.delivered_distance_until = np.concatenate([[0.0], np.cumsum(self.edges * self.delivered[:-1])])
+    self.cost = self.cost_until[-1]
+
+  def __len__(self):
+    return len(self.trip)
+
+  def distance(self, a, b):
+    """Distances between nodes of the path (not gifts)."""
+    return utils.unit_vector_distances(self.vectors[a], self.vectors[b])
+
+  def _segment_cost(self, a, b, carried_after, reverse):
+    """Cost of the edges within the nodes a..b, if the segment is followed by `carried_after` weight."""
+    length = self.distance_until[b] - self.distance_until[a]
+    if reverse:
+      # travelling from b to a, the edge between x+1 and x carries the gifts at the nodes a..x
+      return (carried_after - self.delivered[a-1]) * length + \
+          self.delivered_distance_until[b] - self.delivered_distance_until[a]
+    # travelling from a to b, the edge between x and x+1 carries the gifts at the nodes x+1..b
+    return (carried_after + self.delivered[b]) * length - \
+        (self.delivered_distance_until[b] - self.delivered_distance_until[a])
+
+  def two_opt_delta(self, first, last):
+    """Calculates the cost of reversing the gifts first..last of the trip.
+
+    :first: Index of the first gift of the segment
+    :last: Index of the last gift of the segment (> first)
+
+    :returns: The cost of the move
+    """
+    a = np.asarray(first) + 1
+    b = np.asarray(last) + 1
+    old = self.edges[a-1] * self.carried[a-1] + self.edges[b] * self.carried[b] + \
+        self.cost_until[b] - self.cost_until[a]
+    new = self.distance(a-1, b) * self.carried[a-1] + self.distance(a, b+1) * self.carried[b] + \
+        self._segment_cost(a, b, self.carried[b], True)
+    return new - old
+
+  def or_opt_delta(self, first, length, position, reverse=False):
+    """Calculates the cost of moving the gifts first..first+length-1 of the trip somewhere else in the trip.
+
+    :first: Index of the first gift of the segment
+    :length: Number of gifts in the segment
+    :position: Index of the gift to insert the segment before (len(trip) to insert it at the end),
+    must not be within the segment or right after it
+    :reverse: Whether the segment is inserted in reverse order
+
+    :returns: The cost of the move
+    """
+    a = np.asarray(first) + 1
+    b = a + length - 1
+    c = np.asarray(position) # the segment is inserted between the nodes c and c+1
+    forward = c > b
+    segment_weight = self.delivered[b] - self.delivered[a-1]
+
+    # the gifts between the old and the new place of the segment are delivered before/after it now
+    between = np.where(forward,
+        segment_weight * (self.distance_until[np.maximum(c, b+1)] - self.distance_until[b+1]),
+        -segment_weight * (self.distance_until[np.maximum(a-1, c+1)] - self.distance_until[c+1]))
+    # weight carried after the segment in the new place
+    carried_after = np.where(forward, self.carried[c], self.carried[c] - segment_weight)
+    entry, exit = (b, a) if reverse else (a, b)
+
+    old = self.edges[a-1] * self.carried[a-1] + self.edges[b] * self.carried[b] + self.edges[c] * self.carried[c] + \
+        self._segment_cost(a, b, self.carried[b], False)
+    new = self.distance(a-1, b+1) * np.where(forward, self.carried[a-1], self.carried[b]) + \
+        self.distance(c, entry) * (carried_after + segment_weight) + \
+        self.distance(exit, c+1) * carried_after + \
+        self._segment_cost(a, b, carried_after, reverse)
+    return new - old + between
+
+  def best_two_opt(self):
+    """Finds the cheapest segment reversal.
+
+    :returns: Tuple with the indexes of the first and last gift of the segment and the cost of the move
+    """
+    if len(self.trip) < 2:
+      return None, None, np.finfo(np.float64).max
+    first, last = np.triu_indices(len(self.trip), 1)
+    costs = self.two_opt_delta(first, last)
+    best = int(np.argmin(costs))
+    return int(first[best]), int(last[best]), costs[best]
+
+  def best_or_opt(self, max_length=3):
+    """Finds the cheapest relocation of a segment of up to `max_length` gifts (in either direction).
+
+    :max_length: Maximum number of gifts in the segment
+
+    :returns: Tuple with the index of the first gift and length of the segment, the index to insert it before,
+    whether it's reversed and the cost of the move
+    """
+    best = (None, None, None, False, np.finfo(np.float64).max)
+    n = len(self.trip)
+    for length in range(1, min(max_length, n - 1) + 1):
+      first, position = np.meshgrid(np.arange(n - length + 1), np.arange(n + 1), indexing="ij")
+      # inserting within or right next to the segment doesn't move it
+      valid = (position < first) | (position > first + length)
+      first = first[valid]
+      position = position[valid]
+      for reverse in [False, True] if length > 1 else [False]:
+        costs = self.or_opt_delta(first, length, position, reverse)
+        index = int(np.argmin(costs))
+        if costs[index] < best[-1]:
+          best = (int(first[index]), length, int(position[index]), reverse, costs[index])
+    return best
+
+
+def two_opt(trip, first, last):
+  """Reverses the gifts first..last of a trip.
+
+  :returns: Numpy array with the new trip
+  """
+  trip = np.array(trip)
+  trip[first:last+1] = trip[first:last+1][::-1]
+  return trip
+
+def or_opt(trip, first, length, position, reverse=False):
+  """Moves the gifts first..first+length-1 of a trip before the gift at `position`.
+
+  :returns: Numpy array with the new trip
+  """
+  segment = trip[first:first+length]
+  if reverse:
+    segment = segment[::-1]
+  if position < first:
+    return np.concatenate([trip[:position], segment, trip[position:first], trip[first+length:]])
+  return np.concatenate([trip[:first], trip[first+length:position], segment, trip[position:]])
+
+def optimize_trip(trip, max_length=3, gift_table=None):
+  """Applies the best 2-opt or Or-opt move until no move improves the trip any more.
+
+  :trip: Numpy array with the GiftIds of the trip in order of delivery
+  :max_length: Maximum number of gifts of segments moved by Or-opt
+  :gift_table: GiftTable to use (defaults to the global one)
+
+  :returns: Tuple with the optimized trip, the (negative) cost change and the number of applied moves
+  """
+  trip = np.asarray(trip)
+  tour = WeightedTour(trip, gift_table)
+  initial_cost = tour.cost
+  moves = 0
+
+  while len(trip) > 2:
+    # ignore "improvements" that are just rounding errors
+    tolerance = -1e-9 * tour.cost
+    first, last, two_opt_cost = tour.best_two_opt()
+    or_opt_move = tour.best_or_opt(max_length)
+
+    if two_opt_cost < min(or_opt_move[-1], tolerance):
+      trip = two_opt(trip, first, last)
+    elif or_opt_move[-1] < tolerance:
+      trip = or_opt(trip, *or_opt_move[:-1])
+    else:
+      break
+    tour = WeightedTour(trip, gift_table)
+    moves += 1
+
+  return trip, tour.cost - initial_cost, moves
@@ -52,7 +52,7 @@ class Method(abc.ABC):
       self.log.warning("More than one matching file found, aborting! ({})".format(matches))
       return
     self.log.info("Using file {} from {} matching files ({})".format(matches[0], len(matches), matches))
-    data = pd.read_csv(matches[0]).merge(self.gifts, on="GiftId")
+    data = utils.read_solution(matches[0])
     self.current_score = utils.weighted_reindeer_weariness(data)
     self.current_trip_count = len(data.TripId.unique())
     return data
@@ -67,9 +67,7 @@ class Method(abc.ABC):
         self.gifts.GiftId.shape[0], self.trips.GiftId.shape[0]))
       return False
 
-    unique_trips = self.trips.TripId.unique()
     merged = self.trips.merge(self.gifts, on="GiftId")
-    trips = [merged[merged.TripId == t] for t in unique_trips]
 
     if not utils.verify_weights(merged, self.log):
       self.log.error("One or more trip is invalid!")
@@ -79,38 +77,34 @@ class Method(abc.ABC):
     return True
 
   def evaluate_trips(self):
-    unique_trips = self.trips.TripId.unique()
-    merged = self.trips.merge(self.gifts, on="GiftId")
-    trips = [merged[merged.TripId == t] for t in unique_trips]
-
-    score = utils.weighted_reindeer_weariness(merged)
-    utils.log_success_or_error(self.log, score < self.current_score, "Cost of the {} trips: {:.5f}B ({:.5f}M with {} trips)".format(
-      unique_trips.shape[0], score / 1e9, (score - self.current_score) / 1e6, self.current_trip_count))
+    score, unique_trips, costs = utils.get_trip_costs(self.trips.GiftId.values, self.trips.TripId.values)
+    trip_index = np.searchsorted(unique_trips, self.trips.TripId.values)
+    if self.current_score is None:
+      # the trips weren't loaded from a file, so there's nothing to compare to
+      self.log.info("Cost of the {} trips: {:.5f}B".format(unique_trips.shape[0], score / 1e9))
+    else:
+      utils.log_success_or_error(self.log, score < self.current_score, "Cost of the {} trips: {:.5f}B ({:.5f}M with {} trips)".format(
+        unique_trips.shape[0], score / 1e9, (score - self.current_score) / 1e6, self.current_trip_count))
     utils.log_success_or_error(self.log, score < self.current_best, "Compared to best: {:.5f}M".format(
       (score - self.current_best) / 1e6))
 
-    weights = np.asarray([trip.Weight.sum() for trip in trips])
+    weights = np.bincount(trip_index, weights=utils.get_gift_table().weights[self.trips.GiftId.values])
     self.log.info("Sleigh utilization: min {:.2f}, max {:.2f}, avg {:.2f}, std {:.2f}".format(
       weights.min(), weights.max(), weights.mean(), weights.std()))
 
-    costs = np.asarray([utils.weighted_trip_length(trip[["Latitude","Longitude"]], trip.Weight) for trip in trips])
     self.log.info("Trip costs: min {:.2f}M, max {:.2f}M, avg {:.2f}M, std {:.2f}k".format(
       costs.min() / 1e6, costs.max() / 1e6, costs.mean() / 1e6, costs.std() / 1e3))
 
-    stops = np.asarray([trip.shape[0] for trip in trips])
+    stops = np.bincount(trip_index)
     self.log.info("Stops per trip: min {}, max {}, avg {:.2f}, std {:.2f}".format(
       stops.min(), stops.max(), stops.mean(), stops.std()))
 
-    cache_info = utils.get_cache_info()
-    self.log.info("Distance cache info: {} ({:.2f}% hits))".format(
-      cache_info, 100.0 * cache_info.hits / (cache_info.hits + cache_info.misses)))
-
   def write_trips(self, file_name):
     """Creates a submission file from the calculated trips
 
-    :file_name: Name of the file to write
+    :file_name: Name of the file to write (a binary .npy file or a CSV file for any other extension)
 
     """
     self.log.debug("Writing trips to {}".format(file_name))
-    self.trips[["GiftId", "TripId"]].astype(int).to_csv(file_name, index=False)
+    utils.write_solution(file_name, self.trips.GiftId.values, self.trips.TripId.values)
 
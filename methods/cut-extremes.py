@@ -1,10 +1,7 @@
 #!/usr/bin/env python
 
-import numpy as np
-import pandas as pd
-
-import utils
 from method import Method
+from solution import Solution
 from neighbors import (OptimalHorizontalTripSplitNeighbor,
     OptimalMoveGiftInTripNeighbor,
                        OptimalVerticalTripSplitNeighbor)
@@ -27,13 +24,13 @@ class CutExtremeTripsMethod(Method):
       return
 
     # split all trips into separate trips
-    trips = [all_trips[all_trips.TripId == t].values for t in all_trips.TripId.unique()]
+    trips = Solution.from_frame(all_trips)
 
     maximum_weight = 900
     maximum_length = 95
     large_trips = []
     for i, trip in enumerate(trips):
-      if trip[:, utils.WEIGHT].sum() > maximum_weight and len(trip) > maximum_length:
+      if trips.weights[i] > maximum_weight and len(trip) > maximum_length:
         large_trips.append(i)
 
     self.log.info("Found {} trips with weight >{} and length >{}".format(len(large_trips), maximum_weight, maximum_length))
@@ -44,7 +41,7 @@ class CutExtremeTripsMethod(Method):
       vertical_split = OptimalVerticalTripSplitNeighbor(trips, large_trip_index)
       neighbor = horizontal_split if horizontal_split.cost_delta() < vertical_split.cost_delta() else vertical_split
       previous_length = len(trips[large_trip_index])
-      previous_weight = trips[large_trip_index][:, utils.WEIGHT].sum()
+      previous_weight = trips.weights[large_trip_index]
       neighbor.apply()
       self.log.debug("Applying {}\t(new trip gifts: {:.1f}%, cost: {:.3f}M) to trip {} (length {}, weight {:.1f})".format(
         neighbor, 100 * neighbor.first_trip_percentage,
@@ -54,6 +51,5 @@ class CutExtremeTripsMethod(Method):
     self.log.info("Total cost of all modifications: {:.5f}M".format(total_cost_change / 1e6))
 
     # extract gift/trip mapping
-    combined_trips = np.concatenate(trips)[:, [utils.GIFT, utils.TRIP]]
-    self.trips = pd.DataFrame(combined_trips, columns=["GiftId", "TripId"])
+    self.trips = trips.to_frame()
 
@@ -2,121 +2,185 @@
 
 # https://www.kaggle.com/the1owl/you-ll-shoot-your-eye-out-kid
 
-import sqlite3
-
+import numpy as np
 import pandas as pd
 
 import utils
-from haversine import haversine
 from method import Method
+from workers import optimize_trips
 
 
-class EyeMethod(Method):
-  def bb_sort(self, ll):
-    s_limit = 5000
-    optimal = False
-    ll = [[0,utils.NORTH_POLE,10]] + ll[:] + [[0,utils.NORTH_POLE,10]]
-    while not optimal:
-      optimal = True
-      for i in range(1,len(ll) - 2):
-        lcopy = ll[:]
-        lcopy[i], lcopy[i+1] = ll[i+1][:], ll[i][:]
-        if self.path_opt_test(ll[1:-1]) > self.path_opt_test(lcopy[1:-1]):
-          #print("swap")
-          ll = lcopy[:]
-          optimal = False
-          s_limit -= 1
-          if s_limit < 0:
-            optimal = True
-            break
-    return ll[1:-1]
-
-  def path_opt_test(self, llo):
-    f_ = 0.0
-    d_ = 0.0
-    l_ = utils.NORTH_POLE
-    for i in range(len(llo)):
-      d_ += haversine(l_, llo[i][1])
-      f_ += d_ * llo[i][2]
-      l_ = llo[i][1]
-    d_ += haversine(l_, utils.NORTH_POLE)
-    f_ += d_ * 10 #sleigh weight for whole trip
-    return f_
+def bb_sort(trip, vectorized=False):
+  """Bubble sort: swaps adjacent gifts as long as that reduces the cost of the trip.
+  The cost of swapping two adjacent gifts only depends on the three legs around them and the weight
+  carried on the first one, so each swap is evaluated in O(1) from a distance matrix of the trip.
+
+  :trip: Numpy array with the GiftIds of the trip
+  :vectorized: Instead of swapping pair by pair, evaluate all adjacent swaps at once and apply all improving
+  swaps that don't affect each other (the result differs from the sequential sort)
+
+  :returns: Numpy array with the GiftIds of the sorted trip
+  """
+  s_limit = 5000
+  gift_table = utils.get_gift_table()
+  path = np.concatenate([[utils.NORTH_POLE_ID], trip, [utils.NORTH_POLE_ID]]).astype(np.int64)
+  vectors = gift_table.unit_vectors[path]
+  distances = utils.unit_vector_distances(vectors[:, None], vectors[None, :])
+  weights = gift_table.weights[path]
+  # node[k]: index (into path/distances/weights) of the node at position k
+  node = np.arange(len(path))
+  # carried[k]: weight carried on the leg to position k+1
+  carried = utils.remaining_weights(weights[1:-1])
+
+  if vectorized:
+    while s_limit >= 0:
+      # swapping the nodes at k and k+1 changes the legs between the nodes at k-1..k+2
+      a, b, c, d = node[:-3], node[1:-2], node[2:-1], node[3:]
+      before = carried[:-2]
+      improvements = distances[a, c] * before + distances[c, b] * (before - weights[c]) + distances[b, d] * (before - weights[b] - weights[c]) - \
+          (distances[a, b] * before + distances[b, c] * (before - weights[b]) + distances[c, d] * (before - weights[b] - weights[c]))
+      candidates = np.flatnonzero(improvements < 0)
+      if len(candidates) == 0:
+        break
+
+      # swaps that are at least 3 positions apart don't affect each other
+      blocked = np.zeros(len(node) + 2, dtype=bool)
+      for k in candidates[np.argsort(improvements[candidates], kind="mergesort")]:
+        if blocked[k:k+5].any():
+          continue
+        blocked[k+2] = True
+        node[[k+1, k+2]] = node[[k+2, k+1]]
+        s_limit -= 1
+        if s_limit < 0:
+          break
+      carried = utils.remaining_weights(weights[node[1:-1]])
+    return path[node[1:-1]]
+
+  distances = distances.tolist()
+  weights = weights.tolist()
+  node = node.tolist()
+  carried = carried.tolist()
+  optimal = False
+  while not optimal:
+    optimal = True
+    for i in range(1, len(node) - 2):
+      a, b, c, d = node[i-1], node[i], node[i+1], node[i+2]
+      before = carried[i-1]
+      old = distances[a][b] * before + distances[b][c] * (before - weights[b]) + distances[c][d] * (before - weights[b] - weights[c])
+      new = distances[a][c] * before + distances[c][b] * (before - weights[c]) + distances[b][d] * (before - weights[b] - weights[c])
+      if old > new:
+        #print("swap")
+        node[i], node[i+1] = c, b
+        carried[i] = before - weights[c]
+        optimal = False
+        s_limit -= 1
+        if s_limit < 0:
+          optimal = True
+          break
+  return path[node[1:-1]]
+
+def path_opt_test(trip):
+  return utils.get_gift_table().trip_cost(np.asarray(trip, dtype=np.int64))
+
+def assign_grid_cells(latitudes, longitudes, n):
+  """Assigns gifts to the cells of a grid with about n rows and columns.
+  The cells overlap slightly, gifts in the overlap belong to the later cell.
+
+  :latitudes: Numpy array with the latitudes of the gifts
+  :longitudes: Numpy array with the longitudes of the gifts
+  :n: Number of rows/columns (not necessarily an integer)
+
+  :returns: Tuple with the row and column (both starting at 1) of each gift, 0 if the gift isn't in any cell
+  """
+  def cells(values, start, end, size):
+    # each cell covers [start - size, start], the starts go down from `start` in integer steps
+    starts = np.arange(start, end, int(-size))
+    # the number of starts >= value is the last cell that can contain the value
+    cell = np.digitize(values, starts, right=True)
+    outside = (cell == 0) | (values < starts[np.maximum(cell, 1) - 1] - size)
+    return np.where(outside, 0, cell)
+  return cells(latitudes, 90, -90, 180 / n), cells(longitudes, 180, -180, 360 / n)
+
+def pack_trips(gifts, n, limit):
+  """Packs the gifts into trips: the gifts are sorted by grid cell, longitude and latitude and each trip
+  takes the gifts that fit into the sleigh out of the next `limit` gifts that don't have a trip yet,
+  from north to south.
 
+  :gifts: Pandas DataFrame with the gifts
+  :n: Number of rows/columns of the grid
+  :limit: Number of gifts to choose the gifts of a trip from
+
+  :returns: Numpy array with the TripId (starting at 1) of each gift
+  """
+  latitudes = gifts.Latitude.values
+  longitudes = gifts.Longitude.values
+  weights = gifts.Weight.values
+  i, j = assign_grid_cells(latitudes, longitudes, n)
+  order = np.lexsort((latitudes, longitudes, j, i))
+
+  trip_ids = np.zeros(len(gifts), dtype=np.int64)
+  pending = [] # positions in `order` of gifts that were considered for a trip, but didn't fit
+  next_position = 0
+  trip_id = 0
+  while pending or next_position < len(order):
+    end = min(next_position + limit - len(pending), len(order))
+    positions = np.asarray(pending + list(range(next_position, end)))
+    next_position = end
+    # by latitude, descending
+    positions = positions[np.argsort(-latitudes[order[positions]], kind="mergesort")]
+
+    trip_id += 1
+    load = 0.0
+    pending = []
+    for position in positions:
+      gift = order[position]
+      if load + weights[gift] <= utils.WEIGHT_LIMIT:
+        load += weights[gift]
+        trip_ids[gift] = trip_id
+      else:
+        pending.append(position)
+    pending.sort()
+
+  return trip_ids
+
+
+class EyeMethod(Method):
   @property
   def name(self):
     return "eye"
 
   def run(self, args):
-    c = sqlite3.connect(":memory:")
-    self.gifts.to_sql("gifts",c)
-    cu = c.cursor()
-    cu.execute("ALTER TABLE gifts ADD COLUMN 'TripId' INT;")
-    cu.execute("ALTER TABLE gifts ADD COLUMN 'i' INT;")
-    cu.execute("ALTER TABLE gifts ADD COLUMN 'j' INT;")
-    c.commit()
-
+    best = None
+    best_cost = None
     for n in [1.25252525]:
-      i_ = 0
-      j_ = 0
-      for i in range(90,-90,int(-180/n)):
-        i_ += 1
-        j_ = 0
-        for j in range(180,-180,int(-360/n)):
-          j_ += 1
-          cu = c.cursor()
-          cu.execute("UPDATE gifts SET i=" + str(i_) + ", j=" + str(j_) + " WHERE ((Latitude BETWEEN " + str(i - (180/n)) + " AND  " + str(i) + ") AND (Longitude BETWEEN " + str(j - (360/n)) + " AND  " + str(j) + "));")
-          c.commit()
-
       for limit_ in [67]:
-        trips = pd.read_sql("SELECT * FROM (SELECT * FROM gifts WHERE TripId IS NULL ORDER BY i, j, Longitude, Latitude LIMIT " + str(limit_) + " ) ORDER BY Latitude DESC",c)
-        t_ = 0
-        while len(trips.GiftId)>0:
-          g = []
-          t_ += 1
-          w_ = 0.0
-          for i in range(len(trips.GiftId)):
-            if (w_ + float(trips.Weight[i]))<= utils.WEIGHT_LIMIT:
-              w_ += float(trips.Weight[i])
-              g.append(trips.GiftId[i])
-          cu = c.cursor()
-          cu.execute("UPDATE gifts SET TripId = " + str(t_) + " WHERE GiftId IN(" + (",").join(map(str,g)) + ");")
-          c.commit()
-
-          trips = pd.read_sql("SELECT * FROM (SELECT * FROM gifts WHERE TripId IS NULL ORDER BY i, j, Longitude, Latitude LIMIT " + str(limit_) + " ) ORDER BY Latitude DESC",c)
-          #break
-
-        # ou_ = open("submission_opt" + str(limit_) + " " + str(n) + ".csv","w")
-        # ou_.write("TripId,GiftId\n")
+        trip_ids = pack_trips(self.gifts, n, limit_)
+
+        # each trip from north to south
+        order = np.lexsort((self.gifts.Longitude.values, -self.gifts.Latitude.values, trip_ids))
+        stops = np.bincount(trip_ids[order])[1:]
+        unsorted_trips = np.split(self.gifts.GiftId.values[order], np.cumsum(stops)[:-1])
+        sorted_trips = optimize_trips(unsorted_trips, bb_sort, args.processes, args.random_seed, self.log)
+
         bm = 0.0
-        submission = pd.read_sql("SELECT TripId FROM gifts GROUP BY TripId ORDER BY TripId;", c)
         trips = []
-        for s_ in range(len(submission.TripId)):
-          trip = pd.read_sql("SELECT GiftId, Latitude, Longitude, Weight FROM gifts WHERE TripId = " + str(submission.TripId[s_]) + " ORDER BY Latitude DESC, Longitude ASC;",c)
-          a = []
-          for x_ in range(len(trip.GiftId)):
-            a.append([trip.GiftId[x_],(trip.Latitude[x_],trip.Longitude[x_]),trip.Weight[x_]])
-          b = self.bb_sort(a)
-          if self.path_opt_test(a) <= self.path_opt_test(b):
-            print(submission.TripId[s_], "No Change", self.path_opt_test(a) , self.path_opt_test(b))
-            bm += self.path_opt_test(a)
-            for y_ in range(len(a)):
-              trips.append({"TripId": submission.TripId[s_], "GiftId": a[y_][0]})
-              # ou_.write(str(submission.TripId[s_])+","+str(a[y_][0])+"\n")
+        for t_, (a, b) in enumerate(zip(unsorted_trips, sorted_trips), 1):
+          if path_opt_test(a) <= path_opt_test(b):
+            self.log.debug("{} No Change {} {}".format(t_, path_opt_test(a), path_opt_test(b)))
+            bm += path_opt_test(a)
           else:
-            print(submission.TripId[s_], "Optimized", self.path_opt_test(a) - self.path_opt_test(b))
-            bm += self.path_opt_test(b)
-            for y_ in range(len(b)):
-              trips.append({"TripId": submission.TripId[s_], "GiftId": b[y_][0]})
-              # ou_.write(str(submission.TripId[s_])+","+str(b[y_][0])+"\n")
-        # ou_.close()
-        self.trips = self.trips.append(trips)
+            self.log.debug("{} Optimized {}".format(t_, path_opt_test(a) - path_opt_test(b)))
+            bm += path_opt_test(b)
+            a = b
+          trips.extend({"TripId": t_, "GiftId": gift_id} for gift_id in a)
 
         benchmark = 12514008574.2
         if bm < benchmark:
-          print(n, limit_, "Improvement", bm, bm - benchmark, benchmark)
+          self.log.info("{} {} Improvement {} {} {}".format(n, limit_, bm, bm - benchmark, benchmark))
         else:
-          print(n, limit_, "Try again", bm, bm - benchmark, benchmark)
-        cu = c.cursor()
-        cu.execute("UPDATE gifts SET TripId = NULL;")
-        c.commit()
+          self.log.info("{} {} Try again {} {} {}".format(n, limit_, bm, bm - benchmark, benchmark))
+        if best is None or bm < best_cost:
+          best = trips
+          best_cost = bm
+
+    self.trips = pd.DataFrame(best, columns=["GiftId", "TripId"])
@@ -1,14 +1,12 @@
 #!/usr/bin/env python
 
-import pickle
-from os import path
+from bisect import bisect_left
 
 import numpy as np
 
 import pandas as pd
 import utils
 from method import Method
-from neighbor import Neighbor
 
 
 class StupidGreedyMethod(Method):
@@ -85,32 +83,74 @@ class MinimumTripsGreedMethod(Method):
   def run(self, args):
     """
     Idea: Minimize the number of trips needed to distribute all gifts. Doesn't work.
+    Each gift, starting with the heaviest, is packed into the first trip that can still carry it.
     """
-    sorted_gifts = self.gifts.sort_values("Weight", ascending=False)
-    current_trip = 1
-    current_capacity = utils.WEIGHT_LIMIT
-    trips = []
-    while sorted_gifts.shape[0] > 0:
-      gift_added = False
-      # find gift that fits into sleigh
-      for _, gift in sorted_gifts.iterrows():
-        if current_capacity < gift.Weight:
-          continue
-
-        # found gift, add to trip and remove from remaining gifts
-        current_capacity -= gift.Weight
-        sorted_gifts = sorted_gifts.drop(gift.name)
-        trips.append({"GiftId": int(gift.GiftId), "TripId": current_trip})
-        gift_added = True
-        break
+    trip_of_gift = utils.first_fit_decreasing(self.gifts.Weight.values)
+    self.log.debug("Packed {} gifts into {} trips".format(len(trip_of_gift), trip_of_gift.max() + 1))
+
+    # deliver the gifts of each trip from heaviest to lightest
+    order = np.lexsort((-self.gifts.Weight.values, trip_of_gift))
+    self.trips = pd.DataFrame({"GiftId": self.gifts.GiftId.values[order], "TripId": trip_of_gift[order] + 1})
+
+
+def assign_to_closest_trips(trip_longitudes, trip_weights, gift_longitudes, gift_weights, gift_ids):
+  """Assigns gifts one after another to the trip with the most similar longitude that can still carry them.
+
+  The trips are kept sorted by longitude, so the closest trips are found with a binary search and only
+  full trips next to them have to be skipped.
+
+  :trip_longitudes: Numpy array with the longitude of each trip
+  :trip_weights: Numpy array with the weight that is already assigned to each trip
+  :gift_longitudes: Numpy array with the longitudes of the gifts in the order they are assigned
+  :gift_weights: Numpy array with the weights of the gifts
+  :gift_ids: Numpy array with the GiftIds of the gifts (for reporting gifts that don't fit)
+
+  :returns: Numpy array with the index of the trip of each gift
+  """
+  order = np.argsort(trip_longitudes, kind="mergesort")
+  longitudes = trip_longitudes[order].tolist()
+  weights = trip_weights[order].astype(np.float64).tolist()
+  trip_indexes = order.tolist()
+
+  assignments = np.full(len(gift_longitudes), -1, dtype=np.int64)
+  for i, (longitude, weight) in enumerate(zip(gift_longitudes.tolist(), gift_weights.tolist())):
+    # closest trips on both sides that can still carry the gift
+    right = bisect_left(longitudes, longitude)
+    left = right - 1
+    while left >= 0 and weight + weights[left] > utils.WEIGHT_LIMIT:
+      left -= 1
+    while right < len(longitudes) and weight + weights[right] > utils.WEIGHT_LIMIT:
+      right += 1
+
+    if left < 0 and right == len(longitudes):
+      raise ValueError("No trip can carry gift {} with weight {}".format(gift_ids[i], weight))
+    if left < 0:
+      closest = right
+    elif right == len(longitudes):
+      closest = left
+    else:
+      left_distance = longitude - longitudes[left]
+      right_distance = longitudes[right] - longitude
+      # on a tie, the trip that was created first wins
+      closest = right if right_distance < left_distance or \
+          (right_distance == left_distance and trip_indexes[right] < trip_indexes[left]) else left
 
-      if not gift_added:
-        # we couldn't find a gift that fits into the current sleigh, start new trip
-        current_trip += 1
-        current_capacity = utils.WEIGHT_LIMIT
-        self.log.debug("Started trip {}, remaining gifts: {}".format(current_trip, sorted_gifts.shape[0]))
+    weights[closest] += weight
+    assignments[i] = trip_indexes[closest]
 
-    self.trips = self.trips.append(trips)
+  return assignments
+
+def get_geographically_sorted_trips(gifts, trip_of_gift):
+  """Drops off the gifts of each trip from north to south.
+
+  :gifts: Pandas DataFrame with the gifts
+  :trip_of_gift: Numpy array with the index of the trip of each gift
+
+  :returns: Pandas DataFrame with the GiftIds and TripIds (numbered from 0 in the order of the trips)
+  """
+  order = np.lexsort((-gifts.Latitude.values, trip_of_gift))
+  _, trip_ids = np.unique(trip_of_gift[order], return_inverse=True)
+  return pd.DataFrame({"GiftId": gifts.GiftId.values[order], "TripId": trip_ids})
 
 
 class HeavyAntarcticaGreedyMethod(Method):
@@ -122,88 +162,27 @@ class HeavyAntarcticaGreedyMethod(Method):
     antarctica_gifts = self.gifts[self.gifts.Latitude < -60]
     heavy_antarctica_gifts = antarctica_gifts[antarctica_gifts.Weight > 30]
     self.log.info("Creating {} trips for the heaviest gifts that need to be delievered furthest".format(heavy_antarctica_gifts.shape[0]))
-    trips = {gift.Longitude: (gift.Weight, [gift]) for _, gift in heavy_antarctica_gifts.iterrows()}
+    trip_of_gift = pd.Series(-1, index=self.gifts.index)
+    trip_of_gift.loc[heavy_antarctica_gifts.index] = np.arange(heavy_antarctica_gifts.shape[0])
 
-    remaining_gifts = self.gifts[~self.gifts.isin(heavy_antarctica_gifts)].dropna().sort_values("Weight", ascending=False)
+    remaining_gifts = self.gifts.drop(heavy_antarctica_gifts.index).sort_values("Weight", ascending=False)
     self.log.info("Spreading the remaining {} gifts across the existing trips".format(remaining_gifts.shape[0]))
 
-    for _, gift in remaining_gifts.iterrows():
-      # find trip where the heavy antarctica gift has the most similar longitude
-      trip_longitude = None
-      minimum_distance = None
-
-      for longitude, gift_info in trips.items():
-        if gift.Weight + gift_info[0] > utils.WEIGHT_LIMIT:
-          # avoid invalid assignments
-          continue
-        current_distance = abs(gift.Longitude - longitude)
-        if trip_longitude is None or current_distance < minimum_distance:
-          minimum_distance = current_distance
-          trip_longitude = longitude
-
-      # assign current gift to the closest trip
-      trips[trip_longitude] = (trips[trip_longitude][0] + gift.Weight, trips[trip_longitude][1] + [gift])
-
-    return trips
-
-  def get_optimally_sorted_trips(self, trips):
-    self.log.warning("THIS DOESN'T WORK")
-    self.log.info("Putting trips into optimal order")
-    total_trip_count = len(trips)
-    all_trips = []
-    for i, trip in enumerate(trips.values()):
-      self.log.debug("Processing trip {}/{} with length {}".format(i+1, total_trip_count, len(trip[1])))
-      sorted_trip = sorted(trip[1], key=lambda tup: tup.Weight, reverse=True)
-      this_trip = []
-      for gift in sorted_trip:
-        if len(this_trip) == 0:
-          this_trip.append(gift)
-          continue
-        gift[utils.TRIP] = len(all_trips)
-        best_index, _ = Neighbor.find_best_insertion_index(np.asarray(this_trip), gift.values,
-            lat_index=1, lon_index=2, weight_index=3)
-        this_trip.insert(best_index, gift)
-      if this_trip:
-        all_trips.append(this_trip)
-
-    # extract gift/trip mapping
-    combined_trips = np.concatenate(all_trips)[:, [utils.GIFT, utils.TRIP]]
-    return pd.DataFrame(combined_trips, columns=["GiftId", "TripId"])
-
-  def get_geographically_sorted_trips(self, trips):
-    # drop off gifts from north to south
-    self.log.info("Putting trips into geographical order")
-    all_trips = []
-    for trip in trips.values():
-      sorted_trip = sorted(trip[1], key=lambda tup: tup.Latitude, reverse=True)
-      this_trip = []
-      for t in sorted_trip:
-        t[utils.TRIP] = len(all_trips)
-        this_trip.append(t)
-      if this_trip:
-        all_trips.append(this_trip)
-
-    # extract gift/trip mapping
-    combined_trips = np.concatenate(all_trips)[:, [utils.GIFT, utils.TRIP]]
-    return pd.DataFrame(combined_trips, columns=["GiftId", "TripId"])
+    # assign each gift to the trip where the heavy antarctica gift has the most similar longitude
+    trip_of_gift.loc[remaining_gifts.index] = assign_to_closest_trips(heavy_antarctica_gifts.Longitude.values,
+        heavy_antarctica_gifts.Weight.values, remaining_gifts.Longitude.values, remaining_gifts.Weight.values,
+        remaining_gifts.GiftId.values)
+
+    return trip_of_gift.values
 
   def run(self, args):
     """
     Idea: Create valid trips by creating one for each of the heaviest gifts in antarctica
     and then assign the other gifts to these based on their Longitude.
     """
-    trips_file = "unsorted-heavy-trips.pkl"
-    if path.exists(trips_file):
-      self.log.info("Loading unsorted trips from '{}'".format(trips_file))
-      with open(trips_file, "rb") as fh:
-        trips = pickle.load(fh)
-    else:
-      trips = self.calculate_heavy_trip_assignments()
-      self.log.info("Writing unsorted trips to '{}'".format(trips_file))
-      with open(trips_file, "wb") as fh:
-        pickle.dump(trips, fh)
-
-    self.trips = self.get_geographically_sorted_trips(trips)
+    trip_of_gift = self.calculate_heavy_trip_assignments()
+    self.log.info("Putting trips into geographical order")
+    self.trips = get_geographically_sorted_trips(self.gifts, trip_of_gift)
 
 
 class BalancedAntarcticaGreedyMethod(Method):
@@ -215,9 +194,10 @@ class BalancedAntarcticaGreedyMethod(Method):
     antarctica_gifts = self.gifts[self.gifts.Latitude < -60]
     heavy_antarctica_gifts = antarctica_gifts[antarctica_gifts.Weight > 35]
     self.log.info("Creating {} trips for the heaviest gifts that need to be delievered furthest".format(heavy_antarctica_gifts.shape[0]))
-    trips = {gift.Longitude: (gift.Weight, [gift]) for _, gift in heavy_antarctica_gifts.iterrows()}
+    trip_of_gift = pd.Series(-1, index=self.gifts.index)
+    trip_of_gift.loc[heavy_antarctica_gifts.index] = np.arange(heavy_antarctica_gifts.shape[0])
 
-    remaining_gifts = self.gifts[~self.gifts.isin(heavy_antarctica_gifts)].dropna().sort_values("Weight", ascending=False)
+    remaining_gifts = self.gifts.drop(heavy_antarctica_gifts.index).sort_values("Weight", ascending=False)
 
     self.log.info("Inserting additional boundaries to prevent long trips")
     # create histogram of all gifts, distributed across the current trip longitudes
@@ -242,50 +222,28 @@ class BalancedAntarcticaGreedyMethod(Method):
           added_bounds.append(new_bound_after)
       bounds = sorted(np.append(bounds, new_bounds))
       histogram = np.histogram(self.gifts.Longitude, bounds)
-    for added_bound in added_bounds:
-      trips[added_bound] = (0, [])
+    # the added boundaries are empty trips after the trips of the heavy gifts
+    trip_longitudes = np.concatenate([heavy_antarctica_gifts.Longitude.values, added_bounds])
+    trip_weights = np.concatenate([heavy_antarctica_gifts.Weight.values, np.zeros(len(added_bounds))])
     self.log.info("Added bounderies for a total of {} trips (expected gifts/trip average: {}, std: {})"
-        .format(len(trips.keys()), histogram[0].mean(), histogram[0].std()))
+        .format(len(trip_longitudes), histogram[0].mean(), histogram[0].std()))
 
     self.log.info("Spreading the remaining {} gifts across the existing trips".format(remaining_gifts.shape[0]))
-    for _, gift in remaining_gifts.iterrows():
-      # find trip where the heavy antarctica gift has the most similar longitude
-      trip_longitude = None
-      minimum_distance = None
-
-      for longitude, gift_info in trips.items():
-        if gift.Weight + gift_info[0] > utils.WEIGHT_LIMIT:
-          # avoid invalid assignments
-          continue
-        current_distance = abs(gift.Longitude - longitude)
-        if trip_longitude is None or current_distance < minimum_distance:
-          minimum_distance = current_distance
-          trip_longitude = longitude
-
-      # assign current gift to the closest trip
-      trips[trip_longitude] = (trips[trip_longitude][0] + gift.Weight, trips[trip_longitude][1] + [gift])
-
-    gifts_per_trip_counts = [len(t[1]) for t in trips.values()]
+    # assign each gift to the trip with the most similar longitude
+    trip_of_gift.loc[remaining_gifts.index] = assign_to_closest_trips(trip_longitudes, trip_weights,
+        remaining_gifts.Longitude.values, remaining_gifts.Weight.values, remaining_gifts.GiftId.values)
+
+    gifts_per_trip_counts = np.bincount(trip_of_gift.values[trip_of_gift.values >= 0], minlength=len(trip_longitudes))
     self.log.info("Spread all gifts across {} trips (gifts/trip average: {}, std: {})".format(
-      len(trips.values()), np.mean(gifts_per_trip_counts), np.std(gifts_per_trip_counts)))
+      len(trip_longitudes), np.mean(gifts_per_trip_counts), np.std(gifts_per_trip_counts)))
 
-    return trips
+    return trip_of_gift.values
 
   def run(self, args):
     """
     Idea: Create valid trips by creating
     and then assign the other gifts to these based on their Longitude.
     """
-    trips_file = "unsorted-balanced-trips.pkl"
-    if path.exists(trips_file):
-      self.log.info("Loading unsorted trips from '{}'".format(trips_file))
-      with open(trips_file, "rb") as fh:
-        trips = pickle.load(fh)
-    else:
-      trips = self.calculate_balanced_trip_assignments()
-      self.log.info("Writing unsorted trips to '{}'".format(trips_file))
-      with open(trips_file, "wb") as fh:
-        pickle.dump(trips, fh)
-
-    self.trips = HeavyAntarcticaGreedyMethod.get_geographically_sorted_trips(self, trips) # naughty!
-
+    trip_of_gift = self.calculate_balanced_trip_assignments()
+    self.log.info("Putting trips into geographical order")
+    self.trips = get_geographically_sorted_trips(self.gifts, trip_of_gift)
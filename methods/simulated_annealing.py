@@ -1,15 +1,16 @@
 #!/usr/bin/env python
 
 import gc
-from multiprocessing import Pool
+from multiprocessing import Pipe, Pool, Process
 
 import numpy as np
-import pandas as pd
 import pickle
 
 import utils
 from method import Method
 from neighbor import Neighbor
+from solution import Solution
+from workers import WorkerPool
 from neighbors import (MoveGiftToAnotherTripNeighbor,
                        MoveGiftToLightestTripNeighbor,
                        MoveGiftToOptimalTripNeighbor,
@@ -18,9 +19,227 @@ from neighbors import (MoveGiftToAnotherTripNeighbor,
                        OptimalMoveGiftInTripNeighbor,
                        OptimalSwapInRandomTripNeighbor,
                        OptimalVerticalTripSplitNeighbor,
+                       OrOptInTripNeighbor,
                        SplitOneTripIntoTwoNeighbor,
                        SwapGiftsAcrossTripsNeighbor,
-                       SwapRandomGiftsInTripNeighbor)
+                       SwapRandomGiftsInTripNeighbor,
+                       TwoOptInTripNeighbor)
+
+
+def get_neighbors(trips, trip):
+  # current neighbor to test
+  # return [OptimalMergeTripIntoAdjacentNeighbor(trips, self.log)]
+
+  # optimum neighbors in descending order of calculation complexity
+  # TODO: Try different weights per neighbor and different weights for trips within neighbors (based on cost/weight)
+  return [
+      # TODO: Specify more restrictive heuristic restrictions in neighbors
+
+      # MERGE-TRIP NEIGHBORHOOD
+      # 1000 iterations:
+      # merge current trip into neighbors
+      # OptimalMergeTripIntoAdjacentNeighbor(trips, trip),
+
+      # TWO-TRIP NEIGHBORHOOD
+      # 1000 iterations: 6m11s
+      MoveGiftToOptimalTripNeighbor(trips, trip),
+
+      # NEW-TRIP NEIGHBORHOOD
+      # 1000 iterations: 1m15s
+      OptimalHorizontalTripSplitNeighbor(trips, trip),
+      # 1000 iterations: 1m20s
+      # OptimalVerticalTripSplitNeighbor(trips, trip), # disabled because that doesn't help anyway
+
+      # SINGLE-TRIP NEIGHBORHOOD
+      # 1000 iterations: 1m44s
+      OptimalSwapInRandomTripNeighbor(trips, trip),
+      # 1000 iterations single-threaded: 1m51s
+      # 1000 iterations on four threads: 2m6s
+      # 1000 iterations on two threads:  2m10s
+      # 1000 iterations on two threads with length > 50:  1m49s
+      # 1000 iterations on two threads with length > 100: 1m43s
+      # 1000 iterations on two threads with length > 200: 1m45s
+      # 1000 iterations on two threads with length > 500: 1m44s
+      OptimalMoveGiftInTripNeighbor(trips, trip),
+      # segment reversal and relocation with O(1) deltas per move
+      TwoOptInTripNeighbor(trips, trip),
+      OrOptInTripNeighbor(trips, trip),
+      ]
+
+
+def get_slow_neighbors(trips, trip):
+  return [
+      # MERGE-TRIP NEIGHBORHOOD
+      # 1000 iterations:
+      # merge current trip into neighbors (evaluated in a transaction instead of on a copy of all trips)
+      OptimalMergeTripIntoAdjacentNeighbor(trips, trip),
+      ]
+
+
+def anneal_step(trips, pool, trip, temperature, treat_slow_jobs_differntly=True, log=None):
+  """Evaluates the neighbors for one iteration and applies the cheapest one if it improves the solution,
+  otherwise a random one with the acceptance probability of the temperature.
+
+  :trips: The Solution to modify
+  :pool: WorkerPool to evaluate the neighbors with
+  :trip: Index of the trip to focus on (or None for random trips)
+  :temperature: Current temperature
+  :treat_slow_jobs_differntly: Only evaluate the slow neighbors if none of the others improves the solution
+  :log: Logger for every evaluated move (or None)
+
+  :returns: Tuple with the selected neighbor and whether it was "good", "acc"(epted) or "rej"(ected)
+  """
+  neighbors = get_neighbors(trips, trip)
+
+  # get slow and normal neighbors
+  slow_neighbors = get_slow_neighbors(trips, trip)
+  if not treat_slow_jobs_differntly:
+    neighbors = slow_neighbors + neighbors
+    slow_neighbors.clear()
+
+  # evaluate normal neighbors
+  costs = pool.evaluate(neighbors)
+
+  # find cheapest neighbor
+  neighbor = neighbors[costs.index(min(costs))]
+
+  # if cheapest neighbor is bad, select neighbor randomly - we always prefer good solutions,
+  # but if there is none, no specific neighbor should be preferred since their costs are biased
+  if neighbor.cost_delta() >= 0:
+    neighbor = neighbors[np.random.randint(len(neighbors))]
+
+  # if cheapest neighbor is bad and we have slow neighbors to check, evaluate those and
+  # pick them if they're cheaper (but not if they do nothing)
+  while neighbor.cost_delta() >= 0 and len(slow_neighbors) > 0:
+    slow_neighbor = slow_neighbors[-1]
+    slow_neighbors.remove(slow_neighbor)
+    if slow_neighbor.cost_delta() != 0 and slow_neighbor.cost_delta() < neighbor.cost_delta():
+      neighbor = slow_neighbor
+
+  if neighbor.cost_delta() < 0:
+    if log:
+      log.success("Accepting neighbor {} with negative cost {:.1f}k".format(neighbor, neighbor.cost_delta() / 1e3))
+    neighbor.apply()
+    pool.apply(neighbor)
+    return neighbor, "good"
+
+  accepting_probability = np.exp(-neighbor.cost_delta()/temperature)
+  if accepting_probability > np.random.rand():
+    if log:
+      log.info("Accepting worse neighbor {:>20} (by {:>.1f}k, {:>4.1f}% chance, T={:>9.1f})".format(
+        str(neighbor), neighbor.cost_delta() / 1e3, 100 * accepting_probability, temperature))
+    neighbor.apply()
+    pool.apply(neighbor)
+    return neighbor, "acc"
+
+  if log:
+    log.debug("Rejecting worse neighbor {:>20} (by {:>.1f}k, {:>4.1f}% chance, T={:>9.1f})".format(
+      str(neighbor), neighbor.cost_delta() / 1e3, 100 * accepting_probability, temperature))
+  return neighbor, "rej"
+
+
+def partition_into_sectors(trips, sectors, offset=0.0):
+  """Assigns the trips to longitude sectors with the same number of trips each.
+
+  :trips: The Solution
+  :sectors: Number of sectors
+  :offset: Fraction of a sector by which the sector boundaries are rotated eastwards
+
+  :returns: List with a Numpy array of trip indexes per sector
+  """
+  # circular mean of the longitudes, so that trips across the date line aren't put in the middle
+  gift_ids = np.concatenate(list(trips))
+  trip_of_gift = np.repeat(np.arange(len(trips)), trips.stops)
+  radians = utils.get_gift_table().radians[gift_ids, 1]
+  longitudes = np.arctan2(
+    np.bincount(trip_of_gift, weights=np.sin(radians), minlength=len(trips)),
+    np.bincount(trip_of_gift, weights=np.cos(radians), minlength=len(trips)))
+
+  order = np.roll(np.argsort(longitudes, kind="mergesort"), -int(offset * len(trips) / sectors))
+  return np.array_split(order, sectors)
+
+
+def anneal(solution, pool, iterations, temperature, temperature_decrease=None, alpha=1.0, bad_trips_iterations=0):
+  """Runs a chain for a number of iterations.
+
+  :solution: The Solution to modify
+  :pool: WorkerPool to evaluate the neighbors with
+  :iterations: Number of iterations
+  :temperature: Temperature at the start
+  :temperature_decrease: Number of iterations after which the temperature is decreased (None: constant temperature)
+  :alpha: Factor for the temperature decrease
+  :bad_trips_iterations: Number of iterations at the start that focus on inefficient trips
+
+  :returns: Tuple with the total cost change and a dict with the number of good/accepted/rejected moves
+  """
+  outcomes = {"good": 0, "acc": 0, "rej": 0}
+  cost_change = 0
+  last_trip_index = None
+
+  for i in range(iterations):
+    if temperature_decrease and i > 0 and i % temperature_decrease == 0:
+      temperature *= alpha
+
+    if last_trip_index is not None:
+      trip = last_trip_index
+    else:
+      trip = utils.get_index_of_inefficient_trip(solution) if i < bad_trips_iterations else None
+
+    neighbor, outcome = anneal_step(solution, pool, trip, temperature)
+    outcomes[outcome] += 1
+    if outcome != "rej":
+      cost_change += neighbor.cost_delta()
+    # merges remove a trip, so the index may no longer exist
+    last_trip_index = trip if outcome == "good" and trip is not None and trip < len(solution) else None
+
+  return cost_change, outcomes
+
+
+def anneal_sector(trips, trip_ids, iterations, temperature, temperature_decrease, alpha, bad_trips_iterations, random_seed):
+  """Runs an independent chain on the trips of a single sector (in a separate process).
+
+  :trips: List of Numpy arrays with the GiftIds of the trips of the sector
+  :trip_ids: TripId of each trip
+  :iterations: Number of iterations
+  :temperature: Temperature at the start
+  :temperature_decrease: Number of iterations after which the temperature is decreased
+  :alpha: Factor for the temperature decrease
+  :bad_trips_iterations: Number of iterations at the start that focus on inefficient trips
+  :random_seed: Random seed of the chain
+
+  :returns: Tuple with the GiftIds of the resulting trips, their TripIds, the total cost change and a dict with
+  the number of good/accepted/rejected moves
+  """
+  np.random.seed(random_seed)
+  solution = Solution(trips, trip_ids)
+  cost_change, outcomes = anneal(solution, WorkerPool(solution, 0), iterations, temperature, temperature_decrease,
+      alpha, bad_trips_iterations)
+  return [trip.copy() for trip in solution], solution.trip_ids.copy(), cost_change, outcomes
+
+
+def run_replica(connection, trips, trip_ids, random_seed):
+  """Main loop of a replica process for parallel tempering: anneals its own solution at the temperature
+  it is given and sends back its cost (or its trips) on request.
+
+  :connection: Pipe to the main process
+  :trips: List of Numpy arrays with the GiftIds of the initial trips
+  :trip_ids: TripId of each trip
+  :random_seed: Random seed of the chain
+  """
+  np.random.seed(random_seed)
+  solution = Solution(trips, trip_ids)
+  pool = WorkerPool(solution, 0)
+
+  while True:
+    command, arguments = connection.recv()
+    if command == "anneal":
+      temperature, iterations = arguments
+      _, outcomes = anneal(solution, pool, iterations, temperature)
+      connection.send((solution.costs.sum(), outcomes))
+    elif command == "trips":
+      connection.send(([trip.copy() for trip in solution], solution.trip_ids.copy()))
+    elif command == "stop":
+      break
 
 
 class SimulatedAnnealingMethod(Method):
@@ -28,51 +247,6 @@ class SimulatedAnnealingMethod(Method):
   def name(self):
     return "sim"
 
-  def _get_neighbors(self, trips, trip):
-    # current neighbor to test
-    # return [OptimalMergeTripIntoAdjacentNeighbor(trips, self.log)]
-
-    # optimum neighbors in descending order of calculation complexity
-    # TODO: Try different weights per neighbor and different weights for trips within neighbors (based on cost/weight)
-    return [
-        # TODO: Specify more restrictive heuristic restrictions in neighbors
-
-        # MERGE-TRIP NEIGHBORHOOD
-        # 1000 iterations:
-        # merge current trip into neighbors
-        # OptimalMergeTripIntoAdjacentNeighbor(trips, trip),
-
-        # TWO-TRIP NEIGHBORHOOD
-        # 1000 iterations: 6m11s
-        MoveGiftToOptimalTripNeighbor(trips, trip),
-
-        # NEW-TRIP NEIGHBORHOOD
-        # 1000 iterations: 1m15s
-        OptimalHorizontalTripSplitNeighbor(trips, trip),
-        # 1000 iterations: 1m20s
-        # OptimalVerticalTripSplitNeighbor(trips, trip), # disabled because that doesn't help anyway
-
-        # SINGLE-TRIP NEIGHBORHOOD
-        # 1000 iterations: 1m44s
-        OptimalSwapInRandomTripNeighbor(trips, trip),
-        # 1000 iterations single-threaded: 1m51s
-        # 1000 iterations on four threads: 2m6s
-        # 1000 iterations on two threads:  2m10s
-        # 1000 iterations on two threads with length > 50:  1m49s
-        # 1000 iterations on two threads with length > 100: 1m43s
-        # 1000 iterations on two threads with length > 200: 1m45s
-        # 1000 iterations on two threads with length > 500: 1m44s
-        OptimalMoveGiftInTripNeighbor(trips, trip),
-        ]
-
-  def _get_slow_neighbors(self, trips, trip):
-    return [
-        # MERGE-TRIP NEIGHBORHOOD
-        # 1000 iterations:
-        # merge current trip into neighbors
-        # OptimalMergeTripIntoAdjacentNeighbor(trips, trip), # disabled because that takes forever and doesn't seem to help
-        ]
-
   def run(self, args):
     """
     Idea: Apply simulated annealing (d'uh).
@@ -100,9 +274,21 @@ class SimulatedAnnealingMethod(Method):
     temperature = initial_temperature
 
     # split all trips into separate trips
-    trips = [all_trips[all_trips.TripId == t].values for t in all_trips.TripId.unique()]
+    trips = Solution.from_frame(all_trips)
     last_trip_index = None
 
+    if args.sectors:
+      trips = self._anneal_sectors(trips, args.sectors, iterations, bad_trips_iterations, initial_temperature,
+          temperature_decrease, alpha, args)
+      self.trips = trips.to_frame()
+      return
+
+    if args.replicas:
+      trips = self._anneal_replicas(trips, args.replicas, iterations, log_interval, checkpoint_interval,
+          initial_temperature, args)
+      self.trips = trips.to_frame()
+      return
+
     # variables for stats
     good_solutions = 0
     accepted_bad_solutions = 0
@@ -122,7 +308,7 @@ class SimulatedAnnealingMethod(Method):
       iterations, bad_trips_iterations, treat_slow_jobs_differntly, log_interval, checkpoint_interval,
       worker_size, initial_temperature, temperature_decrease, alpha))
 
-    with Pool(worker_size) as pool:
+    with WorkerPool(trips, worker_size, args.random_seed) as pool:
       for i in range(iterations+1):
         if i > 0 and i % log_interval == 0:
           self.log.debug("{:>6}/{}: T={:>9.1f}, since {:>6}: {:>5.1f}/{:>5.1f}/{:>5.1f}% good/acc/rej ({:>5.1f}% acc), cost: {:>9.1f}k/{:.1f}M".format(
@@ -164,77 +350,31 @@ class SimulatedAnnealingMethod(Method):
           trip = utils.get_index_of_inefficient_trip(trips) if i < bad_trips_iterations else None
         if i == bad_trips_iterations:
           self.log.warning("No longer optimizing bad trips specifically")
-        neighbors = self._get_neighbors(trips, trip)
-
-        # get slow and normal neighbors
-        slow_neighbors = self._get_slow_neighbors(trips, trip)
-        if not treat_slow_jobs_differntly:
-          neighbors = slow_neighbors + neighbors
-          slow_neighbors.clear()
-        jobs = []
 
-        # evaluate normal neighbors
-        for neighbor in neighbors:
-          jobs.append(pool.apply_async(neighbor.cost_delta))
-        costs = [j.get() for j in jobs]
-
-        # find cheapest neighbor
-        neighbor = neighbors[costs.index(min(costs))]
-
-        # if cheapest neighbor is bad, select neighbor randomly - we always prefer good solutions,
-        # but if there is none, no specific neighbor should be preferred since their costs are biased
-        if neighbor.cost_delta() >= 0:
-          neighbor = neighbors[np.random.randint(len(neighbors))]
-
-        # if cheapest neighbor is bad and we have slow neighbors to check, evaluate those and
-        # pick them if they're cheaper (but not if they do nothing)
-        while neighbor.cost_delta() >= 0 and len(slow_neighbors) > 0:
-          slow_neighbor = slow_neighbors[-1]
-          slow_neighbors.remove(slow_neighbor)
-          if slow_neighbor.cost_delta() != 0 and slow_neighbor.cost_delta() < neighbor.cost_delta():
-            neighbor = slow_neighbor
+        neighbor, outcome = anneal_step(trips, pool, trip, temperature, treat_slow_jobs_differntly,
+            self.log if log_neighbors else None)
         neighbor_name = neighbor.__class__.__name__
+        if not neighbor_name in moves.keys():
+          moves[neighbor_name] = {}
+        if not outcome in moves[neighbor_name].keys():
+          moves[neighbor_name][outcome] = 0
+        moves[neighbor_name][outcome] += 1
 
-        if neighbor.cost_delta() < 0:
-          last_trip_index = trip
-          if log_neighbors:
-            self.log.success("Accepting neighbor {} with negative cost {:.1f}k".format(neighbor, neighbor.cost_delta() / 1e3))
+        if outcome == "good":
           total_cost_change += neighbor.cost_delta()
-          neighbor.apply()
           good_solutions += 1
-          if not neighbor_name in moves.keys():
-            moves[neighbor_name] = {}
-          if not "good" in moves[neighbor_name].keys():
-            moves[neighbor_name]["good"] = 0
-          moves[neighbor_name]["good"] += 1
+          # if the last iteration had a cost decrease, try optimizing the same trip again
+          # (merges remove a trip, so the index may no longer exist)
+          last_trip_index = trip if trip is not None and trip < len(trips) else None
           self.check_gifts(trips, neighbor)
-          continue
-
-        last_trip_index = None
-        accepting_probability = np.exp(-neighbor.cost_delta()/temperature)
-        if accepting_probability > np.random.rand():
-          if log_neighbors:
-            self.log.info("Accepting worse neighbor {:>20} (by {:>.1f}k, {:>4.1f}% chance, T={:>9.1f})".format(
-              str(neighbor), neighbor.cost_delta() / 1e3, 100 * accepting_probability, temperature))
+        elif outcome == "acc":
           total_cost_change += neighbor.cost_delta()
-          neighbor.apply()
           accepted_bad_solutions += 1
-          if not neighbor_name in moves.keys():
-            moves[neighbor_name] = {}
-          if not "acc" in moves[neighbor_name].keys():
-            moves[neighbor_name]["acc"] = 0
-          moves[neighbor_name]["acc"] += 1
+          last_trip_index = None
           self.check_gifts(trips, neighbor)
         else:
-          if log_neighbors:
-            self.log.debug("Rejecting worse neighbor {:>20} (by {:>.1f}k, {:>4.1f}% chance, T={:>9.1f})".format(
-              str(neighbor), neighbor.cost_delta() / 1e3, 100 * accepting_probability, temperature))
           rejected_bad_solutions += 1
-          if not neighbor_name in moves.keys():
-            moves[neighbor_name] = {}
-          if not "rej" in moves[neighbor_name].keys():
-            moves[neighbor_name]["rej"] = 0
-          moves[neighbor_name]["rej"] += 1
+          last_trip_index = None
 
     overall_good_solutions.append(good_solutions - last_good_solutions)
     overall_accepted_solutions.append(accepted_bad_solutions - last_accepted_bad_solutions)
@@ -250,42 +390,195 @@ class SimulatedAnnealingMethod(Method):
     self.log.info("Applied the following moves: {}".format(moves))
 
     # extract gift/trip mapping
-    combined_trips = np.concatenate(trips)[:, [0, 1]]
-    self.trips = pd.DataFrame(combined_trips, columns=["GiftId", "TripId"])
+    self.trips = trips.to_frame()
+
+  def _anneal_sectors(self, trips, sectors, iterations, bad_trips_iterations, temperature, temperature_decrease, alpha, args):
+    """Runs independent chains on longitude sectors of the trips in parallel processes.
+
+    Moves only change trips that are close to each other, so the sectors barely interact. After every round,
+    the sectors are merged into one solution and partitioned again with the boundaries shifted by half a
+    sector, so the trips at the boundaries of one round are in the middle of a sector in the next one.
+    Every sector runs all iterations, so the total number of iterations grows with the number of sectors.
+
+    :returns: The merged Solution
+    """
+    rounds = 10
+    iterations_per_round = int(np.ceil(iterations / rounds))
+    random_seed = args.random_seed if args.random_seed is not None else np.random.randint(2**31 - rounds * sectors)
+    total_cost_change = 0
+    temperatures = []
+    overall_good_solutions = []
+    overall_accepted_solutions = []
+    overall_rejected_solutions = []
+    overall_cost = []
+
+    self.log.info("Parameters: {} sectors, {} rounds of {} iterations per sector; T={}, decrease every {}, alpha={}".format(
+      sectors, rounds, iterations_per_round, temperature, temperature_decrease, alpha))
+
+    with Pool(sectors) as pool:
+      for current_round in range(rounds):
+        start = current_round * iterations_per_round
+        round_temperature = temperature * alpha ** (start // temperature_decrease)
+        partition = partition_into_sectors(trips, sectors, 0.5 * (current_round % 2))
+
+        jobs = []
+        for i, sector in enumerate(partition):
+          jobs.append(pool.apply_async(anneal_sector, ([trips[t].copy() for t in sector], trips.trip_ids[sector],
+            iterations_per_round, round_temperature, temperature_decrease, alpha, max(0, bad_trips_iterations - start),
+            random_seed + current_round * sectors + i)))
+        results = [job.get() for job in jobs]
+
+        # merge the sectors, the TripIds are renumbered since new trips of different sectors may share one
+        trips = Solution([trip for sector_trips, _, _, _ in results for trip in sector_trips if len(trip) > 0])
+        self.check_gifts(trips, None)
+
+        cost_change = sum(result[2] for result in results)
+        total_cost_change += cost_change
+        outcomes = {outcome: sum(result[3][outcome] for result in results) for outcome in ["good", "acc", "rej"]}
+        temperatures.append(round_temperature)
+        overall_good_solutions.append(outcomes["good"])
+        overall_accepted_solutions.append(outcomes["acc"])
+        overall_rejected_solutions.append(outcomes["rej"])
+        overall_cost.append(cost_change)
+        self.log.debug("Round {:>2}/{}: T={:>9.1f}, {} trips, {} good/{} acc/{} rej, cost: {:>9.1f}k/{:.1f}M".format(
+          current_round + 1, rounds, round_temperature, len(trips), outcomes["good"], outcomes["acc"], outcomes["rej"],
+          cost_change / 1e3, total_cost_change / 1e6))
+
+        if not self.create_checkpoint(trips, start + iterations_per_round, iterations, iterations_per_round,
+            args.evaluation_id, args.random_seed, temperatures, overall_good_solutions, overall_accepted_solutions,
+            overall_rejected_solutions, overall_cost):
+          self.log.error("Aborting evaluation because the current solution is invalid")
+          break
+
+    self.log.info("Finished {} rounds on {} sectors with total cost change of {:.3f}M".format(
+      rounds, sectors, total_cost_change / 1e6))
+    return trips
+
+  def _anneal_replicas(self, trips, replicas, iterations, log_interval, checkpoint_interval, temperature, args):
+    """Parallel tempering: runs chains at fixed temperatures in parallel processes and swaps the temperatures
+    of chains at neighboring temperatures depending on the cost of their solutions, so good solutions are
+    refined at low temperatures while the hot chains keep exploring.
+
+    :returns: The best Solution found by any replica
+    """
+    exchange_interval = 100
+    # the coldest replica practically only accepts improvements
+    ladder = np.geomspace(temperature / 1e3, temperature, replicas)
+    exchanges = int(np.ceil(iterations / exchange_interval))
+    random_seed = args.random_seed if args.random_seed is not None else np.random.randint(2**31 - replicas)
+
+    # slot_of_replica[r]: index of the temperature of replica r in the ladder
+    slot_of_replica = np.arange(replicas)
+    outcomes = [{"good": 0, "acc": 0, "rej": 0} for _ in range(replicas)] # per temperature
+    swap_attempts = np.zeros(replicas - 1, dtype=int) # per pair of neighboring temperatures
+    swaps = np.zeros(replicas - 1, dtype=int)
+    best_cost = trips.costs.sum()
+    initial_cost = best_cost
+    best = trips
+    best_costs = []
+
+    self.log.info("Parameters: {} replicas with temperatures {}, swaps every {} iterations, {} iterations per replica".format(
+      replicas, ", ".join("{:.1f}".format(t) for t in ladder), exchange_interval, exchanges * exchange_interval))
+
+    connections = []
+    processes = []
+    for i in range(replicas):
+      connection, replica_connection = Pipe()
+      process = Process(target=run_replica, daemon=True,
+          args=(replica_connection, [trip.copy() for trip in trips], trips.trip_ids, random_seed + i))
+      process.start()
+      replica_connection.close()
+      connections.append(connection)
+      processes.append(process)
+
+    try:
+      for exchange in range(1, exchanges + 1):
+        for connection, slot in zip(connections, slot_of_replica):
+          connection.send(("anneal", (ladder[slot], exchange_interval)))
+        results = [connection.recv() for connection in connections]
+        costs = np.array([cost for cost, _ in results])
+        for (_, replica_outcomes), slot in zip(results, slot_of_replica):
+          for outcome, count in replica_outcomes.items():
+            outcomes[slot][outcome] += count
+
+        # keep the best solution of all replicas
+        best_replica = int(np.argmin(costs))
+        if costs[best_replica] < best_cost:
+          connections[best_replica].send(("trips", None))
+          best = Solution(*connections[best_replica].recv())
+          best_cost = costs[best_replica]
+        best_costs.append(best_cost)
+
+        # try to swap the temperatures of neighboring pairs (alternating between even and odd pairs)
+        replica_at_slot = np.argsort(slot_of_replica)
+        for slot in range(exchange % 2, replicas - 1, 2):
+          colder, hotter = replica_at_slot[slot], replica_at_slot[slot + 1]
+          swap_attempts[slot] += 1
+          exponent = (costs[colder] - costs[hotter]) * (1.0 / ladder[slot] - 1.0 / ladder[slot + 1])
+          if exponent >= 0 or np.exp(exponent) > np.random.rand():
+            slot_of_replica[colder], slot_of_replica[hotter] = slot + 1, slot
+            swaps[slot] += 1
+
+        i = exchange * exchange_interval
+        if i % log_interval < exchange_interval or exchange == exchanges:
+          self.log.debug("{:>6}/{}: best cost: {:.1f}M ({:.1f}M), acc per T: {}, swaps per pair: {}".format(
+            i, iterations, best_cost / 1e6, (best_cost - initial_cost) / 1e6,
+            "/".join("{:.1f}%".format(100.0 * o["acc"] / (o["acc"] + o["rej"] + 1e-6)) for o in outcomes),
+            "/".join("{:.1f}%".format(100.0 * s / (a + 1e-6)) for s, a in zip(swaps, swap_attempts))))
+
+        if i % checkpoint_interval < exchange_interval and exchange != exchanges:
+          if not self.create_checkpoint(best, i, iterations, exchange_interval, args.evaluation_id, args.random_seed,
+              list(ladder), [o["good"] for o in outcomes], [o["acc"] for o in outcomes], [o["rej"] for o in outcomes],
+              best_costs):
+            self.log.error("Aborting evaluation because the current solution is invalid")
+            break
+    finally:
+      for connection in connections:
+        connection.send(("stop", None))
+      for process in processes:
+        process.join()
+
+    for t, o in zip(ladder, outcomes):
+      self.log.info("T={:>9.1f}: {} good, {} accepted/{} rejected bad solutions ({:.1f}% acceptance)".format(
+        t, o["good"], o["acc"], o["rej"], 100.0 * o["acc"] / (o["acc"] + o["rej"] + 1e-6)))
+    for slot in range(replicas - 1):
+      self.log.info("Swaps between T={:.1f} and T={:.1f}: {}/{} ({:.1f}%)".format(
+        ladder[slot], ladder[slot + 1], swaps[slot], swap_attempts[slot], 100.0 * swaps[slot] / (swap_attempts[slot] + 1e-6)))
+    self.log.info("Finished parallel tempering with {} replicas, best cost change of {:.3f}M".format(
+      replicas, (best_cost - initial_cost) / 1e6))
+    return best
 
   def check_gifts(self, trips, neighbor, print_weights=False):
     if not Neighbor.VERIFY_COST_DELTA:
       return
 
     for i, trip in enumerate(trips):
-      if len(set(trip[:, utils.TRIP])) != 1:
-        self.log.error("Trip has gifts with unexpected number of trip IDs: {} (previous move: {})".format(set(trip[:, utils.TRIP]), str(neighbor)))
-        print(i, trip[:, utils.TRIP])
+      if np.any(trips.trip_of_gift[trip] != i):
+        self.log.error("Trip has gifts that are assigned to other trips: {} (previous move: {})".format(
+          set(trips.trip_of_gift[trip]), str(neighbor)))
+        print(i, trips.trip_of_gift[trip])
         raise ValueError()
 
-    weights = [np.sum(t[:, utils.WEIGHT]) for t in trips]
+    weights = trips.weights
     if print_weights:
       print("weights", np.max(weights))
     if np.max(weights) > utils.WEIGHT_LIMIT:
       self.log.error("Trip with invalid weight: {} (previous move: {})".format(np.max(weights), str(neighbor)))
       raise ValueError()
 
-    gifts = [t[:, utils.GIFT] for t in trips]
-    flattened = [val for sublist in gifts for val in sublist]
-    gifts = np.unique(flattened)
+    gifts = np.unique(np.concatenate(list(trips)))
     if len(gifts) != 100000:
       self.log.error("Wrong number of gifts: {} (previous move: {})".format(len(gifts), str(neighbor)))
       raise ValueError()
 
   def create_checkpoint(self, trips, i, iterations, metrics_interval, evaluation_id, random_seed,
       temperatures, good_solutions, accepted_solutions, rejected_solutions, costs):
-    checkpoint_file = "checkpoints/{}_{}_{}.csv".format(evaluation_id, random_seed, i)
+    checkpoint_file = "checkpoints/{}_{}_{}.npy".format(evaluation_id, random_seed, i)
     metrics_file = "checkpoints/metrics_{}_{}_{}.pkl".format(evaluation_id, random_seed, i)
     self.log.info("{:>6}/{}: Creating checkpoint {}, {}".format(i, iterations, checkpoint_file, metrics_file))
 
     # extract gift/trip mapping
-    combined_trips = np.concatenate(trips)[:, [0, 1]]
-    self.trips = pd.DataFrame(combined_trips, columns=["GiftId", "TripId"])
+    self.trips = trips.to_frame()
     self.write_trips(checkpoint_file)
 
     with open(metrics_file, "wb") as fh:
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+
+import utils
+from method import Method
+
+
+def sweep_trips(longitudes, latitudes, weights, cluster_width, trip_weight):
+  """Polar sweep: cuts the globe into clusters of `cluster_width` degrees of longitude and sweeps
+  through each cluster by longitude, starting a new trip whenever the gifts so far reach the trip weight.
+
+  A gift starts a new trip if the weight of the gifts before it in the cluster reaches the next multiple
+  of the trip weight, so no trip is heavier than the trip weight plus the weight of its last gift.
+
+  :longitudes: Numpy array with the longitudes of the gifts
+  :latitudes: Numpy array with the latitudes of the gifts
+  :weights: Numpy array with the weights of the gifts
+  :cluster_width: Width of each cluster in degrees of longitude
+  :trip_weight: Target weight of each trip
+
+  :returns: Tuple with the indexes of the gifts in order of delivery and the TripId (starting at 1) of each
+  of these gifts, each trip is delivered from north to south
+  """
+  clusters = np.floor((longitudes + 180) / cluster_width).astype(np.int64)
+  order = np.lexsort((longitudes, clusters))
+  clusters = clusters[order]
+  cluster_start = np.ones(len(order), dtype=bool)
+  cluster_start[1:] = clusters[1:] != clusters[:-1]
+
+  # weight of the gifts before each gift within its cluster
+  weight_before = np.cumsum(weights[order]) - weights[order]
+  weight_before -= np.maximum.accumulate(np.where(cluster_start, weight_before, 0.0))
+  groups = np.floor(weight_before / trip_weight).astype(np.int64)
+
+  new_trip = np.ones(len(order), dtype=bool)
+  new_trip[1:] = cluster_start[1:] | (groups[1:] != groups[:-1])
+  trip_ids = np.cumsum(new_trip)
+
+  # each trip from north to south
+  by_latitude = np.lexsort((-latitudes[order], trip_ids))
+  return order[by_latitude], trip_ids[by_latitude]
+
+
+class SweepMethod(Method):
+  @property
+  def name(self):
+    return "sweep"
+
+  def run(self, args):
+    """
+    Idea: Create valid trips by sweeping around the north pole: each trip takes the next gifts by longitude
+    until it's full, without crossing the boundary of a cluster of longitudes. Then deliver the gifts of
+    each trip from north to south.
+    """
+    cluster_width = args.cluster_width if args.cluster_width is not None else 360.0
+    trip_weight = args.trip_weight if args.trip_weight is not None else utils.WEIGHT_LIMIT - self.gifts.Weight.max()
+
+    # the last gift may exceed the trip weight
+    max_trip_weight = utils.WEIGHT_LIMIT - self.gifts.Weight.max()
+    if trip_weight > max_trip_weight:
+      self.log.warning("Reducing the trip weight from {} to {} to keep the trips valid".format(trip_weight, max_trip_weight))
+      trip_weight = max_trip_weight
+
+    self.log.info("Sweeping clusters of {} degrees into trips of {} weight".format(cluster_width, trip_weight))
+    order, trip_ids = sweep_trips(self.gifts.Longitude.values, self.gifts.Latitude.values, self.gifts.Weight.values,
+        cluster_width, trip_weight)
+    self.trips = pd.DataFrame({"GiftId": self.gifts.GiftId.values[order], "TripId": trip_ids})
@@ -1,11 +1,81 @@
 #!/usr/bin/env python
 
+from collections import deque
+
 import numpy as np
-import pandas as pd
-import utils
+import local_search
 from method import Method
-from neighbors import (OptimalMoveGiftInTripNeighbor,
-                       OptimalSwapInRandomTripNeighbor)
+from solution import Solution
+from neighbors import OptimalMoveGiftInTripNeighbor
+from workers import optimize_trips
+
+
+def apply_best_swaps(trip, swaps_per_trip=10):
+  """Applies the best of all swaps of a trip up to x times.
+
+  :trip: Numpy array with the GiftIds of the trip
+  :swaps_per_trip: Maximum number of swaps
+
+  :returns: Tuple with the GiftIds of the optimized trip, the (negative) cost change and the number of swaps
+  """
+  trips = Solution([trip])
+  total_improvement = 0
+  swaps = 0
+  for _ in range(swaps_per_trip):
+    first, second, cost = trips.cost_model(0).best_swap()
+    if cost >= 0:
+      break
+    total_improvement += cost
+    swaps += 1
+    trips.swap_gifts(0, first, second)
+  return trips[0].copy(), total_improvement, swaps
+
+def optimize_trip_thoroughly(trip):
+  """Applies 2-opt and Or-opt moves until none of them improves the trip, then moves single gifts
+  to their best position until none of them can be moved to a better position.
+
+  :trip: Numpy array with the GiftIds of the trip
+
+  :returns: Tuple with the GiftIds of the optimized trip, the cost change and number of 2-opt/Or-opt moves, the
+  cost change and number of gift moves and the number of evaluated gift moves
+  """
+  trips = Solution([trip])
+  optimized_trip, local_search_improvement, moves = local_search.optimize_trip(trip)
+  if moves > 0:
+    trips[0] = optimized_trip
+
+  # don't-look bits: every gift is checked once, afterwards only the gifts next to the old and new
+  # position of a moved gift are checked again, since the moves of all other gifts cost the same as before
+  queue = deque(int(gift) for gift in np.random.permutation(trips[0]))
+  queued = set(queue)
+  swaps = 0
+  evaluations = 0
+  improvement = 0
+  min_improvement = -1e-9 * trips.cost(0) # ignore "improvements" that are just rounding errors
+  while queue:
+    gift = queue.popleft()
+    queued.remove(gift)
+    trip = trips[0]
+    index = int(np.flatnonzero(trip == gift)[0])
+    adjacent = list(trip[max(index-1, 0):index+2])
+
+    neighbor = OptimalMoveGiftInTripNeighbor(trips, trip=0, gift_index=index)
+    # neighbor = OptimalSwapInRandomTripNeighbor(trips, trip=0, first_gift=index)
+    evaluations += 1
+    if neighbor.cost_delta() < min_improvement:
+      improvement += neighbor.cost_delta()
+      swaps += 1
+      neighbor.apply()
+
+      trip = trips[0]
+      index = int(np.flatnonzero(trip == gift)[0])
+      adjacent += list(trip[max(index-1, 0):index+2])
+      for other in adjacent:
+        if other not in queued:
+          queue.append(int(other))
+          queued.add(int(other))
+
+  return trips[0].copy(), local_search_improvement, moves, improvement, swaps, evaluations
 
 
 class RandomTspOptimizeTripMethod(Method):
@@ -21,38 +91,23 @@ class RandomTspOptimizeTripMethod(Method):
     Idea: Load existing valid solution and improve it by improving the order of gift distribution
     within a single trip. For each trip, select x elements and swap it with the other element that
     yields the largest decrease in cost.
+    Instead of random elements, the best of all swaps of the trip is applied each time.
     """
     all_trips = self._load_trips_from_file(args)
     if all_trips is None:
       return
-    swaps_per_trip = 10
 
     # split all trips into separate trips
-    trips = [all_trips[all_trips.TripId == t].values for t in all_trips.TripId.unique()]
+    trips = Solution.from_frame(all_trips)
 
     # process each trip separately
-    for i, trip in enumerate(trips):
-      if i % 100 == 0:
-        self.log.info("Optimizing trip {}...".format(i))
-
-      # for each trip, swap x random items
-      total_improvement = 0
-      swaps = 0
-      for _ in range(swaps_per_trip):
-        neighbor = OptimalSwapInRandomTripNeighbor(trips, self.log, trip=trip)
-        if neighbor.cost_delta() < 0:
-          total_improvement += neighbor.cost_delta()
-          swaps += 1
-          neighbor.apply()
-
-      self.log.debug("Swapped {} locations with a total improvement of {}".format(swaps, total_improvement))
-
-      # done processing the trip, write back the permutated trip
+    results = optimize_trips(list(trips), apply_best_swaps, args.processes, args.random_seed, self.log)
+    for i, (trip, total_improvement, swaps) in enumerate(results):
       trips[i] = trip
+      self.log.debug("Swapped {} locations with a total improvement of {}".format(swaps, total_improvement))
 
     # extract gift/trip mapping
-    combined_trips = np.concatenate(trips)[:, [utils.GIFT, utils.TRIP]]
-    self.trips = pd.DataFrame(combined_trips, columns=["GiftId", "TripId"])
+    self.trips = trips.to_frame()
 
 
 class ThoroughTspOptimizeTripMethod(Method):
@@ -66,64 +121,25 @@ class ThoroughTspOptimizeTripMethod(Method):
   def run(self, args):
     """
     Idea: Load existing valid solution and improve it by improving the order of gift distribution
-    within a single trip. Until at least half the elements weren't moved, improve each trip by
-    swapping an element with one that provides the largest decrease in cost.
+    within a single trip. First, 2-opt and Or-opt moves are applied until none of them improves the trip.
+    Then, improve each trip by moving elements to the position that provides the largest decrease in cost
+    until no element can be moved to a better position.
     """
     all_trips = self._load_trips_from_file(args)
     if all_trips is None:
       return
 
     # split all trips into separate trips
-    trips = [all_trips[all_trips.TripId == t].values for t in all_trips.TripId.unique()]
+    trips = Solution.from_frame(all_trips)
 
     # process each trip separately
-    for i, trip in enumerate(trips):
-      if i % 100 == 0 and i != 0:
-        checkpoint_file = "checkpoints/{}_{}_{}.csv".format(args.evaluation_id, args.random_seed, i)
-        self.log.info("{:>6}/{}: Creating checkpoint '{}'".format(i, len(trips), checkpoint_file))
-        combined_trips = np.concatenate(trips)[:, [0, 1]]
-        self.trips = pd.DataFrame(combined_trips, columns=["GiftId", "TripId"])
-        self.write_trips(checkpoint_file)
-
-      swaps = 0
-      improvement = 0
-      current_improvement = 0
-      no_improvement_count = 0
-      abort_after_x_without_improvement = int(len(trip) * 0.9)
-      min_tries = 10
-      min_improvement = -1e2
-      tries = 0
-      # try at least min_tries times and as long as there's some "considerable" improvement
-      while current_improvement < min_improvement or min_tries > tries:
-        current_improvement = 0
-        current_swaps = 0
-        current_no_improvement_count = 0
-        tries += 1
-
-        # try to improve in random order until swapping half the gifts failed to improve the solution
-        indexes = np.random.permutation(range(len(trip)))
-        for index in indexes:
-          neighbor = OptimalMoveGiftInTripNeighbor(trips, self.log, trip=i, gift_index=index)
-          # neighbor = OptimalSwapInRandomTripNeighbor(trips, self.log, trip=trip, first_gift=index)
-          if neighbor.cost_delta() < 0:
-            improvement += neighbor.cost_delta()
-            current_improvement += neighbor.cost_delta()
-            swaps += 1
-            current_swaps += 1
-            neighbor.apply()
-          else:
-            no_improvement_count += 1
-            current_no_improvement_count += 1
-            if current_no_improvement_count - current_swaps > abort_after_x_without_improvement:
-              break
-
-      self.log.debug("Checked {:>3d} in {} tries for {:>3d}-gift trip: swapped {:>2d} gifts with an improvement of {:.3}M".format(
-        swaps + no_improvement_count, tries, len(trip), swaps, improvement / 1e6))
-
-      # done processing the trip, write back the permutated trip
+    results = optimize_trips(list(trips), optimize_trip_thoroughly, args.processes, args.random_seed, self.log)
+    for i, (trip, local_search_improvement, moves, improvement, swaps, evaluations) in enumerate(results):
       trips[i] = trip
+      self.log.debug("Applied {:>3d} 2-opt/Or-opt moves to {:>3d}-gift trip with an improvement of {:.3}M".format(
+        moves, len(trip), local_search_improvement / 1e6))
+      self.log.debug("Checked {:>4d} gifts for {:>3d}-gift trip: moved {:>2d} gifts with an improvement of {:.3}M".format(
+        evaluations, len(trip), swaps, improvement / 1e6))
 
     # extract gift/trip mapping
-    combined_trips = np.concatenate(trips)[:, [utils.GIFT, utils.TRIP]]
-    self.trips = pd.DataFrame(combined_trips, columns=["GiftId", "TripId"])
-
+    self.trips = trips.to_frame()
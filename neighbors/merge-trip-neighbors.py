@@ -19,7 +19,8 @@ class MergeTripIntoOthersNeighbor(Neighbor):
     return "merge-{}-into-others".format(self.trip_to_merge)
 
   def _find_trip_to_merge(self):
-    weights = [np.sum(trip[:, utils.WEIGHT]) for trip in self.trips]
+    weights = self.trips.weights
+    gift_weights = utils.get_gift_table().weights
     median_weight = np.median(weights)
 
     trips_to_check = np.random.permutation(len(self.trips))
@@ -27,13 +28,13 @@ class MergeTripIntoOthersNeighbor(Neighbor):
     # check all trips (in random order) to see whether they may be merged into the other trips
     for trip_index in trips_to_check:
       trip = self.trips[trip_index]
-      trip_weight = np.sum(trip[:, utils.WEIGHT])
+      trip_weight = weights[trip_index]
       if trip_weight > median_weight:
         # large trips are unlikely to be merged successfully
         continue
 
       # sort gifts by descending weight
-      sorting_indices = trip[:, utils.WEIGHT].argsort()[::-1]
+      sorting_indices = gift_weights[trip].argsort()[::-1]
       sorted_gifts = trip[sorting_indices]
 
       # try to assign all gifts of the current trip to other trips
@@ -43,14 +44,11 @@ class MergeTripIntoOthersNeighbor(Neighbor):
         # find a new trip that can accommodate the gift - we only try trips that haven't been modified yet
         # that 1. is more balanced and 2. makes it possible to easily calculate costs
         host_found = False
-        shuffled_trips = [(i, t) for i, t in enumerate(self.trips)]
-        np.random.shuffle(shuffled_trips)
-        for i, host_trip in shuffled_trips:
-          # print(i, host_trip)
+        for i in np.random.permutation(len(self.trips)):
           if i in gift_assignment.keys() or i == trip_index:
             # we don't want to insert into trips that already receive a new item or into the trip we're trying to merge
             continue
-          if gift[utils.WEIGHT] + host_trip[:, utils.WEIGHT].sum() < utils.WEIGHT_LIMIT:
+          if gift_weights[gift] + weights[i] < utils.WEIGHT_LIMIT:
             gift_assignment[i] = gift
             host_found = True
             break
@@ -78,11 +76,12 @@ class MergeTripIntoOthersNeighbor(Neighbor):
     cost_of_insertions = 0
 
     for trip_index, gift in self.trip_assignments_for_gifts.items():
-      index_in_trip, cost = Neighbor.find_best_insertion_index(self.trips[trip_index], gift)
+      host_trip = self.trips.cost_model(trip_index)
+      index_in_trip, cost = host_trip.best_insertion(gift)
       self.gift_insertions.append((gift, trip_index, index_in_trip))
       cost_of_insertions += cost
 
-    self.cost = cost_of_insertions - utils.weighted_trip_length(trip[:, utils.LOCATION], trip[:, utils.WEIGHT])
+    self.cost = cost_of_insertions - self.trips.cost(self.trip_to_merge)
     return self.cost
 
   def apply(self):
@@ -95,18 +94,17 @@ class MergeTripIntoOthersNeighbor(Neighbor):
     trip = self.trips[self.trip_to_merge]
 
     if self.VERIFY_COST_DELTA:
-      old = utils.weighted_trip_length(trip[:, utils.LOCATION], trip[:, utils.WEIGHT])
+      old = self.weighted_trip_length(trip)
       for trip_index in self.trip_assignments_for_gifts.keys():
-        old += utils.weighted_trip_length(self.trips[trip_index][:, utils.LOCATION], self.trips[trip_index][:, utils.WEIGHT])
+        old += self.weighted_trip_length(self.trips[trip_index])
 
     for gift, trip_index, index_in_trip in self.gift_insertions:
-      gift[utils.TRIP] = self.trips[trip_index][0,1]
-      self.trips[trip_index] = np.insert(self.trips[trip_index], index_in_trip, gift, axis=0)
+      self.trips.insert_gift(trip_index, index_in_trip, gift)
 
     if self.VERIFY_COST_DELTA:
       new = 0
       for trip_index in self.trip_assignments_for_gifts.keys():
-        new += utils.weighted_trip_length(self.trips[trip_index][:, utils.LOCATION], self.trips[trip_index][:, utils.WEIGHT])
+        new += self.weighted_trip_length(self.trips[trip_index])
       utils.verify_costs_are_equal(self.cost_delta(), new-old)
 
     # only delete the row afterwards to not mess up the indexes for the cost calculation
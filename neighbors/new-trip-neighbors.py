@@ -12,7 +12,7 @@ class SplitOneTripIntoTwoNeighbor(Neighbor):
   def __init__(self, trips):
     self.trips = trips
     self.trip = np.random.randint(len(trips))
-    while len(self.trips[self.trip]) < 2:
+    while self.trips.stops[self.trip] < 2:
       self.trip = np.random.randint(len(trips))
     self.index_to_split = None
     super(SplitOneTripIntoTwoNeighbor, self).__init__()
@@ -21,6 +21,7 @@ class SplitOneTripIntoTwoNeighbor(Neighbor):
     return "split-{}-at-{}".format(self.trip, self.index_to_split)
 
   def _find_best_split_index(self, trip):
+    gift_table = utils.get_gift_table()
     minimum_cost = np.finfo(np.float64).max
     best_index = None
 
@@ -28,8 +29,8 @@ class SplitOneTripIntoTwoNeighbor(Neighbor):
     for i in range(1, len(trip)):
       first_trip = trip[:i]
       second_trip = trip[i:]
-      cost_first_trip = utils.weighted_trip_length(first_trip[:, utils.LOCATION],first_trip[:, utils.WEIGHT])
-      cost_second_trip = utils.weighted_trip_length(second_trip[:, utils.LOCATION],second_trip[:, utils.WEIGHT])
+      cost_first_trip = gift_table.trip_cost(first_trip)
+      cost_second_trip = gift_table.trip_cost(second_trip)
       current_cost = cost_first_trip + cost_second_trip
       if current_cost < minimum_cost:
         minimum_cost = current_cost
@@ -41,7 +42,7 @@ class SplitOneTripIntoTwoNeighbor(Neighbor):
       return self.cost
 
     trip = self.trips[self.trip]
-    cost_of_old_trip = utils.weighted_trip_length(trip[:, utils.LOCATION], trip[:, utils.WEIGHT])
+    cost_of_old_trip = self.trips.cost(self.trip)
 
     # find split index with minimum cost
     self.index_to_split, cost_of_split = self._find_best_split_index(trip)
@@ -55,18 +56,15 @@ class SplitOneTripIntoTwoNeighbor(Neighbor):
     trip = self.trips[self.trip]
 
     if self.VERIFY_COST_DELTA:
-      old = utils.weighted_trip_length(trip[:, utils.LOCATION], trip[:, utils.WEIGHT])
+      old = self.weighted_trip_length(trip)
 
-    new_trip = trip[self.index_to_split:]
-    existing_trips = [t[0, utils.TRIP] for t in self.trips]
-    new_trip_id = np.max(existing_trips) + 1
-    new_trip[:, utils.TRIP] = new_trip_id
+    new_trip = trip[self.index_to_split:].copy()
     self.trips[self.trip] = trip[:self.index_to_split]
     self.trips.append(new_trip)
 
     if self.VERIFY_COST_DELTA:
-      new = utils.weighted_trip_length(self.trips[self.trip][:, utils.LOCATION], self.trips[self.trip][:, utils.WEIGHT]) + \
-          utils.weighted_trip_length(new_trip[:, utils.LOCATION], new_trip[:, utils.WEIGHT])
+      new = self.weighted_trip_length(self.trips[self.trip]) + \
+          self.weighted_trip_length(new_trip)
       utils.verify_costs_are_equal(self.cost_delta(), new-old)
 
 
@@ -74,7 +72,7 @@ class OptimalHorizontalTripSplitNeighbor(Neighbor):
   def __init__(self, trips, trip=None):
     self.trips = trips
     self.trip = np.random.randint(len(trips)) if trip is None else trip
-    while len(self.trips[self.trip]) < 4:
+    while self.trips.stops[self.trip] < 4:
       self.trip = np.random.randint(len(trips))
     self.longitude_to_split = None
     self.first_trip_percentage = None # percentage of gifts that remain in the first trip
@@ -88,26 +86,27 @@ class OptimalHorizontalTripSplitNeighbor(Neighbor):
       return self.cost
 
     trip = self.trips[self.trip]
-    cost_of_old_trip = utils.weighted_trip_length(trip[:, utils.LOCATION], trip[:, utils.WEIGHT])
+    gift_table = utils.get_gift_table()
+    cost_of_old_trip = self.trips.cost(self.trip)
 
     # check splitting in the middle third of longitudes
-    longitudes = np.sort(trip[:, utils.LON][:])[int(len(trip)/3.0):int(len(trip)*2.0/3)]
+    longitudes = np.sort(gift_table.locations[trip, 1])[int(len(trip)/3.0):int(len(trip)*2.0/3)]
 
     minimum_cost = np.finfo(np.float64).max
 
     for i, lon in enumerate(longitudes):
       # split trips and sort by LAT descending
-      trip_1 = trip[trip[:, utils.LON] < lon]
-      trip_1 = trip_1[trip_1[:, utils.LAT].argsort()[::-1]]
-      trip_2 = trip[trip[:, utils.LON] >= lon]
-      trip_2 = trip_2[trip_2[:, utils.LAT].argsort()[::-1]]
+      trip_1 = trip[gift_table.locations[trip, 1] < lon]
+      trip_1 = trip_1[gift_table.locations[trip_1, 0].argsort()[::-1]]
+      trip_2 = trip[gift_table.locations[trip, 1] >= lon]
+      trip_2 = trip_2[gift_table.locations[trip_2, 0].argsort()[::-1]]
 
       if len(trip_1) * len(trip_2) == 0:
         # don't split here if one of the resulting trips is empty
         continue
 
-      cost_2_1 = utils.weighted_trip_length(trip_1[:, utils.LOCATION], trip_1[:, utils.WEIGHT])
-      cost_2_2 = utils.weighted_trip_length(trip_2[:, utils.LOCATION], trip_2[:, utils.WEIGHT])
+      cost_2_1 = gift_table.trip_cost(trip_1)
+      cost_2_2 = gift_table.trip_cost(trip_2)
       if cost_2_1 + cost_2_2 < minimum_cost:
         minimum_cost = cost_2_1 + cost_2_2
         self.longitude_to_split = lon
@@ -121,23 +120,21 @@ class OptimalHorizontalTripSplitNeighbor(Neighbor):
     trip = self.trips[self.trip]
 
     if self.VERIFY_COST_DELTA:
-      old = utils.weighted_trip_length(trip[:, utils.LOCATION], trip[:, utils.WEIGHT])
+      old = self.weighted_trip_length(trip)
 
-    trip_1 = trip[trip[:, utils.LON] < self.longitude_to_split]
-    trip_1 = trip_1[trip_1[:, utils.LAT].argsort()[::-1]]
-    trip_2 = trip[trip[:, utils.LON] >= self.longitude_to_split]
-    trip_2 = trip_2[trip_2[:, utils.LAT].argsort()[::-1]]
+    gift_table = utils.get_gift_table()
+    trip_1 = trip[gift_table.locations[trip, 1] < self.longitude_to_split]
+    trip_1 = trip_1[gift_table.locations[trip_1, 0].argsort()[::-1]]
+    trip_2 = trip[gift_table.locations[trip, 1] >= self.longitude_to_split]
+    trip_2 = trip_2[gift_table.locations[trip_2, 0].argsort()[::-1]]
     self.first_trip_percentage = len(trip_1) / len(trip)
 
-    existing_trips = [t[0, utils.TRIP] for t in self.trips]
-    new_trip_id = np.max(existing_trips) + 1
-    trip_2[:, utils.TRIP] = new_trip_id
     self.trips[self.trip] = trip_1
     self.trips.append(trip_2)
 
     if self.VERIFY_COST_DELTA:
-      new = utils.weighted_trip_length(self.trips[self.trip][:, utils.LOCATION], self.trips[self.trip][:, utils.WEIGHT]) + \
-          utils.weighted_trip_length(trip_2[:, utils.LOCATION], trip_2[:, utils.WEIGHT])
+      new = self.weighted_trip_length(self.trips[self.trip]) + \
+          self.weighted_trip_length(trip_2)
       utils.verify_costs_are_equal(self.cost_delta(), new-old)
 
 
@@ -145,7 +142,7 @@ class OptimalVerticalTripSplitNeighbor(Neighbor):
   def __init__(self, trips, trip=None):
     self.trips = trips
     self.trip = np.random.randint(len(trips)) if trip is None else trip
-    while len(self.trips[self.trip]) < 4:
+    while self.trips.stops[self.trip] < 4:
       self.trip = np.random.randint(len(trips))
     self.latitude_to_split = None
     super(OptimalVerticalTripSplitNeighbor, self).__init__()
@@ -158,26 +155,27 @@ class OptimalVerticalTripSplitNeighbor(Neighbor):
       return self.cost
 
     trip = self.trips[self.trip]
-    cost_of_old_trip = utils.weighted_trip_length(trip[:, utils.LOCATION], trip[:, utils.WEIGHT])
+    gift_table = utils.get_gift_table()
+    cost_of_old_trip = self.trips.cost(self.trip)
 
     # check splitting in the middle third of latitudes
-    latitudes = np.sort(trip[:, utils.LAT][:])[int(len(trip)/3.0):int(len(trip)*2.0/3)]
+    latitudes = np.sort(gift_table.locations[trip, 0])[int(len(trip)/3.0):int(len(trip)*2.0/3)]
 
     minimum_cost = np.finfo(np.float64).max
 
     for i, lat in enumerate(latitudes):
       # split trips and sort by LON descending
-      trip_1 = trip[trip[:, utils.LAT] < lat]
-      trip_1 = trip_1[trip_1[:, utils.LON].argsort()[::-1]]
-      trip_2 = trip[trip[:, utils.LAT] >= lat]
-      trip_2 = trip_2[trip_2[:, utils.LON].argsort()[::-1]]
+      trip_1 = trip[gift_table.locations[trip, 0] < lat]
+      trip_1 = trip_1[gift_table.locations[trip_1, 1].argsort()[::-1]]
+      trip_2 = trip[gift_table.locations[trip, 0] >= lat]
+      trip_2 = trip_2[gift_table.locations[trip_2, 1].argsort()[::-1]]
 
       if len(trip_1) * len(trip_2) == 0:
         # don't split here if one of the resulting trips is empty
         continue
 
-      cost_2_1 = utils.weighted_trip_length(trip_1[:, utils.LOCATION], trip_1[:, utils.WEIGHT])
-      cost_2_2 = utils.weighted_trip_length(trip_2[:, utils.LOCATION], trip_2[:, utils.WEIGHT])
+      cost_2_1 = gift_table.trip_cost(trip_1)
+      cost_2_2 = gift_table.trip_cost(trip_2)
       if cost_2_1 + cost_2_2 < minimum_cost:
         minimum_cost = cost_2_1 + cost_2_2
         self.latitude_to_split = lat
@@ -191,21 +189,19 @@ class OptimalVerticalTripSplitNeighbor(Neighbor):
     trip = self.trips[self.trip]
 
     if self.VERIFY_COST_DELTA:
-      old = utils.weighted_trip_length(trip[:, utils.LOCATION], trip[:, utils.WEIGHT])
+      old = self.weighted_trip_length(trip)
 
-    trip_1 = trip[trip[:, utils.LAT] < self.latitude_to_split]
-    trip_1 = trip_1[trip_1[:, utils.LON].argsort()[::-1]]
-    trip_2 = trip[trip[:, utils.LAT] >= self.latitude_to_split]
-    trip_2 = trip_2[trip_2[:, utils.LON].argsort()[::-1]]
+    gift_table = utils.get_gift_table()
+    trip_1 = trip[gift_table.locations[trip, 0] < self.latitude_to_split]
+    trip_1 = trip_1[gift_table.locations[trip_1, 1].argsort()[::-1]]
+    trip_2 = trip[gift_table.locations[trip, 0] >= self.latitude_to_split]
+    trip_2 = trip_2[gift_table.locations[trip_2, 1].argsort()[::-1]]
 
-    existing_trips = [t[0, utils.TRIP] for t in self.trips]
-    new_trip_id = np.max(existing_trips) + 1
-    trip_2[:, utils.TRIP] = new_trip_id
     self.trips[self.trip] = trip_1
     self.trips.append(trip_2)
 
     if self.VERIFY_COST_DELTA:
-      new = utils.weighted_trip_length(self.trips[self.trip][:, utils.LOCATION], self.trips[self.trip][:, utils.WEIGHT]) + \
-          utils.weighted_trip_length(trip_2[:, utils.LOCATION], trip_2[:, utils.WEIGHT])
+      new = self.weighted_trip_length(self.trips[self.trip]) + \
+          self.weighted_trip_length(trip_2)
       utils.verify_costs_are_equal(self.cost_delta(), new-old)
 
@@ -4,17 +4,22 @@
 import numpy as np
 import pandas as pd
 
+import local_search
 import utils
+from cost_model import TripCostModel
 from neighbor import Neighbor
 
 
 class SwapRandomGiftsInTripNeighbor(Neighbor):
   def __init__(self, trips):
+    self.trips = trips
+
     # don't overwrite existing trip
-    if not hasattr(self, "trip"):
-      self.trip = trips[np.random.randint(len(trips))]
-      while len(self.trip) < 2:
-        self.trip = trips[np.random.randint(len(trips))]
+    if not hasattr(self, "trip_index"):
+      self.trip_index = np.random.randint(len(trips))
+      while trips.stops[self.trip_index] < 2:
+        self.trip_index = np.random.randint(len(trips))
+    self.trip = trips[self.trip_index]
 
     # don't overwrite existing gifts
     if not hasattr(self, "first_gift"):
@@ -27,15 +32,25 @@ class SwapRandomGiftsInTripNeighbor(Neighbor):
     super(SwapRandomGiftsInTripNeighbor, self).__init__()
 
   def __str__(self):
-    return "{}-random-swap-{}-{}".format(int(self.trip[0][1]), self.first_gift, self.second_gift)
+    return "{}-random-swap-{}-{}".format(self.trips.trip_ids[self.trip_index], self.first_gift, self.second_gift)
+
+  def __getstate__(self):
+    state = super(SwapRandomGiftsInTripNeighbor, self).__getstate__()
+    state.pop("trip", None)
+    return state
+
+  def attach(self, trips):
+    super(SwapRandomGiftsInTripNeighbor, self).attach(trips)
+    self.trip = trips[self.trip_index]
 
   def _get_cost_of_swapping_adjacent(self, a, b, c, d, cumulative_weight_at_a, weight_at_b, weight_at_c):
-    old_cost = utils.distance(a, b) * cumulative_weight_at_a + \
-        utils.distance(b, c) * (cumulative_weight_at_a - weight_at_b) + \
-        utils.distance(c, d) * (cumulative_weight_at_a - weight_at_b - weight_at_c)
-    new_cost = utils.distance(a, c) * cumulative_weight_at_a + \
-        utils.distance(c, b) * (cumulative_weight_at_a - weight_at_c) + \
-        utils.distance(b, d) * (cumulative_weight_at_a - weight_at_c - weight_at_b)
+    distance = utils.get_gift_table().distance
+    old_cost = distance(a, b) * cumulative_weight_at_a + \
+        distance(b, c) * (cumulative_weight_at_a - weight_at_b) + \
+        distance(c, d) * (cumulative_weight_at_a - weight_at_b - weight_at_c)
+    new_cost = distance(a, c) * cumulative_weight_at_a + \
+        distance(c, b) * (cumulative_weight_at_a - weight_at_c) + \
+        distance(b, d) * (cumulative_weight_at_a - weight_at_c - weight_at_b)
     return new_cost - old_cost
 
   def _calculate_cost_of_swapping_items(self, first, second):
@@ -43,19 +58,22 @@ class SwapRandomGiftsInTripNeighbor(Neighbor):
     j = max(first, second)
 
     # set up weights
-    weight_diff = self.trip[i][utils.WEIGHT] - self.trip[j][utils.WEIGHT]
-    cum_weight_before_i = np.sum(self.trip[i:][:, utils.WEIGHT]) + utils.SLEIGH_WEIGHT
-    cum_weight_before_j = np.sum(self.trip[j:][:, utils.WEIGHT]) + utils.SLEIGH_WEIGHT
-    weight_i = self.trip[i][utils.WEIGHT]
-    weight_j = self.trip[j][utils.WEIGHT]
+    gift_table = utils.get_gift_table()
+    weights = gift_table.weights[self.trip]
+    weight_diff = weights[i] - weights[j]
+    cum_weight_before_i = np.sum(weights[i:]) + utils.SLEIGH_WEIGHT
+    cum_weight_before_j = np.sum(weights[j:]) + utils.SLEIGH_WEIGHT
+    weight_i = weights[i]
+    weight_j = weights[j]
 
     # set up locations
-    before_i = tuple(self.trip[i-1][[utils.LAT, utils.LON]]) if i > 0 else utils.NORTH_POLE
-    before_j = tuple(self.trip[j-1][[utils.LAT, utils.LON]]) if j > 0 else utils.NORTH_POLE
-    at_i = tuple(self.trip[i][[utils.LAT, utils.LON]])
-    at_j = tuple(self.trip[j][[utils.LAT, utils.LON]])
-    after_i = tuple(self.trip[i+1][[utils.LAT, utils.LON]]) if i < len(self.trip)-1 else utils.NORTH_POLE
-    after_j = tuple(self.trip[j+1][[utils.LAT, utils.LON]]) if j < len(self.trip)-1 else utils.NORTH_POLE
+    ids = self.trip
+    before_i = ids[i-1] if i > 0 else utils.NORTH_POLE_ID
+    before_j = ids[j-1] if j > 0 else utils.NORTH_POLE_ID
+    at_i = ids[i]
+    at_j = ids[j]
+    after_i = ids[i+1] if i < len(self.trip)-1 else utils.NORTH_POLE_ID
+    after_j = ids[j+1] if j < len(self.trip)-1 else utils.NORTH_POLE_ID
 
     if i+1 == j:
       # swap adjacent locations is simplified
@@ -71,12 +89,7 @@ class SwapRandomGiftsInTripNeighbor(Neighbor):
       new_i = Neighbor.get_cost_of_tour_of_three(before_j, at_i, after_j, cum_weight_before_j + weight_diff, weight_i)
 
       # cost difference from weight between i and j (sub-self.trip between i+1..j-1)
-      distance = 0
-      for k in range(i+1, j-1):
-        distance += utils.distance(
-            tuple(self.trip[k][[utils.LAT, utils.LON]]),
-            tuple(self.trip[k+1][[utils.LAT, utils.LON]])
-            )
+      distance = np.sum(gift_table.path_distances(ids[i+1:j]))
       diff = distance * weight_diff
       improvement = new_j + new_i - old_j - old_i + diff
 
@@ -94,26 +107,23 @@ class SwapRandomGiftsInTripNeighbor(Neighbor):
     # self.log.debug("Applying {}".format(self))
 
     if self.VERIFY_COST_DELTA:
-      old = utils.weighted_trip_length(self.trip[:, utils.LOCATION], self.trip[:, utils.WEIGHT])
+      old = self.weighted_trip_length(self.trip)
 
-    self.trip[[self.first_gift, self.second_gift]] = self.trip[[self.second_gift, self.first_gift]]
+    self.trips.swap_gifts(self.trip_index, self.first_gift, self.second_gift)
 
     if self.VERIFY_COST_DELTA:
-      new = utils.weighted_trip_length(self.trip[:, utils.LOCATION], self.trip[:, utils.WEIGHT])
+      new = self.weighted_trip_length(self.trip)
       utils.verify_costs_are_equal(self.cost_delta(), new-old)
 
 
 class OptimalSwapInRandomTripNeighbor(SwapRandomGiftsInTripNeighbor):
   def __init__(self, trips, trip=None, first_gift=None):
+    # otherwise a random trip with at least 2 gifts and a random first gift are selected
     if trip is not None:
-      # select random trip with at least 2 gifts
-      self.trip = trips[np.random.randint(len(trips))]
-      while len(self.trip) < 2:
-        self.trip = trips[np.random.randint(len(trips))]
+      self.trip_index = trip
 
     if first_gift is not None:
-      # select the first gift to swap randomly
-      self.first_gift = np.random.randint(len(self.trip))
+      self.first_gift = first_gift
 
     # don't assign second gift yet
     self.second_gift = -1
@@ -121,24 +131,16 @@ class OptimalSwapInRandomTripNeighbor(SwapRandomGiftsInTripNeighbor):
     super(OptimalSwapInRandomTripNeighbor, self).__init__(trips)
 
   def __str__(self):
-    return "{}-optimal-swap-{}-{}: {:.5f}M".format(int(self.trip[0][1]), self.first_gift, self.second_gift, self.cost_delta() / 1e6)
+    return "{}-optimal-swap-{}-{}: {:.5f}M".format(self.trips.trip_ids[self.trip_index], self.first_gift, self.second_gift, self.cost_delta() / 1e6)
 
   def cost_delta(self):
     if self.cost is not None:
       return self.cost
 
-    self.cost = np.finfo(np.float64).max
-    self.second_gift = None
-
-    for i in range(len(self.trip)):
-      if i == self.first_gift:
-        # don't swap with self
-        continue
-      current_cost = self._calculate_cost_of_swapping_items(self.first_gift, i)
-      if current_cost < self.cost:
-        self.cost = current_cost
-        self.second_gift = i
-
+    # costs of swapping with all other gifts at once (swapping with itself costs inf)
+    costs = self.trips.cost_model(self.trip_index).swap_costs(self.first_gift)
+    self.second_gift = int(np.argmin(costs))
+    self.cost = costs[self.second_gift]
     return self.cost
 
 
@@ -148,7 +150,7 @@ class OptimalMoveGiftInTripNeighbor(Neighbor):
     if trip is None:
       # select random trip with at least 4 gifts
       self.trip = np.random.randint(len(trips))
-      while len(self.trips[self.trip]) < 4:
+      while self.trips.stops[self.trip] < 4:
         self.trip = np.random.randint(len(trips))
     else:
       self.trip = trip
@@ -158,19 +160,19 @@ class OptimalMoveGiftInTripNeighbor(Neighbor):
     super(OptimalMoveGiftInTripNeighbor, self).__init__()
 
   def __str__(self):
-    return "{}-optimal-move-{}-{}: {:.5f}M".format(int(self.trips[self.trip][0][1]),
+    return "{}-optimal-move-{}-{}: {:.5f}M".format(self.trips.trip_ids[self.trip],
         self.gift_index, self.new_index, self.cost_delta() / 1e6)
 
   def cost_delta(self):
     if self.cost is not None:
       return self.cost
 
-    trip = self.trips[self.trip]
-    gift = trip[self.gift_index]
-    cost_to_remove = self._cost_to_remove_gift(trip, self.gift_index)
+    trip = self.trips.cost_model(self.trip)
+    gift = trip.trip[self.gift_index]
+    cost_to_remove = trip.removal_cost(self.gift_index)
 
-    trip_without_gift = np.delete(trip, self.gift_index, axis=0)
-    self.new_index, cost_to_insert = Neighbor.find_best_insertion_index(trip_without_gift, gift, index_to_be_removed=self.gift_index+1)
+    trip_without_gift = TripCostModel(np.delete(trip.trip, self.gift_index))
+    self.new_index, cost_to_insert = trip_without_gift.best_insertion(gift, index_to_be_removed=self.gift_index+1)
 
     self.cost = cost_to_insert + cost_to_remove
     return self.cost
@@ -181,17 +183,92 @@ class OptimalMoveGiftInTripNeighbor(Neighbor):
     trip = self.trips[self.trip]
 
     if self.VERIFY_COST_DELTA:
-      old = utils.weighted_trip_length(trip[:, utils.LOCATION], trip[:, utils.WEIGHT])
+      old = self.weighted_trip_length(trip)
 
-    gift = trip[self.gift_index]
-
-    trip = np.delete(trip, self.gift_index, axis=0)
+    gift = self.trips.remove_gift(self.trip, self.gift_index)
     index_to_insert = self.new_index if self.new_index < self.gift_index else self.new_index + 0
-    trip = np.insert(trip, index_to_insert, gift, axis=0)
+    self.trips.insert_gift(self.trip, index_to_insert, gift)
+
+    if self.VERIFY_COST_DELTA:
+      trip = self.trips[self.trip]
+      new = self.weighted_trip_length(trip)
+      utils.verify_costs_are_equal(self.cost_delta(), new-old)
 
-    self.trips[self.trip] = trip
+
+class TwoOptInTripNeighbor(Neighbor):
+  def __init__(self, trips, trip=None):
+    self.trips = trips
+    if trip is None:
+      # select random trip with at least 4 gifts
+      self.trip = np.random.randint(len(trips))
+      while self.trips.stops[self.trip] < 4:
+        self.trip = np.random.randint(len(trips))
+    else:
+      self.trip = trip
+
+    self.first_gift = None
+    self.last_gift = None
+    super(TwoOptInTripNeighbor, self).__init__()
+
+  def __str__(self):
+    return "{}-2opt-{}-{}: {:.5f}M".format(self.trips.trip_ids[self.trip],
+        self.first_gift, self.last_gift, self.cost_delta() / 1e6)
+
+  def cost_delta(self):
+    if self.cost is not None:
+      return self.cost
+
+    tour = local_search.WeightedTour(self.trips[self.trip])
+    self.first_gift, self.last_gift, self.cost = tour.best_two_opt()
+    return self.cost
+
+  def apply(self):
+    # self.log.debug("Applying {}".format(self))
+
+    if self.VERIFY_COST_DELTA:
+      old = self.weighted_trip_length(self.trips[self.trip])
+
+    self.trips[self.trip] = local_search.two_opt(self.trips[self.trip], self.first_gift, self.last_gift)
 
     if self.VERIFY_COST_DELTA:
-      new = utils.weighted_trip_length(trip[:, utils.LOCATION], trip[:, utils.WEIGHT])
+      new = self.weighted_trip_length(self.trips[self.trip])
       utils.verify_costs_are_equal(self.cost_delta(), new-old)
 
+
+class OrOptInTripNeighbor(Neighbor):
+  def __init__(self, trips, trip=None, max_length=3):
+    self.trips = trips
+    if trip is None:
+      # select random trip with at least 4 gifts
+      self.trip = np.random.randint(len(trips))
+      while self.trips.stops[self.trip] < 4:
+        self.trip = np.random.randint(len(trips))
+    else:
+      self.trip = trip
+
+    self.max_length = max_length
+    self.move = None # first gift, length, position, reverse
+    super(OrOptInTripNeighbor, self).__init__()
+
+  def __str__(self):
+    return "{}-oropt-{}: {:.5f}M".format(self.trips.trip_ids[self.trip], self.move, self.cost_delta() / 1e6)
+
+  def cost_delta(self):
+    if self.cost is not None:
+      return self.cost
+
+    tour = local_search.WeightedTour(self.trips[self.trip])
+    *self.move, self.cost = tour.best_or_opt(self.max_length)
+    return self.cost
+
+  def apply(self):
+    # self.log.debug("Applying {}".format(self))
+
+    if self.VERIFY_COST_DELTA:
+      old = self.weighted_trip_length(self.trips[self.trip])
+
+    self.trips[self.trip] = local_search.or_opt(self.trips[self.trip], *self.move)
+
+    if self.VERIFY_COST_DELTA:
+      new = self.weighted_trip_length(self.trips[self.trip])
+      utils.verify_costs_are_equal(self.cost_delta(), new-old)
@@ -1,11 +1,10 @@
 #!/usr/bin/env python
 
-import copy
-
 import numpy as np
 import pandas as pd
 
 import utils
+from cost_model import TripCostModel, find_best_insertion_into_trips
 from neighbor import Neighbor
 
 
@@ -22,9 +21,16 @@ class MoveGiftToAnotherTripNeighbor(Neighbor):
     super(MoveGiftToAnotherTripNeighbor, self).__init__()
 
   def _get_valid_target_trip(self):
-    weight_of_gift = self.trips[self.trip][self.gift_to_move][utils.WEIGHT]
+    gift = self.trips[self.trip][self.gift_to_move]
+    weight_of_gift = utils.get_gift_table().weights[gift]
+
+    # prefer trips that hold gifts close to the gift to move
+    for i in np.random.permutation(self.trips.trips_near_gift(gift)):
+      if self.trips.weights[i] + weight_of_gift <= utils.WEIGHT_LIMIT:
+        return i
+
     for i in np.random.permutation(len(self.trips)):
-      if i != self.trip and np.sum(self.trips[i][:, utils.WEIGHT]) + weight_of_gift <= utils.WEIGHT_LIMIT:
+      if i != self.trip and self.trips.weights[i] + weight_of_gift <= utils.WEIGHT_LIMIT:
         return i
 
   def __str__(self):
@@ -40,21 +46,19 @@ class MoveGiftToAnotherTripNeighbor(Neighbor):
       while len(self.trips[self.trip]) < 2:
         self.trip = np.random.randint(len(self.trips))
 
-    source = self.trips[self.trip]
+    source = self.trips.cost_model(self.trip)
 
     if self.gift_to_move is not None or self.destination_trip is not None or self.destination_insertion_index is not None or self.cost_to_insert_in_destination is not None:
       # we should have *all* of these set
-      return self.cost_to_insert_in_destination + self._cost_to_remove_gift(source, self.gift_to_move)
+      return self.cost_to_insert_in_destination + source.removal_cost(self.gift_to_move)
 
     self.gift_to_move = np.random.randint(len(source))
     self.destination_trip = self._get_valid_target_trip()
 
-    gift = source[self.gift_to_move]
-
-    self.destination_insertion_index, cost_to_insert = Neighbor.find_best_insertion_index(
-        self.trips[self.destination_trip], gift)
+    destination = self.trips.cost_model(self.destination_trip)
+    self.destination_insertion_index, cost_to_insert = destination.best_insertion(source.trip[self.gift_to_move])
 
-    cost_to_remove = self._cost_to_remove_gift(source, self.gift_to_move)
+    cost_to_remove = source.removal_cost(self.gift_to_move)
 
     self.cost = cost_to_insert + cost_to_remove
     return self.cost
@@ -66,21 +70,17 @@ class MoveGiftToAnotherTripNeighbor(Neighbor):
     destination = self.trips[self.destination_trip]
 
     if self.VERIFY_COST_DELTA:
-      old = utils.weighted_trip_length(source[:, utils.LOCATION], source[:, utils.WEIGHT]) + \
-          utils.weighted_trip_length(destination[:, utils.LOCATION], destination[:, utils.WEIGHT])
+      old = self.weighted_trip_length(source) + \
+          self.weighted_trip_length(destination)
 
-    gift = source[self.gift_to_move] # NOTE: This apparently can be index-out-of-bounds!
-    gift[utils.TRIP] = destination[0, utils.TRIP]
-
-    destination = np.insert(destination, self.destination_insertion_index, gift, axis=0)
-    self.trips[self.destination_trip] = destination
-
-    source = np.delete(source, self.gift_to_move, axis=0)
-    self.trips[self.trip] = source
+    gift = self.trips.remove_gift(self.trip, self.gift_to_move) # NOTE: This apparently can be index-out-of-bounds!
+    self.trips.insert_gift(self.destination_trip, self.destination_insertion_index, gift)
 
     if self.VERIFY_COST_DELTA:
-      new = utils.weighted_trip_length(source[:, utils.LOCATION], source[:, utils.WEIGHT]) + \
-          utils.weighted_trip_length(destination[:, utils.LOCATION], destination[:, utils.WEIGHT])
+      source = self.trips[self.trip]
+      destination = self.trips[self.destination_trip]
+      new = self.weighted_trip_length(source) + \
+          self.weighted_trip_length(destination)
       utils.verify_costs_are_equal(self.cost_delta(), new-old)
 
 
@@ -89,10 +89,10 @@ class MoveGiftToLightestTripNeighbor(MoveGiftToAnotherTripNeighbor):
     self.destination_trip = self._get_lightest_target_trip(trips)
 
     self.trip = np.random.randint(len(trips))
-    while len(self.trips[self.trip]) < 2:
+    while trips.stops[self.trip] < 2:
       self.trip = np.random.randint(len(trips))
     self.gift_to_move = np.random.randint(len(trips[self.trip]))
-    while self.trip == self.destination_trip or  trips[self.destination_trip][:, utils.WEIGHT].sum() + trips[self.trip][self.gift_to_move][utils.WEIGHT] > utils.WEIGHT_LIMIT:
+    while self.trip == self.destination_trip or trips.weights[self.destination_trip] + utils.get_gift_table().weights[trips[self.trip][self.gift_to_move]] > utils.WEIGHT_LIMIT:
       self.trip = np.random.randint(len(trips))
       self.gift_to_move = np.random.randint(len(trips[self.trip]))
     super(MoveGiftToLightestTripNeighbor, self).__init__(trips)
@@ -103,8 +103,7 @@ class MoveGiftToLightestTripNeighbor(MoveGiftToAnotherTripNeighbor):
 
   def _get_lightest_target_trip(self, trips):
     # can be invalid!
-    weights = [np.sum(trip[:, utils.WEIGHT]) for trip in trips]
-    return weights.index(np.min(weights))
+    return int(np.argmin(trips.weights))
 
 
 class MoveGiftToOptimalTripNeighbor(MoveGiftToAnotherTripNeighbor):
@@ -123,27 +122,9 @@ class MoveGiftToOptimalTripNeighbor(MoveGiftToAnotherTripNeighbor):
         self.destination_trip, self.destination_insertion_index)
 
   def find_close_trips(self, gift, trip_index_to_skip):
-    gift_longitude = gift[utils.LON]
-    gift_weight = gift[utils.WEIGHT]
-    tolerance = 1
-    while True:
-      candidates = []
-      close_candidates = []
-      for i, trip in enumerate(self.trips):
-        if i == trip_index_to_skip or trip[:, utils.WEIGHT].sum() + gift_weight > utils.WEIGHT_LIMIT:
-          # avoid full candidates and moving to same trip
-          continue
-        min_lon = trip[:, utils.LON].min()
-        max_lon = trip[:, utils.LON].max()
-        if gift_longitude > min_lon and gift_longitude < max_lon:
-          candidates.append(i)
-        elif gift_longitude > min_lon - tolerance and gift_longitude < max_lon + tolerance:
-          close_candidates.append(i)
-      if candidates:
-        return candidates
-      if close_candidates:
-        return close_candidates
-      tolerance += 1
+    # avoid full candidates and moving to same trip
+    gift_table = utils.get_gift_table()
+    return self.trips.longitude_index.close_trips(gift_table.locations[gift, 1], gift_table.weights[gift], trip_index_to_skip)
 
   def cost_delta(self):
     if self.cost is not None:
@@ -155,19 +136,15 @@ class MoveGiftToOptimalTripNeighbor(MoveGiftToAnotherTripNeighbor):
     # trips are good candidates if inserting the gift doesn't add a (big) detour
     candidate_trips = self.find_close_trips(gift, self.trip)
 
-    best_candidate = None
-    best_index_in_candidate = None
-    minimum_cost = np.finfo(np.float64).max
-
-    # try inserting into each
-    for candidate in candidate_trips:
-      destination_index, cost = self.find_best_insertion_index(self.trips[candidate], gift)
-      if cost < minimum_cost:
-        minimum_cost = cost
-        best_candidate = candidate
-        best_index_in_candidate = destination_index
+    # try inserting into all of them at once
+    best_candidate, best_index_in_candidate, minimum_cost = find_best_insertion_into_trips(
+        [self.trips.cost_model(candidate).trip for candidate in candidate_trips], gift)
+    if best_candidate is None:
+      # no other trip can carry the gift, so the move is never accepted
+      self.cost = np.finfo(np.float64).max
+      return self.cost
 
-    self.destination_trip = best_candidate
+    self.destination_trip = candidate_trips[best_candidate]
     self.destination_insertion_index = best_index_in_candidate
     self.cost_to_insert_in_destination = minimum_cost
 
@@ -193,12 +170,13 @@ class SwapGiftsAcrossTripsNeighbor(Neighbor):
     return "swap-{}:{}-{}:{}".format(self.first_trip, self.first_gift, self.second_trip, self.second_gift)
 
   def _get_valid_swapee(self):
-    weight_of_first_gift = self.trips[self.first_trip][self.first_gift][utils.WEIGHT]
-    first_weight = np.sum(self.trips[self.first_trip][:, utils.WEIGHT])
-    second_weight = np.sum(self.trips[self.second_trip][:, utils.WEIGHT])
+    gift_weights = utils.get_gift_table().weights
+    weight_of_first_gift = gift_weights[self.trips[self.first_trip][self.first_gift]]
+    first_weight = self.trips.weights[self.first_trip]
+    second_weight = self.trips.weights[self.second_trip]
 
     for gift in np.random.permutation(len(self.trips[self.second_trip])):
-      weight_of_second_gift = self.trips[self.second_trip][gift][utils.WEIGHT]
+      weight_of_second_gift = gift_weights[self.trips[self.second_trip][gift]]
       if (first_weight - weight_of_first_gift + weight_of_second_gift <= utils.WEIGHT_LIMIT and
           second_weight + weight_of_first_gift - weight_of_second_gift <= utils.WEIGHT_LIMIT):
         return gift
@@ -211,29 +189,37 @@ class SwapGiftsAcrossTripsNeighbor(Neighbor):
     # find second trip to exchange gifts with and valid gifts to swap
     first_gifts_to_try = np.random.permutation(len(self.trips[self.first_trip]))
     for fg in first_gifts_to_try:
-      self.second_trip = np.random.randint(len(self.trips))
-      while len(self.trips[self.second_trip]) < 3 or self.first_trip == self.second_trip:
+      # prefer trips that hold gifts close to the first gift
+      close_trips = [t for t in self.trips.trips_near_gift(self.trips[self.first_trip][fg]) if self.trips.stops[t] >= 3]
+      if close_trips:
+        self.second_trip = close_trips[np.random.randint(len(close_trips))]
+      else:
         self.second_trip = np.random.randint(len(self.trips))
+        while len(self.trips[self.second_trip]) < 3 or self.first_trip == self.second_trip:
+          self.second_trip = np.random.randint(len(self.trips))
       self.first_gift = fg
       self.second_gift = self._get_valid_swapee()
       if self.second_gift is not None:
         break
 
+    first_trip = self.trips.cost_model(self.first_trip)
+    second_trip = self.trips.cost_model(self.second_trip)
+    first_gift = first_trip.trip[self.first_gift]
+    second_gift = second_trip.trip[self.second_gift]
+
     # find insertion indexes with minimum cost
-    self.first_trip_insertion_index, cost_to_insert_first = Neighbor.find_best_insertion_index(
-        self.trips[self.first_trip], self.trips[self.second_trip][self.second_gift], index_to_be_removed=self.first_gift)
-    self.second_trip_insertion_index, cost_to_insert_second = Neighbor.find_best_insertion_index(
-        self.trips[self.second_trip], self.trips[self.first_trip][self.first_gift], index_to_be_removed=self.second_gift)
+    self.first_trip_insertion_index, cost_to_insert_first = first_trip.best_insertion(
+        second_gift, index_to_be_removed=self.first_gift)
+    self.second_trip_insertion_index, cost_to_insert_second = second_trip.best_insertion(
+        first_gift, index_to_be_removed=self.second_gift)
 
     # update temporary trips with new insertion to accurately calculate the cost of deletion
-    temporary_first_trip = self.trips[self.first_trip]
-    temporary_first_trip = np.insert(temporary_first_trip, self.first_trip_insertion_index, self.trips[self.second_trip][self.second_gift], axis=0)
-    temporary_second_trip = self.trips[self.second_trip]
-    temporary_second_trip = np.insert(temporary_second_trip, self.second_trip_insertion_index, self.trips[self.first_trip][self.first_gift], axis=0)
+    temporary_first_trip = TripCostModel(np.insert(first_trip.trip, self.first_trip_insertion_index, second_gift))
+    temporary_second_trip = TripCostModel(np.insert(second_trip.trip, self.second_trip_insertion_index, first_gift))
 
     # calculate (negative) cost of deletion
-    cost_to_remove_first = self._cost_to_remove_gift(temporary_first_trip, self.first_gift if self.first_gift < self.first_trip_insertion_index else self.first_gift + 1)
-    cost_to_remove_second = self._cost_to_remove_gift(temporary_second_trip, self.second_gift if self.second_gift < self.second_trip_insertion_index else self.second_gift + 1)
+    cost_to_remove_first = temporary_first_trip.removal_cost(self.first_gift if self.first_gift < self.first_trip_insertion_index else self.first_gift + 1)
+    cost_to_remove_second = temporary_second_trip.removal_cost(self.second_gift if self.second_gift < self.second_trip_insertion_index else self.second_gift + 1)
 
     self.cost = cost_to_insert_first + cost_to_insert_second + cost_to_remove_first + cost_to_remove_second
 
@@ -246,33 +232,28 @@ class SwapGiftsAcrossTripsNeighbor(Neighbor):
     second_trip = self.trips[self.second_trip]
 
     if self.VERIFY_COST_DELTA:
-      old = utils.weighted_trip_length(first_trip[:, utils.LOCATION], first_trip[:, utils.WEIGHT]) + \
-          utils.weighted_trip_length(second_trip[:, utils.LOCATION], second_trip[:, utils.WEIGHT])
+      old = self.weighted_trip_length(first_trip) + \
+          self.weighted_trip_length(second_trip)
 
-    # extract insertees now (before they're removed) and update their trip assignment
-    first_gift_row = first_trip[self.first_gift]
-    trip_id_for_second_gift = first_trip[0, utils.TRIP]
-    first_gift_row[utils.TRIP] = second_trip[0, utils.TRIP]
-    second_gift_row = second_trip[self.second_gift]
-    second_gift_row[utils.TRIP] = trip_id_for_second_gift
+    # extract insertees now (before they're removed)
+    first_gift = first_trip[self.first_gift]
+    second_gift = second_trip[self.second_gift]
 
     # update first trip
-    first_trip = np.insert(first_trip, self.first_trip_insertion_index, second_gift_row, axis=0)
-
+    self.trips.insert_gift(self.first_trip, self.first_trip_insertion_index, second_gift)
     index_to_remove = self.first_gift if self.first_gift < self.first_trip_insertion_index else self.first_gift + 1
-    first_trip = np.delete(first_trip, index_to_remove, axis=0)
-    self.trips[self.first_trip] = first_trip
+    self.trips.remove_gift(self.first_trip, index_to_remove)
 
     # update second trip
-    second_trip = np.insert(second_trip, self.second_trip_insertion_index, first_gift_row, axis=0)
-
+    self.trips.insert_gift(self.second_trip, self.second_trip_insertion_index, first_gift)
     index_to_remove = self.second_gift if self.second_gift < self.second_trip_insertion_index else self.second_gift + 1
-    second_trip = np.delete(second_trip, index_to_remove, axis=0)
-    self.trips[self.second_trip] = second_trip
+    self.trips.remove_gift(self.second_trip, index_to_remove)
 
     if self.VERIFY_COST_DELTA:
-      new = utils.weighted_trip_length(first_trip[:, utils.LOCATION], first_trip[:, utils.WEIGHT]) + \
-          utils.weighted_trip_length(second_trip[:, utils.LOCATION], second_trip[:, utils.WEIGHT])
+      first_trip = self.trips[self.first_trip]
+      second_trip = self.trips[self.second_trip]
+      new = self.weighted_trip_length(first_trip) + \
+          self.weighted_trip_length(second_trip)
       utils.verify_costs_are_equal(self.cost_delta(), new-old)
 
 
@@ -280,7 +261,7 @@ class OptimalMergeTripIntoAdjacentNeighbor(Neighbor):
   def __init__(self, trips, trip=None):
     self.trips = trips
     self.trip_to_merge = trip
-    self.trips_with_applied_merge = None
+    self.moves = None
     self.modified_trips = None
     super(OptimalMergeTripIntoAdjacentNeighbor, self).__init__()
 
@@ -289,17 +270,15 @@ class OptimalMergeTripIntoAdjacentNeighbor(Neighbor):
 
   def _find_trip_to_merge(self):
     # TODO: Find reasonable heuristics
-    weights = [np.sum(trip[:, utils.WEIGHT]) for trip in self.trips]
+    weights = self.trips.weights
     maximum_weight = min(500, np.median(weights), np.mean(weights))
-    lengths = [len(trip[:, utils.WEIGHT]) for trip in self.trips]
+    lengths = self.trips.stops
     maximum_trip_length = min(50, np.median(lengths), np.mean(lengths))
 
     trips_to_check = np.random.permutation(len(self.trips))
 
     for trip_index in trips_to_check:
-      trip = self.trips[trip_index]
-      trip_weight = np.sum(trip[:, utils.WEIGHT])
-      if trip_weight < maximum_weight and len(trip) < maximum_trip_length:
+      if weights[trip_index] < maximum_weight and lengths[trip_index] < maximum_trip_length:
         return trip_index
 
   def cost_delta(self):
@@ -314,26 +293,27 @@ class OptimalMergeTripIntoAdjacentNeighbor(Neighbor):
     trip = self.trips[self.trip_to_merge]
 
     # sort gifts by descending weight
-    sorting_indices = trip[:, utils.WEIGHT].argsort()[::-1]
+    sorting_indices = utils.get_gift_table().weights[trip].argsort()[::-1]
     sorted_gifts = trip[sorting_indices]
 
-    # move gifts by size to optimal other trips
-    self.trips_with_applied_merge = copy.deepcopy(self.trips)
-    self.cost = 0
+    # move gifts by size to optimal other trips, but only tentatively
+    self.moves = []
     self.modified_trips = []
-    for gift in sorted_gifts:
-      # find the index of the current gift in the current trip that is being merged
-      gift_index = -1
-      for i, g in enumerate(self.trips_with_applied_merge[self.trip_to_merge]):
-        if g[utils.GIFT] == gift[utils.GIFT]:
-          gift_index = i
-          break
-      # move gift
-      neighbor = MoveGiftToOptimalTripNeighbor(self.trips_with_applied_merge, self.trip_to_merge, gift_index)
-      self.cost += neighbor.cost_delta()
-      neighbor.apply()
-      if not neighbor.destination_trip in self.modified_trips:
-        self.modified_trips.append(neighbor.destination_trip)
+    self.trips.begin()
+    try:
+      for gift in sorted_gifts:
+        # find the index of the current gift in the current trip that is being merged
+        gift_index = np.flatnonzero(self.trips[self.trip_to_merge] == gift)[0]
+        # move gift
+        neighbor = MoveGiftToOptimalTripNeighbor(self.trips, self.trip_to_merge, gift_index)
+        neighbor.cost_delta()
+        neighbor.apply()
+        self.moves.append((gift_index, neighbor.destination_trip, neighbor.destination_insertion_index))
+        if not neighbor.destination_trip in self.modified_trips:
+          self.modified_trips.append(neighbor.destination_trip)
+      self.cost = self.trips.transaction_cost_delta()
+    finally:
+      self.trips.rollback()
 
     return self.cost
 
@@ -348,17 +328,19 @@ class OptimalMergeTripIntoAdjacentNeighbor(Neighbor):
     trip = self.trips[self.trip_to_merge]
 
     if self.VERIFY_COST_DELTA:
-      old = utils.weighted_trip_length(trip[:, utils.LOCATION], trip[:, utils.WEIGHT])
+      old = self.weighted_trip_length(trip)
       for trip_index in self.modified_trips:
-        old += utils.weighted_trip_length(self.trips[trip_index][:, utils.LOCATION], self.trips[trip_index][:, utils.WEIGHT])
+        old += self.weighted_trip_length(self.trips[trip_index])
 
-    self.trips.clear()
-    self.trips.extend(self.trips_with_applied_merge)
+    # replay the moves found while evaluating the merge
+    for gift_index, destination_trip, destination_insertion_index in self.moves:
+      gift = self.trips.remove_gift(self.trip_to_merge, gift_index)
+      self.trips.insert_gift(destination_trip, destination_insertion_index, gift)
 
     if self.VERIFY_COST_DELTA:
       new = 0
       for trip_index in self.modified_trips:
-        new += utils.weighted_trip_length(self.trips[trip_index][:, utils.LOCATION], self.trips[trip_index][:, utils.WEIGHT])
+        new += self.weighted_trip_length(self.trips[trip_index])
       utils.verify_costs_are_equal(self.cost_delta(), new-old)
 
     # only delete the row afterwards to not mess up the indexes for the cost calculation
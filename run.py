@@ -48,7 +48,8 @@ if __name__ == "__main__":
 
   log = utils.get_logger("santa-sleigh")
   Neighbor.log = log
-  gifts = pd.read_csv("data/gifts.csv")
+  gifts = pd.read_csv(utils.GIFTS_FILE)
+  utils.set_gift_table(utils.GiftTable(gifts))
 
   methods = {method.name: method for method in get_all_methods(gifts, log)}
 
@@ -60,11 +61,21 @@ if __name__ == "__main__":
 
   # method-specific arguments
   parser.add_argument("--from-file", required=False, help=
-      "Pattern to match files under 'data/' against which contains a solution to load as basis for the new evaluation")
+      "Pattern to match files under 'data/' against which contains a solution to load as basis for the new evaluation (CSV or binary .npy)")
   parser.add_argument("--alpha", required=False, type=int,
       help="Factor for temperature decrease in SA")
   parser.add_argument("--temperature", required=False, type=int,
       help="Initial temperature to use for SA")
+  parser.add_argument("--sectors", required=False, type=int,
+      help="Number of longitude sectors to run SA on in parallel processes")
+  parser.add_argument("--replicas", required=False, type=int,
+      help="Number of replicas at different temperatures to run SA on in parallel processes (parallel tempering)")
+  parser.add_argument("--cluster-width", required=False, type=float,
+      help="Width of the longitude clusters in degrees for the sweep")
+  parser.add_argument("--trip-weight", required=False, type=float,
+      help="Target weight of the trips for the sweep")
+  parser.add_argument("--processes", required=False, type=int,
+      help="Number of processes to optimize single trips in (defaults to the number of cores)")
 
   args = parser.parse_args()
   evaluation_id = "{}-{}".format(args.method, datetime.utcnow().strftime("%Y-%m-%d-%H:%M:%S"))
@@ -0,0 +1,638 @@
+#!/usr/bin/env python
+
+import bisect
+
+import numpy as np
+import pandas as pd
+
+import utils
+from cost_model import TripCostModel
+
+
+class Solution(object):
+  """Trips of a solution, stored as GiftIds in one flat array, together with aggregates of every trip.
+
+  Trip i occupies `order[offsets[i]:offsets[i]+stops[i]]` of a shared int32 buffer. Each trip has some
+  free slots behind it, so gifts are inserted, removed and swapped in place and only a trip that runs out
+  of slots is moved to the end of the buffer. Coordinates and weights are only kept in the GiftTable.
+
+  Indexing returns views of the buffer, which stay valid until trips are added, removed or moved.
+  The weight, number of stops, longitude span and cost of each trip are cached so that queries don't
+  have to scan all trips, and the index of the trip holding each gift is kept so that trips with gifts
+  close to a gift can be found.
+
+  Changes can be made tentatively: between `begin` and `commit`/`rollback`, the state of every trip is
+  saved to an undo log before it is changed for the first time, so a rollback only restores the trips
+  that were actually touched.
+  """
+
+  SLACK = 8 # free slots reserved behind every trip
+
+  def __init__(self, trips=None, trip_ids=None):
+    """
+    :trips: Iterable with Numpy arrays of the GiftIds of each trip in order of delivery
+    :trip_ids: TripId of each trip (defaults to consecutive numbers)
+    """
+    self._order = np.zeros(0, dtype=np.int32)
+    self._end = 0 # end of the last slot in the buffer
+    self._garbage = 0 # slots of the buffer that no longer belong to any trip
+    self._offsets = np.zeros(0, dtype=np.int64)
+    self._capacities = np.zeros(0, dtype=np.int64)
+    self._trip_ids = np.zeros(0, dtype=np.int64)
+    self._weights = np.zeros(0)
+    self._stops = np.zeros(0, dtype=np.int64)
+    self._min_longitudes = np.zeros(0)
+    self._max_longitudes = np.zeros(0)
+    self._costs = np.zeros(0) # NaN marks a trip whose cost has to be recalculated
+    self._models = [] # cached TripCostModel of each trip (or None)
+    self._longitude_index = None
+    self._trip_of_gift = np.full(len(utils.get_gift_table()), -1, dtype=np.int32)
+    self._undo_log = None # saved state of each trip changed in the current transaction
+    self._trips_before_transaction = None
+    if trips is not None:
+      for i, trip in enumerate(trips):
+        self.append(trip, None if trip_ids is None else trip_ids[i])
+
+  @classmethod
+  def from_frame(cls, all_trips):
+    """Creates a solution from a DataFrame of all trips.
+
+    :all_trips: Pandas DataFrame with the columns GiftId and TripId (gifts in order of delivery)
+
+    :returns: Solution with the trips in order of their first appearance
+    """
+    gift_ids = all_trips.GiftId.values.astype(np.int64)
+    trip_ids = all_trips.TripId.values.astype(np.int64)
+    order = np.argsort(trip_ids, kind="mergesort")
+    unique_trip_ids, starts = np.unique(trip_ids[order], return_index=True)
+    trips = np.split(gift_ids[order], starts[1:])
+    first_appearance = order[starts]
+    in_order = np.argsort(first_appearance)
+    return cls([trips[i] for i in in_order], unique_trip_ids[in_order])
+
+  def to_frame(self):
+    """Extracts the gift/trip mapping.
+
+    :returns: Pandas DataFrame with GiftId and TripId of all gifts in order of delivery
+    """
+    return pd.DataFrame({
+      "GiftId": np.concatenate(list(self)) if len(self) else np.zeros(0, dtype=np.int32),
+      "TripId": np.repeat(self._trip_ids, self._stops)})
+
+  def copy(self):
+    """Copies the trips and their aggregates (cost models are immutable and shared)."""
+    other = Solution()
+    other.__dict__.update(self.__dict__)
+    for name in ["_order", "_offsets", "_capacities", "_trip_ids", "_weights", "_stops",
+        "_min_longitudes", "_max_longitudes", "_costs", "_trip_of_gift"]:
+      setattr(other, name, getattr(self, name).copy())
+    other._models = list(self._models)
+    other._longitude_index = None
+    other._undo_log = None
+    other._trips_before_transaction = None
+    return other
+
+  def __deepcopy__(self, memo):
+    return self.copy()
+
+  def __getstate__(self):
+    # the cost models reference the gift table, don't send them to other processes
+    state = self.__dict__.copy()
+    state["_models"] = [None] * len(self)
+    state["_longitude_index"] = None
+    return state
+
+  def __len__(self):
+    return len(self._offsets)
+
+  def __iter__(self):
+    for index in range(len(self)):
+      yield self[index]
+
+  def __getitem__(self, index):
+    offset = self._offsets[index]
+    return self._order[offset:offset+self._stops[index]]
+
+  def __setitem__(self, index, trip):
+    self._save_trip(index)
+    trip = np.asarray(trip, dtype=np.int32)
+    if len(trip) > self._capacities[index]:
+      self._move_trip(index, len(trip) + self.SLACK)
+    self._order[self._offsets[index]:self._offsets[index]+len(trip)] = trip
+    self._stops[index] = len(trip)
+    self._update_aggregates(index)
+
+  def __delitem__(self, index):
+    if self._undo_log is not None:
+      raise ValueError("Trips can't be removed during a transaction")
+    gifts = self[index]
+    self._trip_of_gift[gifts[self._trip_of_gift[gifts] == index]] = -1
+    self._trip_of_gift[self._trip_of_gift > index] -= 1
+    self._garbage += self._capacities[index]
+
+    del self._models[index]
+    self._offsets = np.delete(self._offsets, index)
+    self._capacities = np.delete(self._capacities, index)
+    self._trip_ids = np.delete(self._trip_ids, index)
+    self._weights = np.delete(self._weights, index)
+    self._stops = np.delete(self._stops, index)
+    self._min_longitudes = np.delete(self._min_longitudes, index)
+    self._max_longitudes = np.delete(self._max_longitudes, index)
+    self._costs = np.delete(self._costs, index)
+    if self._longitude_index is not None:
+      self._longitude_index.invalidate()
+    if self._garbage > self._end // 2:
+      self._compact()
+
+  def append(self, trip, trip_id=None):
+    """Adds a trip.
+
+    :trip: Numpy array with the GiftIds of the trip in order of delivery
+    :trip_id: TripId of the trip (defaults to an unused one)
+    """
+    trip = np.asarray(trip, dtype=np.int32)
+    self._trip_ids = np.append(self._trip_ids, self.next_trip_id() if trip_id is None else trip_id)
+    self._offsets = np.append(self._offsets, self._allocate(len(trip) + self.SLACK))
+    self._capacities = np.append(self._capacities, len(trip) + self.SLACK)
+    self._stops = np.append(self._stops, len(trip))
+    self._order[self._offsets[-1]:self._offsets[-1]+len(trip)] = trip
+
+    self._models.append(None)
+    self._weights = np.append(self._weights, 0)
+    self._min_longitudes = np.append(self._min_longitudes, 0)
+    self._max_longitudes = np.append(self._max_longitudes, 0)
+    self._costs = np.append(self._costs, np.nan)
+    if self._longitude_index is not None:
+      self._longitude_index.invalidate()
+    self._update_aggregates(len(self) - 1)
+
+  def extend(self, trips):
+    for trip in trips:
+      self.append(trip)
+
+  def clear(self):
+    self.__init__()
+
+  def _allocate(self, size):
+    """Reserves `size` slots at the end of the buffer (growing it if needed) and returns their offset."""
+    if self._end + size > len(self._order):
+      order = np.zeros(max(2 * len(self._order), self._end + size), dtype=np.int32)
+      order[:self._end] = self._order[:self._end]
+      self._order = order
+    offset = self._end
+    self._end += size
+    return offset
+
+  def _move_trip(self, index, capacity, gap_position=None):
+    """Moves a trip to the end of the buffer, optionally leaving a free slot before `gap_position`."""
+    offset = self._offsets[index]
+    stops = self._stops[index]
+    new_offset = self._allocate(capacity)
+    if gap_position is None:
+      self._order[new_offset:new_offset+stops] = self._order[offset:offset+stops]
+    else:
+      self._order[new_offset:new_offset+gap_position] = self._order[offset:offset+gap_position]
+      self._order[new_offset+gap_position+1:new_offset+stops+1] = self._order[offset+gap_position:offset+stops]
+    self._garbage += self._capacities[index]
+    self._offsets[index] = new_offset
+    self._capacities[index] = capacity
+
+  def _compact(self):
+    """Rewrites the buffer without the slots of removed and moved trips."""
+    capacities = self._stops + self.SLACK
+    offsets = np.concatenate([[0], np.cumsum(capacities)[:-1]]).astype(np.int64)
+    order = np.zeros(2 * int(capacities.sum()) + self.SLACK, dtype=np.int32)
+    for index in range(len(self)):
+      order[offsets[index]:offsets[index]+self._stops[index]] = self[index]
+    self._order = order
+    self._offsets = offsets
+    self._capacities = capacities
+    self._end = int(capacities.sum())
+    self._garbage = 0
+
+  def _update_aggregates(self, index):
+    trip = self[index]
+    gift_table = utils.get_gift_table()
+    longitudes = gift_table.locations[trip, 1]
+    self._weights[index] = gift_table.weights[trip].sum()
+    self._min_longitudes[index] = longitudes.min() if len(trip) else np.inf
+    self._max_longitudes[index] = longitudes.max() if len(trip) else -np.inf
+    self._trip_of_gift[trip] = index
+    self._aggregates_changed(index)
+
+  def _invalidate_cost(self, index):
+    self._costs[index] = np.nan
+    self._models[index] = None
+
+  def _aggregates_changed(self, index):
+    self._invalidate_cost(index)
+    if self._longitude_index is not None:
+      self._longitude_index.update(index)
+
+  @property
+  def trip_ids(self):
+    """Numpy array with the TripId of each trip."""
+    return self._trip_ids
+
+  @property
+  def weights(self):
+    """Numpy array with the total weight of each trip."""
+    return self._weights
+
+  @property
+  def stops(self):
+    """Numpy array with the number of gifts of each trip."""
+    return self._stops
+
+  @property
+  def min_longitudes(self):
+    """Numpy array with the smallest longitude of each trip."""
+    return self._min_longitudes
+
+  @property
+  def max_longitudes(self):
+    """Numpy array with the largest longitude of each trip."""
+    return self._max_longitudes
+
+  @property
+  def trip_of_gift(self):
+    """Numpy array with the index of the trip of each GiftId (-1 for gifts that aren't in any trip)."""
+    return self._trip_of_gift
+
+  def trips_near_gift(self, gift, k=utils.NEAREST_GIFTS):
+    """Finds the trips holding the gifts closest to a gift.
+
+    :gift: GiftId of the gift
+    :k: Number of close gifts to look at
+
+    :returns: List of trip indexes (without the trip of the gift itself), trips with closer gifts first
+    """
+    trips = []
+    own_trip = self._trip_of_gift[gift]
+    for trip in self._trip_of_gift[utils.get_gift_table().candidate_gifts(k)[gift]]:
+      if trip != own_trip and trip >= 0 and trip not in trips:
+        trips.append(int(trip))
+    return trips
+
+  @property
+  def costs(self):
+    """Numpy array with the cost of each trip (outdated costs are recalculated)."""
+    for index in np.flatnonzero(np.isnan(self._costs)):
+      self.cost(index)
+    return self._costs
+
+  def cost(self, index):
+    """Cost of a single trip (recalculated only if the trip changed)."""
+    if np.isnan(self._costs[index]):
+      self._costs[index] = self.cost_model(index).cost
+    return self._costs[index]
+
+  def cost_model(self, index):
+    """Cached TripCostModel of a trip (rebuilt only if the trip changed)."""
+    if self._models[index] is None:
+      self._models[index] = TripCostModel(self[index])
+      self._costs[index] = self._models[index].cost
+    return self._models[index]
+
+  @property
+  def longitude_index(self):
+    """LongitudeIndex of the trips (created on first use and kept up to date afterwards)."""
+    if self._longitude_index is None:
+      self._longitude_index = LongitudeIndex(self)
+    return self._longitude_index
+
+  def next_trip_id(self):
+    """TripId that isn't used by any trip yet."""
+    return self._trip_ids.max() + 1 if len(self._trip_ids) else 1
+
+  def insert_gift(self, index, position, gift):
+    """Inserts a gift into a trip (in place, unless the trip has no free slot left).
+
+    :index: Index of the trip
+    :position: Index of the gift to insert the new gift before
+    :gift: GiftId of the gift
+    """
+    self._save_trip(index)
+    stops = self._stops[index]
+    if stops == self._capacities[index]:
+      self._move_trip(index, 2 * stops + self.SLACK, position)
+    else:
+      offset = self._offsets[index]
+      self._order[offset+position+1:offset+stops+1] = self._order[offset+position:offset+stops]
+    self._order[self._offsets[index]+position] = gift
+    self._stops[index] += 1
+    self._trip_of_gift[gift] = index
+
+    gift_table = utils.get_gift_table()
+    longitude = gift_table.locations[gift, 1]
+    self._weights[index] += gift_table.weights[gift]
+    self._min_longitudes[index] = min(self._min_longitudes[index], longitude)
+    self._max_longitudes[index] = max(self._max_longitudes[index], longitude)
+    self._aggregates_changed(index)
+
+  def remove_gift(self, index, position):
+    """Removes a gift from a trip (in place).
+
+    :index: Index of the trip
+    :position: Index of the gift in the trip
+
+    :returns: GiftId of the removed gift
+    """
+    self._save_trip(index)
+    offset = self._offsets[index]
+    stops = self._stops[index]
+    gift = int(self._order[offset+position])
+    self._order[offset+position:offset+stops-1] = self._order[offset+position+1:offset+stops]
+    self._stops[index] -= 1
+    if self._trip_of_gift[gift] == index:
+      # the gift may already have been inserted into its new trip
+      self._trip_of_gift[gift] = -1
+
+    gift_table = utils.get_gift_table()
+    longitude = gift_table.locations[gift, 1]
+    self._weights[index] -= gift_table.weights[gift]
+    if longitude <= self._min_longitudes[index] or longitude >= self._max_longitudes[index]:
+      # only the extremes of the span require looking at the remaining gifts
+      remaining = gift_table.locations[self[index], 1]
+      self._min_longitudes[index] = remaining.min() if len(remaining) else np.inf
+      self._max_longitudes[index] = remaining.max() if len(remaining) else -np.inf
+    self._aggregates_changed(index)
+    return gift
+
+  def swap_gifts(self, index, first, second):
+    """Swaps two gifts within a trip (in place).
+
+    :index: Index of the trip
+    :first: Index of the first gift
+    :second: Index of the second gift
+    """
+    self._save_trip(index)
+    trip = self[index]
+    trip[first], trip[second] = trip[second], trip[first]
+    self._invalidate_cost(index)
+
+
+  @property
+  def in_transaction(self):
+    return self._undo_log is not None
+
+  def begin(self):
+    """Starts a transaction. All changes until `commit` or `rollback` are recorded in the undo log."""
+    if self._undo_log is not None:
+      raise ValueError("A transaction is already in progress")
+    self._undo_log = {}
+    self._trips_before_transaction = len(self)
+
+  def _save_trip(self, index):
+    """Saves the state of a trip before it is changed for the first time in the current transaction."""
+    if self._undo_log is None or index in self._undo_log or index >= self._trips_before_transaction:
+      return
+    self._undo_log[index] = (self[index].copy(), self._weights[index], self._min_longitudes[index],
+        self._max_longitudes[index], self.cost(index), self._models[index])
+
+  def transaction_cost_delta(self):
+    """Change of the total cost caused by the current transaction (only the changed trips are evaluated)."""
+    if self._undo_log is None:
+      raise ValueError("No transaction in progress")
+    delta = sum(self.cost(index) - saved[4] for index, saved in self._undo_log.items())
+    return delta + sum(self.cost(index) for index in range(self._trips_before_transaction, len(self)))
+
+  def commit(self):
+    """Ends the current transaction and keeps its changes."""
+    if self._undo_log is None:
+      raise ValueError("No transaction in progress")
+    self._undo_log = None
+
+  def rollback(self):
+    """Ends the current transaction and restores all trips it changed."""
+    if self._undo_log is None:
+      raise ValueError("No transaction in progress")
+    undo_log = self._undo_log
+    self._undo_log = None
+
+    # trips that were added during the transaction
+    for index in range(len(self) - 1, self._trips_before_transaction - 1, -1):
+      del self[index]
+
+    # the gifts of the changed trips may have been moved between them, so unassign them all first
+    for index in undo_log:
+      gifts = self[index]
+      self._trip_of_gift[gifts[self._trip_of_gift[gifts] == index]] = -1
+
+    for index, (trip, weight, min_longitude, max_longitude, cost, model) in undo_log.items():
+      if len(trip) > self._capacities[index]:
+        self._move_trip(index, len(trip) + self.SLACK)
+      self._order[self._offsets[index]:self._offsets[index]+len(trip)] = trip
+      self._stops[index] = len(trip)
+      self._trip_of_gift[trip] = index
+      self._weights[index] = weight
+      self._min_longitudes[index] = min_longitude
+      self._max_longitudes[index] = max_longitude
+      if self._longitude_index is not None:
+        self._longitude_index.update(index)
+      self._costs[index] = cost
+      self._models[index] = model
+
+
+class LongitudeIndex(object):
+  """Interval index over the longitude spans and weights of the trips of a solution.
+
+  The trips are sorted by their smallest longitude and a segment tree over that order keeps the largest
+  longitude and the smallest weight of every node. Trips that cover a longitude and can take a gift are
+  found by descending only into nodes that may contain such trips. Changes of a trip update the paths
+  of the tree above the leaves that moved; added or removed trips mark the index for a rebuild before
+  the next query.
+  """
+
+  def __init__(self, solution):
+    """
+    :solution: Solution whose trips to index
+    """
+    self.solution = solution
+    self.dirty = True
+
+  def _rebuild(self):
+    min_longitudes = self.solution.min_longitudes
+    order = np.argsort(min_longitudes, kind="mergesort")
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+
+    self.size = 1
+    while self.size < max(len(order), 1):
+      self.size *= 2
+    max_longitudes = np.full(2 * self.size, -np.inf)
+    min_weights = np.full(2 * self.size, np.inf)
+    max_longitudes[self.size:self.size+len(order)] = self.solution.max_longitudes[order]
+    min_weights[self.size:self.size+len(order)] = self.solution.weights[order]
+    level = self.size
+    while level > 1:
+      # parents of the nodes [level, 2*level) are [level/2, level)
+      max_longitudes[level//2:level] = np.maximum(max_longitudes[level:2*level:2], max_longitudes[level+1:2*level:2])
+      min_weights[level//2:level] = np.minimum(min_weights[level:2*level:2], min_weights[level+1:2*level:2])
+      level //= 2
+
+    # the tree is traversed node by node, which is a lot faster on lists than on Numpy arrays
+    self.max_longitudes = max_longitudes.tolist()
+    self.min_weights = min_weights.tolist()
+    self.sorted_min_longitudes = min_longitudes[order].tolist()
+    self.leaf_trips = order.tolist()
+    self.position = position.tolist()
+    self.dirty = False
+
+  def _update_parents(self, first_position, last_position):
+    first = (self.size + first_position) // 2
+    last = (self.size + last_position) // 2
+    while first >= 1:
+      for node in range(first, last+1):
+        self.max_longitudes[node] = max(self.max_longitudes[2*node], self.max_longitudes[2*node+1])
+        self.min_weights[node] = min(self.min_weights[2*node], self.min_weights[2*node+1])
+      first //= 2
+      last //= 2
+
+  def update(self, index):
+    """Updates the index after the aggregates of a trip changed.
+
+    If the smallest longitude changed, the trip is moved to its new position in the sorted order and
+    the trips in between are shifted by one, which is cheap because the spans change only a little.
+
+    :index: Index of the trip
+    """
+    if self.dirty:
+      return
+    if index >= len(self.position):
+      self.dirty = True
+      return
+
+    old_position = self.position[index]
+    min_longitude = float(self.solution.min_longitudes[index])
+    new_position = old_position
+    if self.sorted_min_longitudes[old_position] != min_longitude:
+      del self.sorted_min_longitudes[old_position]
+      del self.leaf_trips[old_position]
+      new_position = bisect.bisect_left(self.sorted_min_longitudes, min_longitude)
+      self.sorted_min_longitudes.insert(new_position, min_longitude)
+      self.leaf_trips.insert(new_position, index)
+
+    first_position = min(old_position, new_position)
+    last_position = max(old_position, new_position)
+    for position in range(first_position, last_position+1):
+      trip = self.leaf_trips[position]
+      self.position[trip] = position
+      self.max_longitudes[self.size + position] = float(self.solution.max_longitudes[trip])
+      self.min_weights[self.size + position] = float(self.solution.weights[trip])
+    self._update_parents(first_position, last_position)
+
+  def invalidate(self):
+    """Marks the index for a rebuild (e.g. after trips were added or removed)."""
+    self.dirty = True
+
+  def _collect(self, start, end, longitude, capacity):
+    """Positions in [start, end) of trips with a largest longitude above `longitude` and a weight of at most `capacity`."""
+    max_longitudes, min_weights, size = self.max_longitudes, self.min_weights, self.size
+    positions = []
+    if start >= end:
+      return positions
+    stack = [(1, 0, size)]
+    while stack:
+      node, node_start, node_end = stack.pop()
+      if node >= size:
+        positions.append(node_start)
+        continue
+      # only descend into children that overlap the range and may contain matching trips
+      middle = (node_start + node_end) // 2
+      right = 2*node + 1
+      if middle < end and max_longitudes[right] > longitude and min_weights[right] <= capacity:
+        stack.append((right, middle, node_end))
+      if middle > start and max_longitudes[right-1] > longitude and min_weights[right-1] <= capacity:
+        stack.append((right-1, node_start, middle))
+    return positions
+
+  def _first(self, start, capacity, skip):
+    """Position of the first trip from `start` on with a weight of at most `capacity` (ignoring `skip`)."""
+    min_weights, size = self.min_weights, self.size
+    stack = [(1, 0, size)]
+    while stack:
+      node, node_start, node_end = stack.pop()
+      if node >= size:
+        if self.leaf_trips[node_start] != skip:
+          return node_start
+        continue
+      middle = (node_start + node_end) // 2
+      right = 2*node + 1
+      if min_weights[right] <= capacity:
+        stack.append((right, middle, node_end))
+      if middle > start and min_weights[right-1] <= capacity:
+        stack.append((right-1, node_start, middle))
+    return None
+
+  def _largest_max_longitude(self, end, capacity, skip):
+    """Largest longitude of the trips before position `end` with a weight of at most `capacity` (ignoring `skip`)."""
+    max_longitudes, min_weights, size = self.max_longitudes, self.min_weights, self.size
+    best = -np.inf
+    stack = [(1, 0, size)] if end > 0 else []
+    while stack:
+      node, node_start, node_end = stack.pop()
+      if max_longitudes[node] <= best:
+        continue
+      if node >= size:
+        if self.leaf_trips[node_start] != skip:
+          best = max_longitudes[node]
+        continue
+      middle = (node_start + node_end) // 2
+      right = 2*node + 1
+      children = []
+      if middle < end and min_weights[right] <= capacity:
+        children.append((right, middle, node_end))
+      if min_weights[right-1] <= capacity:
+        children.append((right-1, node_start, middle))
+      # visit the child with the larger longitude first to prune the other one
+      if len(children) == 2 and max_longitudes[right] > max_longitudes[right-1]:
+        children.reverse()
+      stack.extend(children)
+    return best
+
+  def close_trips(self, longitude, weight, trip_index_to_skip=None):
+    """Finds the trips that can take a gift and whose span is closest to its longitude.
+
+    Trips whose span strictly covers the longitude are preferred. Otherwise all trips within the
+    smallest whole number of degrees (at least one) that finds any trip are returned.
+
+    :longitude: Longitude of the gift
+    :weight: Weight of the gift
+    :trip_index_to_skip: Index of a trip to ignore (e.g. the one the gift is currently in)
+
+    :returns: Sorted list of trip indexes
+    """
+    if self.dirty:
+      self._rebuild()
+    # the capacity is only used for pruning, the exact weight check is done on the results
+    longitude = float(longitude)
+    capacity = float(utils.WEIGHT_LIMIT - weight + 1e-9)
+    skip = -1 if trip_index_to_skip is None else int(trip_index_to_skip)
+    first_at_or_after = bisect.bisect_left(self.sorted_min_longitudes, longitude)
+
+    candidates = self._collect(0, first_at_or_after, longitude, capacity)
+    candidates = self._filter(candidates, weight, skip, lambda trip: self.solution.max_longitudes[trip] > longitude)
+    if len(candidates):
+      return candidates
+
+    # distance to the closest span from either side
+    distance = np.inf
+    first = self._first(first_at_or_after, capacity, skip)
+    if first is not None:
+      distance = self.sorted_min_longitudes[first] - longitude
+    distance = min(distance, longitude - self._largest_max_longitude(first_at_or_after, capacity, skip))
+    if np.isinf(distance):
+      return []
+    tolerance = max(1, np.floor(distance) + 1)
+
+    end = bisect.bisect_left(self.sorted_min_longitudes, longitude + tolerance)
+    candidates = self._collect(0, first_at_or_after, longitude - tolerance, capacity) + \
+        self._collect(first_at_or_after, end, -np.inf, capacity)
+    return self._filter(candidates, weight, skip, lambda trip: max(
+      self.solution.min_longitudes[trip] - longitude, longitude - self.solution.max_longitudes[trip]) < tolerance)
+
+  def _filter(self, positions, weight, skip, condition):
+    weights = self.solution.weights
+    trips = [self.leaf_trips[position] for position in positions]
+    return sorted(trip for trip in trips if trip != skip and weights[trip] + weight <= utils.WEIGHT_LIMIT and condition(trip))
@@ -1,17 +1,18 @@
 #!/usr/bin/env python
 
 import logging
-from functools import lru_cache
+import math
 
 import numpy as np
 import pandas as pd
+from scipy.spatial import cKDTree
 
 import coloredlogs
-from haversine import haversine
 
 NORTH_POLE = (90, 0)
 WEIGHT_LIMIT = 1000.0
 SLEIGH_WEIGHT = 10.0
+AVG_EARTH_RADIUS = 6371.0 # same radius as the haversine package
 
 GIFT = 0
 TRIP = 1
@@ -20,6 +21,11 @@ LON = 3
 WEIGHT = 4
 LOCATION = [LAT, LON]
 
+GIFTS_FILE = "data/gifts.csv"
+NORTH_POLE_ID = 0 # index of the north pole in the gift table
+
+NEAREST_GIFTS = 10 # size of the candidate list of close gifts per gift
+
 
 def get_location(gift):
   """Extracts the location of a gift as a tuple.
@@ -65,25 +71,83 @@ def log_success_or_error(log, success, message):
   log_method = log.success if success else log.error
   log_method(message)
 
-def distance(a, b):
-  """Use cache to avoid computing unnecessary haversine distances.
-  Also avoid computing symmetric distances ((a,b) and (b,a)).
+def to_unit_vectors(locations):
+  """Converts locations to points on the unit sphere.
+
+  :locations: Array-like of shape (n, 2) (or a single location) with latitude/longitude in degrees
+
+  :returns: Numpy array of shape (n, 3) (or (3,) for a single location)
+  """
+  radians = np.radians(np.asarray(locations, dtype=np.float64))
+  lat = radians[..., 0]
+  lon = radians[..., 1]
+  cos_lat = np.cos(lat)
+  return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+def unit_vector_distances(a, b):
+  """Great-circle distances between unit vectors (broadcasting like numpy).
+  The chord length between two points on the unit sphere is the square root of the haversine,
+  so this is exactly the haversine distance - just without any trigonometry on the way in.
+
+  :a: Numpy array of unit vectors with the coordinates in the last dimension
+  :b: Numpy array of unit vectors with the coordinates in the last dimension
+
+  :returns: Numpy array with the distances
+  """
+  chords = np.sqrt(np.sum(np.square(a - b), axis=-1))
+  return 2 * AVG_EARTH_RADIUS * np.arcsin(np.minimum(chords / 2, 1.0))
+
+def path_distances(locations):
+  """Calculates the distances between consecutive locations of a path.
+
+  :locations: Array-like of shape (n, 2) with the locations of the path
+
+  :returns: Numpy array of length n-1 with the length of each leg
+  """
+  points = to_unit_vectors(locations)
+  return unit_vector_distances(points[1:], points[:-1])
+
+def one_to_many_distances(location, locations):
+  """Calculates the distances from one location to many others.
+
+  :location: Single location
+  :locations: Array-like of shape (n, 2) with the other locations
+
+  :returns: Numpy array of length n with the distances
+  """
+  return unit_vector_distances(to_unit_vectors(locations), to_unit_vectors(location))
+
+def many_to_many_distances(locations_a, locations_b):
+  """Calculates the distances between all pairs of two sets of locations.
 
-  :a: First location
-  :b: Second location
+  :locations_a: Array-like of shape (n, 2)
+  :locations_b: Array-like of shape (m, 2)
 
-  :returns: Haversine distance between the locations
+  :returns: Numpy array of shape (n, m) with the distances
   """
-  aa = tuple(a)
-  bb = tuple(b)
-  return _actually_get_distance(aa, bb) if aa < bb else _actually_get_distance(bb, aa)
+  points_a = to_unit_vectors(locations_a)
+  points_b = to_unit_vectors(locations_b)
+  return unit_vector_distances(points_a[:, np.newaxis, :], points_b[np.newaxis, :, :])
 
-@lru_cache(maxsize=int(32*32*1024*2*0.05)) # should be around 0.05GB
-def _actually_get_distance(a, b):
-  return haversine(a, b)
+def trip_leg_distances(stops):
+  """Calculates the legs of a trip that starts and ends at the north pole.
 
-def get_cache_info():
-  return _actually_get_distance.cache_info()
+  :stops: Array-like of shape (n, 2) with the locations of the trip
+
+  :returns: Numpy array of length n+1 with the length of each leg
+  """
+  stops = np.asarray(stops, dtype=np.float64).reshape(-1, 2)
+  return path_distances(np.concatenate([[NORTH_POLE], stops, [NORTH_POLE]]))
+
+def remaining_weights(weights):
+  """Calculates the weight that is carried on each leg of a trip.
+
+  :weights: Numpy array with the weights of the gifts in the order of delivery
+
+  :returns: Numpy array of length n+1 with the weight carried on each leg (including the sleigh)
+  """
+  weights = np.asarray(weights, dtype=np.float64)
+  return np.append(np.cumsum(weights[::-1])[::-1], 0.0) + SLEIGH_WEIGHT
 
 def weighted_trip_length(stops, weights):
   """Calculates the cost of the trip.
@@ -93,25 +157,272 @@ def weighted_trip_length(stops, weights):
 
   :returns: The cost of the trip
   """
-  tuples = [tuple(x) for x in (stops.values if isinstance(stops, pd.DataFrame) else stops)]
-  weights = (weights.values if isinstance(weights, pd.Series) else weights).tolist()
-  if len(tuples) != len(weights):
+  stops = stops.values if isinstance(stops, pd.DataFrame) else stops
+  weights = weights.values if isinstance(weights, pd.Series) else np.asarray(weights, dtype=np.float64)
+  if len(stops) != len(weights):
     raise ValueError("Stops/weights dimension mismatch!")
 
-  # adding the last trip back to north pole, with just the sleigh weight
-  tuples.append(NORTH_POLE)
-  weights.append(SLEIGH_WEIGHT)
-
-  cost = 0.0
-  prev_stop = NORTH_POLE
-  prev_weight = sum(weights)
-  dist = 0.0
-  for location, weight in zip(tuples, weights):
-    cost += distance(location, prev_stop) * prev_weight
-    dist += distance(location, prev_stop)
-    prev_stop = location
-    prev_weight = prev_weight - weight
-  return cost
+  # the last leg back to the north pole only carries the sleigh weight
+  return np.dot(trip_leg_distances(stops), remaining_weights(weights))
+
+class GiftTable(object):
+  """Geometry and weights of all gifts as contiguous arrays, indexed by GiftId.
+
+  Index 0 isn't used by any gift and holds the north pole (without weight), which means that
+  trips can simply be padded with NORTH_POLE_ID to get their full path.
+  """
+
+  def __init__(self, gifts):
+    size = int(gifts.GiftId.max()) + 1
+    gift_ids = gifts.GiftId.values.astype(np.int64)
+
+    locations = np.zeros((size, 2))
+    locations[NORTH_POLE_ID] = NORTH_POLE
+    locations[gift_ids] = gifts[["Latitude", "Longitude"]].values
+    weights = np.zeros(size)
+    weights[gift_ids] = gifts.Weight.values
+    self._initialize(locations, weights, np.sort(gift_ids))
+
+  @classmethod
+  def from_arrays(cls, locations, weights, gift_ids):
+    """Creates a gift table from existing arrays (e.g. in shared memory) without copying them.
+
+    :locations: Numpy array of shape (n, 2) with latitude and longitude of each GiftId (row 0: north pole)
+    :weights: Numpy array with the weight of each GiftId
+    :gift_ids: Sorted Numpy array with the GiftIds of all gifts
+
+    :returns: The GiftTable
+    """
+    gift_table = cls.__new__(cls)
+    gift_table._initialize(locations, weights, gift_ids)
+    return gift_table
+
+  def _initialize(self, locations, weights, gift_ids):
+    self.locations = locations
+    self.radians = np.radians(self.locations)
+    self.unit_vectors = np.ascontiguousarray(to_unit_vectors(self.locations))
+    self.north_pole_distances = unit_vector_distances(self.unit_vectors, self.unit_vectors[NORTH_POLE_ID])
+    self.weights = weights
+
+    # plain python copy of the vectors for fast scalar lookups
+    self._vector_rows = self.unit_vectors.tolist()
+
+    # spatial index over the gifts (without the north pole), the chord distance between unit vectors
+    # is monotonic in the haversine distance so the nearest gifts are the same
+    self.gift_ids = gift_ids
+    self.tree = cKDTree(self.unit_vectors[self.gift_ids])
+    self._nearest_gifts = {}
+
+  def __len__(self):
+    return len(self.weights)
+
+  def distance(self, a, b):
+    """Calculates the distance between two gifts.
+
+    :a: GiftId of the first gift (or NORTH_POLE_ID)
+    :b: GiftId of the second gift (or NORTH_POLE_ID)
+
+    :returns: Haversine distance between the gifts
+    """
+    u = self._vector_rows[a]
+    v = self._vector_rows[b]
+    chord = math.sqrt((u[0]-v[0])**2 + (u[1]-v[1])**2 + (u[2]-v[2])**2)
+    return 2 * AVG_EARTH_RADIUS * math.asin(min(chord / 2, 1.0))
+
+  def distances(self, a, b):
+    """Calculates the distances between pairs of gifts.
+
+    :a: Numpy array with GiftIds
+    :b: Numpy array with GiftIds (same shape as a)
+
+    :returns: Numpy array with the distances between a[i] and b[i]
+    """
+    return unit_vector_distances(self.unit_vectors[a], self.unit_vectors[b])
+
+  def path_distances(self, ids):
+    """Calculates the distances between consecutive gifts of a path.
+
+    :ids: Numpy array with the GiftIds of the path
+
+    :returns: Numpy array of length n-1 with the length of each leg
+    """
+    points = self.unit_vectors[ids]
+    return unit_vector_distances(points[1:], points[:-1])
+
+  def trip_leg_distances(self, ids):
+    """Calculates the legs of a trip that starts and ends at the north pole.
+
+    :ids: Numpy array with the GiftIds of the trip
+
+    :returns: Numpy array of length n+1 with the length of each leg
+    """
+    if len(ids) == 0:
+      return np.zeros(1)
+    return np.concatenate([
+      self.north_pole_distances[ids[:1]], self.path_distances(ids), self.north_pole_distances[ids[-1:]]])
+
+  def one_to_many_distances(self, gift, ids):
+    """Calculates the distances from one gift to many others.
+
+    :gift: GiftId of the single gift
+    :ids: Numpy array with the GiftIds of the other gifts
+
+    :returns: Numpy array with the distances
+    """
+    return unit_vector_distances(self.unit_vectors[ids], self.unit_vectors[gift])
+
+  def many_to_many_distances(self, a, b):
+    """Calculates the distances between all pairs of two sets of gifts.
+
+    :a: Numpy array with n GiftIds
+    :b: Numpy array with m GiftIds
+
+    :returns: Numpy array of shape (n, m) with the distances
+    """
+    return unit_vector_distances(self.unit_vectors[a][:, np.newaxis, :], self.unit_vectors[b][np.newaxis, :, :])
+
+  def trip_cost(self, ids):
+    """Calculates the cost of a trip.
+
+    :ids: Numpy array with the GiftIds of the trip in order of delivery
+
+    :returns: The cost of the trip
+    """
+    return np.dot(self.trip_leg_distances(ids), remaining_weights(self.weights[ids]))
+
+  def nearest_gifts(self, gift, k=NEAREST_GIFTS):
+    """Finds the gifts closest to a gift.
+
+    :gift: GiftId of the gift
+    :k: Number of gifts to find
+
+    :returns: Numpy array with the GiftIds of the k closest other gifts (closest first)
+    """
+    if k in self._nearest_gifts:
+      return self._nearest_gifts[k][gift]
+    _, rows = self.tree.query(self.unit_vectors[gift], k+1)
+    ids = self.gift_ids[rows]
+    return ids[ids != gift][:k]
+
+  def candidate_gifts(self, k=NEAREST_GIFTS):
+    """Precomputes the k closest gifts of every gift (calculated once per k).
+
+    :k: Number of gifts per candidate list
+
+    :returns: Numpy array of shape (len(self), k) with the GiftIds of the closest other gifts of each gift
+    """
+    if k not in self._nearest_gifts:
+      _, rows = self.tree.query(self.unit_vectors[self.gift_ids], k+1)
+      ids = self.gift_ids[rows]
+      # the gift itself is usually (but with duplicate locations not necessarily) the first match
+      others = np.argsort(ids == self.gift_ids[:, None], axis=1, kind="mergesort")[:, :k]
+      candidates = np.zeros((len(self), k), dtype=np.int64)
+      candidates[self.gift_ids] = ids[np.arange(len(ids))[:, None], others]
+      self._nearest_gifts[k] = candidates
+    return self._nearest_gifts[k]
+
+class CapacityTree(object):
+  """Segment tree over the remaining capacity of trips that finds the first trip that can carry a
+  gift in O(log n).
+
+  Every inner node stores the maximum remaining capacity of its subtree, so the search goes down
+  to the left child whenever that one has enough capacity. Trips that weren't used yet are empty.
+  """
+
+  def __init__(self, size, capacity=WEIGHT_LIMIT):
+    """
+    :size: Maximum number of trips
+    :capacity: Capacity of an empty trip
+    """
+    self.leaves = 1
+    while self.leaves < size:
+      self.leaves *= 2
+    self.capacity = capacity
+    self.tree = [capacity] * (2 * self.leaves)
+
+  def first_fit(self, weight):
+    """Finds the first trip that can still carry a weight.
+
+    :weight: Weight to carry
+
+    :returns: Index of the trip (None if no trip can carry it)
+    """
+    tree = self.tree
+    if tree[1] < weight:
+      return None
+    node = 1
+    while node < self.leaves:
+      node *= 2
+      if tree[node] < weight:
+        node += 1
+    return node - self.leaves
+
+  def remaining(self, index):
+    """Remaining capacity of a trip."""
+    return self.tree[self.leaves + index]
+
+  def add(self, index, weight):
+    """Adds weight to a trip.
+
+    :index: Index of the trip
+    :weight: Weight to add
+    """
+    tree = self.tree
+    node = self.leaves + index
+    tree[node] -= weight
+    while node > 1:
+      node //= 2
+      capacity = max(tree[2 * node], tree[2 * node + 1])
+      if tree[node] == capacity:
+        break
+      tree[node] = capacity
+
+
+def first_fit_decreasing(weights, capacity=WEIGHT_LIMIT):
+  """Packs gifts into as few trips as possible: starting with the heaviest gift, each gift goes into
+  the first trip that can still carry it.
+
+  :weights: Numpy array with the weights of the gifts
+  :capacity: Capacity of each trip
+
+  :returns: Numpy array with the index of the trip of each gift (the trips are numbered from 0 without gaps)
+  """
+  # first fit never needs more than twice the minimum number of trips
+  trips = CapacityTree(2 * int(np.ceil(np.sum(weights) / capacity)) + 1, capacity)
+  order = np.argsort(-np.asarray(weights), kind="mergesort")
+  trip_of_gift = np.empty(len(weights), dtype=np.int64)
+  for gift, weight in zip(order.tolist(), np.asarray(weights, dtype=np.float64)[order].tolist()):
+    index = trips.first_fit(weight)
+    if index is None:
+      raise ValueError("A gift with weight {} doesn't fit into any trip".format(weight))
+    trips.add(index, weight)
+    trip_of_gift[gift] = index
+  return trip_of_gift
+
+_gift_table = None
+
+def get_gift_table():
+  """Returns the gift table, which is built from the gifts file on first use.
+
+  :returns: The GiftTable
+  """
+  global _gift_table
+  if _gift_table is None:
+    _gift_table = GiftTable(pd.read_csv(GIFTS_FILE))
+  return _gift_table
+
+def set_gift_table(gift_table):
+  global _gift_table
+  _gift_table = gift_table
+
+def get_gift_ids(trip):
+  """Extracts the GiftIds of a trip.
+
+  :trip: Numpy array with the rows of the gifts
+
+  :returns: Numpy array with the GiftIds as integers
+  """
+  return trip[:, GIFT].astype(np.int64)
 
 def verify_weights(all_trips, log):
   """Verifies that none of the trips exceeds the weight limit.
@@ -129,18 +440,79 @@ def verify_weights(all_trips, log):
       has_invalid_trip = True
   return not has_invalid_trip
 
+def get_trip_costs(gift_ids, trip_ids, gift_table=None):
+  """Calculates the cost of all trips of a solution in one vectorized pass.
+
+  The gifts are sorted by TripId once (keeping the order of delivery within each trip), all legs
+  are computed at once and the weighted legs are then reduced per trip.
+
+  :gift_ids: Numpy array with the GiftIds of all gifts in order of delivery
+  :trip_ids: Numpy array with the TripId of each gift
+  :gift_table: GiftTable to use (defaults to the global one)
+
+  :returns: Tuple with the total cost, the sorted unique TripIds and a Numpy array with the cost of each trip
+  """
+  gift_table = gift_table if gift_table is not None else get_gift_table()
+  order = np.argsort(np.asarray(trip_ids), kind="mergesort")
+  gifts = np.asarray(gift_ids, dtype=np.int64)[order]
+  trips = np.asarray(trip_ids)[order]
+  if len(gifts) == 0:
+    return 0.0, trips, np.zeros(0)
+
+  is_start = np.concatenate([[True], trips[1:] != trips[:-1]])
+  starts = np.flatnonzero(is_start)
+  ends = np.concatenate([starts[1:], [len(gifts)]])
+  trip_of_gift = np.cumsum(is_start) - 1
+
+  # leg to each gift, starting from the north pole for the first gift of every trip
+  previous = np.concatenate([[NORTH_POLE_ID], gifts[:-1]])
+  previous[starts] = NORTH_POLE_ID
+  legs = gift_table.distances(previous, gifts)
+
+  # weight carried on the leg to each gift (segmented suffix sums), including the sleigh
+  weights = gift_table.weights[gifts]
+  delivered = np.cumsum(weights) - weights
+  trip_weights = np.add.reduceat(weights, starts)
+  carried = trip_weights[trip_of_gift] - (delivered - delivered[starts][trip_of_gift]) + SLEIGH_WEIGHT
+
+  costs = np.add.reduceat(legs * carried, starts) + gift_table.north_pole_distances[gifts[ends-1]] * SLEIGH_WEIGHT
+  return costs.sum(), trips[starts], costs
+
 def weighted_reindeer_weariness(all_trips):
   """Calculates the total cost of all the trips.
 
-  :all_trips: Pandas DataFrame with all trips
+  :all_trips: Pandas DataFrame with all trips (only GiftId and TripId are used)
 
   :returns: Total cost of the trips
   """
-  cost = 0.0
-  for trip in all_trips.groupby("TripId"):
-    this_trip = trip[1]
-    cost += weighted_trip_length(this_trip[["Latitude","Longitude"]], this_trip.Weight)
-  return cost
+  return get_trip_costs(all_trips.GiftId.values, all_trips.TripId.values)[0]
+
+def read_solution(file_name):
+  """Reads the trips of a solution from a CSV file or a binary .npy file.
+
+  The binary file holds an int32 array of shape (2, n) with the GiftIds in order of delivery and the
+  TripId of each gift, which is memory-mapped instead of parsed.
+
+  :file_name: Name of the file to read
+
+  :returns: Pandas DataFrame with the columns GiftId and TripId (gifts in order of delivery)
+  """
+  if not file_name.endswith(".npy"):
+    return pd.read_csv(file_name)[["GiftId", "TripId"]]
+  gift_ids, trip_ids = np.load(file_name, mmap_mode="r")
+  return pd.DataFrame({"GiftId": gift_ids, "TripId": trip_ids})
+
+def write_solution(file_name, gift_ids, trip_ids):
+  """Writes the trips of a solution to a binary .npy file (or a CSV file for any other extension).
+
+  :file_name: Name of the file to write
+  :gift_ids: Numpy array with the GiftIds of all gifts in order of delivery
+  :trip_ids: Numpy array with the TripId of each gift
+  """
+  if not file_name.endswith(".npy"):
+    pd.DataFrame({"GiftId": gift_ids, "TripId": trip_ids}).astype(int).to_csv(file_name, index=False)
+    return
+  np.save(file_name, np.array([gift_ids, trip_ids], dtype=np.int32))
 
 def verify_costs_are_equal(a, b):
   """Checks that the two costs are (roughly) equal
@@ -154,7 +526,7 @@ def verify_costs_are_equal(a, b):
     raise ValueError("Cost mismatch!")
 
 def get_index_of_inefficient_trip(trips):
-  inefficiencies = [weighted_trip_length(trip[:, LOCATION], trip[:, WEIGHT]) / trip[:, WEIGHT].sum() for trip in trips]
+  inefficiencies = trips.costs / trips.weights
   sorted_inefficiencies = np.sort(inefficiencies)
   worst_inefficiencies = sorted_inefficiencies[int(len(trips)*2.0/3):]
 
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+import multiprocessing
+import pickle
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import utils
+from neighbor import Neighbor
+from solution import Solution
+
+
+class SharedArrays(object):
+  """Numpy arrays copied into named shared memory blocks, so that other processes can map them
+  instead of receiving a pickled copy.
+  """
+
+  def __init__(self, arrays):
+    """
+    :arrays: Dict with the Numpy arrays to share
+    """
+    self.blocks = {}
+    self.specs = {} # name of each array -> (name of the block, shape, dtype)
+    for name, array in arrays.items():
+      array = np.ascontiguousarray(array)
+      block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+      np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+      self.blocks[name] = block
+      self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+  def close(self):
+    for block in self.blocks.values():
+      block.close()
+      block.unlink()
+    self.blocks = {}
+
+
+def attach_shared_arrays(specs):
+  """Maps arrays that were shared by another process.
+
+  :specs: The specs of the SharedArrays
+
+  :returns: Tuple with a dict of the Numpy arrays and the list of blocks, which has to be kept open while
+  the arrays are used
+  """
+  arrays = {}
+  blocks = []
+  for name, (block_name, shape, dtype) in specs.items():
+    block = shared_memory.SharedMemory(name=block_name)
+    arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    blocks.append(block)
+  return arrays, blocks
+
+
+def _work(connection, gift_specs, solution_specs, random_seed, log, verify_cost_delta):
+  """Main loop of a worker: evaluates neighbors on a replica of the solution and applies committed moves."""
+  gift_arrays, gift_blocks = attach_shared_arrays(gift_specs)
+  utils.set_gift_table(utils.GiftTable.from_arrays(gift_arrays["locations"], gift_arrays["weights"], gift_arrays["gift_ids"]))
+
+  solution_arrays, solution_blocks = attach_shared_arrays(solution_specs)
+  stops = solution_arrays["stops"]
+  trips = Solution(np.split(solution_arrays["gifts"].copy(), np.cumsum(stops)[:-1]), solution_arrays["trip_ids"].copy())
+  del solution_arrays
+  for block in solution_blocks:
+    block.close()
+
+  Neighbor.log = log
+  Neighbor.VERIFY_COST_DELTA = verify_cost_delta
+  np.random.seed(random_seed)
+  connection.send_bytes(pickle.dumps(("ready", None)))
+
+  while True:
+    command, neighbor = pickle.loads(connection.recv_bytes())
+    if command == "stop":
+      break
+
+    try:
+      neighbor.attach(trips)
+      if command == "evaluate":
+        neighbor.cost_delta()
+        connection.send_bytes(pickle.dumps(("ok", neighbor)))
+      elif command == "apply":
+        neighbor.apply()
+    except Exception:
+      connection.send_bytes(pickle.dumps(("error", traceback.format_exc())))
+      break
+
+  for block in gift_blocks:
+    block.close()
+
+
+class WorkerPool(object):
+  """Processes that evaluate neighbors on their own replica of the solution.
+
+  The gift table is placed in shared memory and mapped by all workers, the solution is shared once to
+  build the replicas. Afterwards, only neighbors (which describe a move in a few numbers) are sent:
+  neighbors to evaluate go to one worker each and come back with their cost and chosen move, applied
+  neighbors are broadcast to all workers in the order they were committed, which keeps the replicas in
+  sync with the solution of the main process.
+
+  Without workers, neighbors are evaluated in the main process.
+  """
+
+  def __init__(self, trips, size, random_seed=None):
+    """
+    :trips: The Solution to replicate (must not be changed without calling `apply`)
+    :size: Number of worker processes
+    :random_seed: Seed of the first worker (the others get the following seeds)
+    """
+    self.size = size
+    self.connections = []
+    self.processes = []
+    self.gift_arrays = None
+    if size == 0:
+      return
+
+    gift_table = utils.get_gift_table()
+    self.gift_arrays = SharedArrays({
+      "locations": gift_table.locations, "weights": gift_table.weights, "gift_ids": gift_table.gift_ids})
+    solution_arrays = SharedArrays({
+      "gifts": np.concatenate(list(trips)) if len(trips) else np.zeros(0, dtype=np.int32),
+      "stops": trips.stops, "trip_ids": trips.trip_ids})
+
+    random_seed = random_seed if random_seed is not None else np.random.randint(2**31 - size)
+    for i in range(size):
+      connection, worker_connection = multiprocessing.Pipe()
+      process = multiprocessing.Process(target=_work, daemon=True, args=(worker_connection, self.gift_arrays.specs,
+        solution_arrays.specs, random_seed + i, Neighbor.log, Neighbor.VERIFY_COST_DELTA))
+      process.start()
+      worker_connection.close()
+      self.connections.append(connection)
+      self.processes.append(process)
+
+    # the replicas are complete once all workers are ready
+    for connection in self.connections:
+      self._receive(connection)
+    solution_arrays.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    self.close()
+
+  def _receive(self, connection):
+    status, result = pickle.loads(connection.recv_bytes())
+    if status == "error":
+      raise RuntimeError("Worker failed:\n{}".format(result))
+    return result
+
+  def evaluate(self, neighbors):
+    """Calculates the cost of several neighbors in parallel.
+    The neighbors are updated with the moves the workers chose, so their costs aren't calculated again.
+
+    :neighbors: List of neighbors of the current solution
+
+    :returns: List with the cost delta of each neighbor
+    """
+    if self.size == 0:
+      return [neighbor.cost_delta() for neighbor in neighbors]
+
+    for i, neighbor in enumerate(neighbors):
+      self.connections[i % self.size].send_bytes(pickle.dumps(("evaluate", neighbor)))
+    for i, neighbor in enumerate(neighbors):
+      evaluated = self._receive(self.connections[i % self.size])
+      neighbor.__dict__.update(evaluated.__dict__)
+    return [neighbor.cost_delta() for neighbor in neighbors]
+
+  def apply(self, neighbor):
+    """Broadcasts a neighbor that was applied to the solution to all replicas.
+
+    :neighbor: The applied neighbor
+    """
+    message = pickle.dumps(("apply", neighbor))
+    for connection in self.connections:
+      connection.send_bytes(message)
+
+  def close(self):
+    for connection in self.connections:
+      connection.send_bytes(pickle.dumps(("stop", None)))
+    for process in self.processes:
+      process.join()
+    self.connections = []
+    self.processes = []
+    if self.gift_arrays is not None:
+      self.gift_arrays.close()
+      self.gift_arrays = None
+
+
+_trip_worker_blocks = None # the gift table of a trip worker is mapped from these blocks
+
+def _initialize_trip_worker(gift_specs, log, verify_cost_delta):
+  global _trip_worker_blocks
+  gift_arrays, _trip_worker_blocks = attach_shared_arrays(gift_specs)
+  utils.set_gift_table(utils.GiftTable.from_arrays(gift_arrays["locations"], gift_arrays["weights"], gift_arrays["gift_ids"]))
+  Neighbor.log = log
+  Neighbor.VERIFY_COST_DELTA = verify_cost_delta
+
+def _optimize_trip(arguments):
+  index, trip, random_seed, optimize = arguments
+  np.random.seed(random_seed)
+  return index, optimize(trip)
+
+
+def optimize_trips(trips, optimize, processes=None, random_seed=None, log=None):
+  """Optimizes trips independently of each other in a pool of processes.
+
+  The longest trips are started first, so no process is left with a long trip when the others are done.
+  Each trip gets its own random seed (derived from its index), so the results don't depend on the
+  number of processes or on the order in which the trips are finished.
+
+  :trips: List of trips (e.g. Numpy arrays with GiftIds)
+  :optimize: Module-level function that optimizes a single trip and returns the result
+  :processes: Number of processes (defaults to the number of cores, with 1 the trips are optimized in the main process)
+  :random_seed: Seed of the first trip (the others get the following seeds)
+  :log: Logger for the progress
+
+  :returns: List with the result of each trip
+  """
+  processes = processes if processes is not None else multiprocessing.cpu_count()
+  random_seed = random_seed if random_seed is not None else np.random.randint(2**31 - len(trips))
+  order = np.argsort([-len(trip) for trip in trips], kind="mergesort")
+  jobs = [(int(i), trips[i], random_seed + int(i), optimize) for i in order]
+  results = [None] * len(trips)
+
+  def log_progress(done):
+    if log is not None and done % 100 == 0:
+      log.info("Optimized {:>6}/{} trips".format(done, len(trips)))
+
+  if processes <= 1:
+    for done, job in enumerate(jobs, 1):
+      index, result = _optimize_trip(job)
+      results[index] = result
+      log_progress(done)
+    return results
+
+  gift_table = utils.get_gift_table()
+  gift_arrays = SharedArrays({
+    "locations": gift_table.locations, "weights": gift_table.weights, "gift_ids": gift_table.gift_ids})
+  try:
+    with multiprocessing.Pool(processes, _initialize_trip_worker,
+        (gift_arrays.specs, Neighbor.log, Neighbor.VERIFY_COST_DELTA)) as pool:
+      # small chunks keep the overhead low, but still let the processes share the last trips
+      chunk_size = max(1, len(jobs) // (32 * processes))
+      for done, (index, result) in enumerate(pool.imap_unordered(_optimize_trip, jobs, chunk_size), 1):
+        results[index] = result
+        log_progress(done)
+  finally:
+    gift_arrays.close()
+  return results